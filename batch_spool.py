@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Batch spool job builder
+Collects the triplicate pages of every invoice in a range into one
+(or a few chunked) PDF documents so the whole batch goes to the
+printer as a single spool job instead of one job per invoice.
+With a 2-up layout the pages are packed two to a sheet, straight across
+invoice boundaries, so a one-page invoice doesn't waste half a sheet.
+Logos, fonts and forms that every invoice carries are written once per
+chunk (see resource_dedup).
+In streaming mode each chunk is written and handed on as soon as it is
+full, and its pages (and the source PDFs behind them) are let go, so
+memory stays flat however many invoices the batch has
+"""
+
+import gc
+import io
+import time
+from pypdf import PdfWriter
+from pypdf.generic import StreamObject
+from resource_dedup import ResourceDeduplicator
+
+DEFAULT_CHUNK_PAGES = 500
+
+
+class SpoolEntry:
+    """
+    Where one invoice's pages ended up in the batch job
+    """
+
+    def __init__(self, name, chunk, first_page, last_page, unit="page"):
+        self.name = name
+        self.chunk = chunk  # 1-based chunk (spool job) number
+        self.first_page = first_page  # 1-based page (or sheet) numbers inside the chunk
+        self.last_page = last_page
+        self.unit = unit  # "sheet" when pages are imposed several to a sheet
+
+    @property
+    def page_count(self):
+        return self.last_page - self.first_page + 1
+
+    def describe(self, chunk_count=1):
+        if self.first_page == self.last_page:
+            pages = f"{self.unit} {self.first_page}"
+        else:
+            pages = f"{self.unit}s {self.first_page}-{self.last_page}"
+        if chunk_count > 1:
+            return f"job {self.chunk}, {pages}"
+        return pages
+
+
+class BatchSpoolJob:
+    """
+    Merge the pages of many invoices, in the order they are added,
+    into as few output documents as possible
+    - An invoice's pages are never split across two chunks
+    - A new chunk is started once max_pages_per_chunk would be exceeded,
+      or once the chunk has reached about max_bytes_per_chunk
+    - With a layout (see imposition.TwoUpLayout) the output pages are
+      sheets: the page counts and entries count sheets, and an invoice
+      may share its first and last sheet with its neighbours
+    - With dedup, identical images, fonts and forms are shared within a chunk
+    - With an optimizer (spool_optimize.SpoolOptimizer), every chunk is
+      optimised just before it is written
+    - With on_chunk (streaming), every chunk is written as soon as it is
+      full and passed to on_chunk(chunk number, PDF bytes); call finish()
+      after the last invoice. chunk_data() is then unavailable
+    """
+
+    def __init__(self, max_pages_per_chunk=DEFAULT_CHUNK_PAGES, layout=None, dedup=True, optimizer=None, max_bytes_per_chunk=None,
+                 on_chunk=None):
+        if max_pages_per_chunk < 1:
+            raise ValueError("max_pages_per_chunk must be at least 1")
+        if max_bytes_per_chunk is not None and max_bytes_per_chunk < 1:
+            raise ValueError("max_bytes_per_chunk must be at least 1")
+        self.max_pages_per_chunk = max_pages_per_chunk
+        self.max_bytes_per_chunk = max_bytes_per_chunk
+        self.on_chunk = on_chunk
+        self.layout = layout
+        self.dedup = dedup
+        self.optimizer = optimizer
+        self.optimized = {}  # optimizer counts, summed over the chunks
+        self.optimize_seconds = 0.0
+        self.write_seconds = 0.0  # writing streamed chunks, optimising included
+        self.bytes_out = 0  # PDF bytes of the chunks written so far
+        self.chunks = []  # PdfWriter per chunk; None once a streamed chunk is handed on
+        self.chunk_open = False  # whether the last chunk still takes pages
+        self.chunk_bytes = 0  # estimated size of the last chunk
+        self._sized = 0  # writer objects counted in chunk_bytes
+        self.dedups = []  # ResourceDeduplicator per chunk, with dedup
+        self.chunk_pages = []  # page (sheet) count per chunk
+        self.entries = []
+        self.invoice_pages = 0  # pages added, before imposition
+        self.open_sheet = None  # the last sheet while it still has free slots
+        self.next_slot = 0
+
+    @property
+    def total_pages(self):
+        return sum(self.chunk_pages)
+
+    @property
+    def shared_resources(self):
+        """
+        Resources written once instead of once per invoice
+        """
+        return sum(dedup.duplicates for dedup in self.dedups)
+
+    @property
+    def bytes_saved(self):
+        return sum(dedup.bytes_saved for dedup in self.dedups)
+
+    def _add_page(self, page):
+        if self.dedup:
+            self.dedups[-1].add_page(page)
+        else:
+            self.chunks[-1].add_page(page)
+
+    def describe_size(self):
+        """
+        "12 page(s)", or "23 page(s) on 12 sheet(s)" when imposed
+        """
+        if self.layout is None:
+            return f"{self.total_pages} page(s)"
+        return f"{self.invoice_pages} page(s) on {self.total_pages} sheet(s)"
+
+    def _free_slots(self):
+        return self.layout.slots - self.next_slot if self.open_sheet is not None else 0
+
+    def _output_pages_for(self, page_count):
+        if self.layout is None:
+            return page_count
+        return self.layout.sheets_for(page_count, self._free_slots())
+
+    def _place(self, page):
+        if self.open_sheet is None:
+            self.open_sheet = self.layout.new_sheet()
+            self.next_slot = 0
+            self.chunk_pages[-1] += 1
+        self.layout.place(self.open_sheet, page, self.next_slot)
+        self.next_slot += 1
+        if self.next_slot == self.layout.slots:
+            self._close_sheet()
+
+    def _finish(self):
+        """
+        Complete the last sheet and optimise the chunks, once, before writing
+        """
+        if self.on_chunk:
+            raise ValueError("A streamed job hands its chunks to on_chunk; call finish()")
+        self._close_sheet()
+        self.chunk_open = False
+        if self.optimizer and not self.optimized:
+            for writer in self.chunks:
+                self._optimize(writer)
+
+    def _optimize(self, writer):
+        start = time.perf_counter()
+        for name, count in self.optimizer.optimize(writer).items():
+            self.optimized[name] = self.optimized.get(name, 0) + count
+        self.optimize_seconds += time.perf_counter() - start
+
+    def _serialize(self, writer):
+        buffer = io.BytesIO()
+        writer.write(buffer)
+        self.bytes_out += buffer.tell()
+        return buffer.getvalue()
+
+    def _measure(self):
+        """
+        Add the stream data of objects new in the last chunk's writer to
+        chunk_bytes: the bulk of what the chunk will take once written
+        """
+        objects = getattr(self.chunks[-1], "_objects", None)
+        if objects is None:
+            return
+        for obj in objects[self._sized:]:
+            if isinstance(obj, StreamObject):
+                self.chunk_bytes += len(obj._data)
+        self._sized = len(objects)
+
+    def _chunk_full(self):
+        if self.chunk_pages[-1] >= self.max_pages_per_chunk:
+            return True
+        return self.max_bytes_per_chunk is not None and self.chunk_bytes >= self.max_bytes_per_chunk
+
+    def _close_chunk(self):
+        """
+        No more pages go into the last chunk. Streaming, it is written,
+        passed to on_chunk and released
+        """
+        self._close_sheet()
+        self.chunk_open = False
+        if not self.on_chunk:
+            return
+        start = time.perf_counter()
+        writer = self.chunks[-1]
+        if self.optimizer:
+            self._optimize(writer)
+        data = self._serialize(writer)
+        # Drops the pages and, with them, the source PDFs they came from
+        self.chunks[-1] = writer = None
+        if self.dedup:
+            self.dedups[-1].release()
+        # Pages and readers refer to each other: only the cycle collector frees them
+        gc.collect()
+        self.write_seconds += time.perf_counter() - start
+        self.on_chunk(len(self.chunks), data)
+
+    def finish(self):
+        """
+        Streaming: write and hand on the last chunk. Does nothing otherwise
+        """
+        if self.on_chunk and self.chunk_open:
+            self._close_chunk()
+
+    def _close_sheet(self):
+        if self.open_sheet is not None:
+            self._add_page(self.layout.finish(self.open_sheet))
+            self.open_sheet = None
+
+    def add_invoice(self, name, pages):
+        """
+        Append one invoice's pages and record the page range they occupy
+        """
+        pages = list(pages)
+        if not pages:
+            raise ValueError(f"No pages to add for {name}")
+
+        # An oversized invoice still gets a chunk of its own
+        if self.chunk_open and self.chunk_pages[-1] + self._output_pages_for(len(pages)) > self.max_pages_per_chunk:
+            self._close_chunk()
+        if not self.chunk_open:
+            self.chunks.append(PdfWriter())
+            self.chunk_pages.append(0)
+            self.chunk_open = True
+            self.chunk_bytes = 0
+            self._sized = 0
+            if self.dedup:
+                self.dedups.append(ResourceDeduplicator(self.chunks[-1]))
+
+        # Starts on the half-filled sheet of the previous invoice, if any
+        first_page = self.chunk_pages[-1] + (0 if self.open_sheet is not None else 1)
+        if self.layout is None:
+            for page in pages:
+                self._add_page(page)
+            self.chunk_pages[-1] += len(pages)
+        else:
+            for page in pages:
+                self._place(page)
+        self.invoice_pages += len(pages)
+
+        entry = SpoolEntry(name, len(self.chunks), first_page, self.chunk_pages[-1],
+                           "page" if self.layout is None else "sheet")
+        self.entries.append(entry)
+        self._measure()
+        if self._chunk_full():
+            self._close_chunk()
+        return entry
+
+    def chunk_data(self):
+        """
+        Every chunk as PDF bytes, in order, without touching the disk
+        """
+        self._finish()
+        return [self._serialize(writer) for writer in self.chunks]
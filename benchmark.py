@@ -0,0 +1,833 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark
+Generates a synthetic invoice folder and times the print pipeline
+against a stub spooler, so nothing reaches a real printer:
+- stages:    discovery, parse, select, transform, write and submit,
+             timed one by one in a single process
+- cli / gui: the real InvoicePrinterCLI and GUI print paths, per
+             invoice and as a single batch job
+- memory:    Python heap (tracemalloc) while one batch job prints
+             through the print engine, streamed chunk by chunk or kept
+             whole; fails when the streamed job's memory grows with the
+             number of invoices
+- startup:   time from launch to the GUI's first window, for the
+             script and the built executable (dist/, or --exe), against
+             --startup-budget; fails as well when importing the GUI
+             loads pypdf
+With --ipp the jobs go to a stub IPP server instead of the stub lp,
+over the IPP backend's kept-alive connection
+Every scenario runs in its own process so its peak RSS is its own.
+Results are written as JSON; pass an earlier results file with
+--compare to see the change in throughput between two commits
+
+    python benchmark.py --invoices 500 --workers 4 --output bench.json
+    python benchmark.py --invoices 500 --workers 4 --compare bench.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue
+
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+PREFIX = "C"
+RENDER_CACHE_FOLDER = ".render_cache"
+LOGO_SEED = 0  # the shared logo is the same image in every corpus
+
+# The skip rules of the GUI
+MAX_PAGES = 11
+MAX_TRIPLICATE = 3
+
+PAGE_SIZES = {
+    "a4": (595.28, 841.89),
+    "letter": (612.0, 792.0),
+    "legal": (612.0, 1008.0),
+    "a5": (419.53, 595.28),
+}
+
+# pages:weight - mostly printable invoices, some short ones and some too long
+DEFAULT_PAGE_MIX = "1:5,2:5,3:20,4:15,5:10,6:10,8:10,9:5,11:5,12:10,20:5"
+
+SCENARIOS = ["stages", "cli", "cli-batch", "gui", "gui-batch", "memory", "startup"]
+
+# The streamed heap in the second half of the jobs may exceed the first half's by this factor (plus MEMORY_SLACK_KB)
+MEMORY_GROWTH = 1.5
+MEMORY_SLACK_KB = 2048
+
+STARTUP_BUDGET = 2.0  # seconds from launch to the first window
+STARTUP_RUNS = 3  # launches per target; the median counts
+STARTUP_TIMEOUT = 60
+
+# Where build_exe.py leaves the executable: one-directory build first
+BUILT_EXECUTABLES = [os.path.join("dist", "InvoicePrinter", "InvoicePrinter"), os.path.join("dist", "InvoicePrinter")]
+
+# Shell stubs start about as fast as the real (compiled) lp does
+STUB_LP = """#!/bin/sh
+case "$*" in *.pdf) ;; *) cat > /dev/null ;; esac
+sleep {latency}
+echo "request id is stub-$$ (1 file(s))"
+"""
+
+# Every job has left the queue by the time anyone asks
+STUB_LPSTAT = """#!/bin/sh
+exit 0
+"""
+
+
+def parse_page_mix(spec):
+    """
+    "3:20,6:10" → ([3, 6], [20, 10])
+    """
+    counts, weights = [], []
+    for item in spec.split(","):
+        pages, _, weight = item.partition(":")
+        counts.append(int(pages))
+        weights.append(float(weight or 1))
+    return counts, weights
+
+
+def _image_xobject(writer, size, rng):
+    from pypdf.generic import DecodedStreamObject, NameObject, NumberObject
+
+    # Noise doesn't compress, like a scanned logo or signature
+    image = DecodedStreamObject()
+    image.set_data(zlib.compress(rng.randbytes(size * size * 3) if hasattr(rng, "randbytes")
+                                 else os.urandom(size * size * 3)))
+    image.update({
+        NameObject("/Type"): NameObject("/XObject"),
+        NameObject("/Subtype"): NameObject("/Image"),
+        NameObject("/Width"): NumberObject(size),
+        NameObject("/Height"): NumberObject(size),
+        NameObject("/ColorSpace"): NameObject("/DeviceRGB"),
+        NameObject("/BitsPerComponent"): NumberObject(8),
+        NameObject("/Filter"): NameObject("/FlateDecode"),
+    })
+    return writer._add_object(image)
+
+
+def make_invoice(path, page_count, page_size, image_size=0, rng=None, logo_size=0):
+    """
+    Write one synthetic invoice: a line of text per page and, with
+    image_size, the same embedded image on every page. With logo_size,
+    every page also shows a logo that is identical in every invoice
+    """
+    from pypdf import PdfWriter
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    rng = rng or random.Random()
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    image = _image_xobject(writer, image_size, rng) if image_size else None
+    logo = _image_xobject(writer, logo_size, random.Random(LOGO_SEED)) if logo_size else None
+
+    width, height = page_size
+    name = os.path.basename(path)
+    for number in range(1, page_count + 1):
+        page = writer.add_blank_page(width=width, height=height)
+        resources = DictionaryObject({NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})})
+        content = f"BT /F1 18 Tf 50 {height - 80:.0f} Td ({name} page {number} of {page_count}) Tj ET"
+        for line in range(20):
+            content += f"\nBT /F1 10 Tf 50 {height - 140 - 14 * line:.0f} Td (Item {line + 1} ...... {rng.randint(1, 9999)}.00) Tj ET"
+        xobjects = DictionaryObject()
+        if image:
+            xobjects[NameObject("/Im1")] = image
+            content += f"\nq 120 0 0 120 {width - 170:.0f} {height - 170:.0f} cm /Im1 Do Q"
+        if logo:
+            xobjects[NameObject("/Logo")] = logo
+            content += f"\nq 80 0 0 40 50 {height - 60:.0f} cm /Logo Do Q"
+        if xobjects:
+            resources[NameObject("/XObject")] = xobjects
+        page[NameObject("/Resources")] = resources
+        stream = DecodedStreamObject()
+        stream.set_data(content.encode())
+        page[NameObject("/Contents")] = writer._add_object(stream)
+
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def generate_corpus(folder, invoices, page_mix=DEFAULT_PAGE_MIX, page_sizes=("a4",),
+                    image_ratio=0.0, image_size=300, missing_ratio=0.0, seed=1, logo_size=0):
+    """
+    Fill folder with {PREFIX}1.pdf ... {PREFIX}<invoices>.pdf
+    - page_mix: "pages:weight,..." distribution of page counts
+    - page_sizes: names from PAGE_SIZES, picked at random per invoice
+    - image_ratio: share of invoices with an embedded image
+    - missing_ratio: share of numbers left out, to exercise gap reporting
+    - logo_size: size in pixels of a logo shared by every invoice, 0 for none
+    Returns the number of files written
+    """
+    rng = random.Random(seed)
+    counts, weights = parse_page_mix(page_mix)
+    os.makedirs(folder, exist_ok=True)
+    written = 0
+    for number in range(1, invoices + 1):
+        if rng.random() < missing_ratio:
+            continue
+        page_count = rng.choices(counts, weights)[0]
+        page_size = PAGE_SIZES[rng.choice(list(page_sizes))]
+        with_image = image_size if rng.random() < image_ratio else 0
+        make_invoice(os.path.join(folder, f"{PREFIX}{number}.pdf"), page_count, page_size, with_image, rng,
+                     logo_size)
+        written += 1
+    return written
+
+
+def install_stub_spooler(folder, latency=0.0):
+    """
+    Put stub lp/lpstat commands first on PATH. lp swallows the PDF and
+    reports a job ID after latency seconds; lpstat lists no jobs
+    """
+    for name, template in (("lp", STUB_LP), ("lpstat", STUB_LPSTAT)):
+        path = os.path.join(folder, name)
+        with open(path, "w") as f:
+            f.write(template.format(latency=latency))
+        os.chmod(path, 0o755)
+    os.environ["PATH"] = folder + os.pathsep + os.environ.get("PATH", "")
+    return folder
+
+
+class _IppStubHandler(BaseHTTPRequestHandler):
+    """
+    Print-Job swallows the PDF after the server's latency, Get-Job-Attributes
+    reports every job completed, CUPS-Get-Default names the printer "stub"
+    """
+    protocol_version = "HTTP/1.1"  # kept alive, like CUPS
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        from ipp_client import (CHARSET, CUPS_GET_DEFAULT, ENUM, GET_JOB_ATTRIBUTES, INTEGER, JOB_ATTRIBUTES,
+                                JOB_COMPLETED, JOB_PENDING, NAME, NATURAL_LANGUAGE, OPERATION_ATTRIBUTES,
+                                PRINT_JOB, PRINTER_ATTRIBUTES, decode_message, encode_message)
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        operation, request_id, groups, data = decode_message(body)
+        status = 0x0000
+        reply = [(OPERATION_ATTRIBUTES, [(CHARSET, "attributes-charset", "utf-8"),
+                                         (NATURAL_LANGUAGE, "attributes-natural-language", "en")])]
+        if operation == PRINT_JOB:
+            time.sleep(self.server.latency)
+            with self.server.lock:
+                self.server.jobs += 1
+                self.server.bytes += len(data)
+                job_id = self.server.jobs
+            reply.append((JOB_ATTRIBUTES, [(INTEGER, "job-id", job_id), (ENUM, "job-state", JOB_PENDING)]))
+        elif operation == GET_JOB_ATTRIBUTES:
+            reply.append((JOB_ATTRIBUTES, [(ENUM, "job-state", JOB_COMPLETED)]))
+        elif operation == CUPS_GET_DEFAULT:
+            reply.append((PRINTER_ATTRIBUTES, [(NAME, "printer-name", "stub")]))
+        else:
+            status = 0x0501  # server-error-operation-not-supported
+        with self.server.lock:
+            self.server.requests += 1
+        payload = encode_message(status, request_id, reply)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/ipp")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_ipp_stub(latency=0.0):
+    """
+    Serve a stub IPP printer on a free port of 127.0.0.1 and point
+    CUPS_SERVER at it. Counts the jobs, requests and connections it saw
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _IppStubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.lock = threading.Lock()
+    server.jobs = server.requests = server.connections = server.bytes = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["CUPS_SERVER"] = f"127.0.0.1:{server.server_address[1]}"
+    return server
+
+
+def peak_rss_kb():
+    """
+    Peak resident set size of this process and of its finished
+    children (the worker pool), in KiB; None where it can't be read
+    """
+    if resource is None:
+        try:
+            import psutil
+        except ImportError:
+            return None, None
+        return psutil.Process().memory_info().peak_wset // 1024, None
+    # ru_maxrss is in bytes on macOS, KiB elsewhere
+    scale = 1024 if platform.system() == "Darwin" else 1
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale
+    return own, children
+
+
+class StageTimer:
+    """
+    Accumulated wall time per named stage
+    """
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+
+def run_stages(folder, invoices, options):
+    """
+    The per-invoice pipeline, one stage at a time, in this process
+    """
+    from pypdf import PdfReader, PdfWriter
+    from invoice_index import InvoiceIndex
+    from page_cache import skip_reason
+    from page_fit import fit_page
+    from page_sizes import A5_SIZE
+    from parallel_render import triplicate_count
+    from ipp_client import connect_ipp
+    from pdf_probe import probe_page_count
+    from spooler import PrintQueue
+
+    timer = StageTimer()
+    with timer.stage("discovery"):
+        files, missing = InvoiceIndex(folder).find(PREFIX, 1, invoices)
+
+    queue = PrintQueue(print_file=lambda path: None, max_queue_depth=options.queue_depth, ipp=connect_ipp())
+    printed = skipped = errors = 0
+    bytes_out = 0
+    for path in files:
+        try:
+            with timer.stage("parse"):
+                total_pages = probe_page_count(path)
+                reader = None
+                if total_pages is None or not skip_reason(total_pages, MAX_PAGES):
+                    reader = PdfReader(path)
+                    total_pages = len(reader.pages)
+                    mediaboxes = [(float(page.mediabox.width), float(page.mediabox.height))
+                                  for page in reader.pages]
+            with timer.stage("select"):
+                if skip_reason(total_pages, MAX_PAGES):
+                    skipped += 1
+                    continue
+                count = triplicate_count(total_pages, MAX_TRIPLICATE)
+                pages = [reader.pages[i] for i in range(total_pages - count, total_pages)]
+            with timer.stage("transform"):
+                pages = [fit_page(page, *A5_SIZE) for page in pages]
+            with timer.stage("write"):
+                writer = PdfWriter()
+                for page in pages:
+                    writer.add_page(page)
+                buffer = io.BytesIO()
+                writer.write(buffer)
+                data = buffer.getvalue()
+                bytes_out += len(data)
+            with timer.stage("submit"):
+                queue.submit_data(data, os.path.basename(path))
+            printed += 1
+        except Exception:
+            errors += 1
+    with timer.stage("submit"):
+        queue.wait_all()
+    queue.close()
+
+    return {
+        "invoices": len(files),
+        "printed": printed,
+        "skips": skipped,
+        "errors": errors,
+        "bytes_out": bytes_out,
+        "stages": {name: round(seconds, 4) for name, seconds in timer.seconds.items()},
+    }
+
+
+def _batch_heap(files, options, stream):
+    """
+    Python heap (KB, tracemalloc) while files print as one batch job
+    through PrintEngine.print_batch, the path both front ends take: in
+    use whenever a chunk is sent, and the peak
+    """
+    import tracemalloc
+    from invoice_engine import PrintEngine, PrintRules, RunReport
+    from metrics import RunMetrics
+    from page_sizes import A5_SIZE
+
+    heap = []
+
+    class HeapReport(RunReport):
+        def chunk_sent(self, chunk, print_job):
+            heap.append(tracemalloc.get_traced_memory()[0] // 1024)
+
+    metrics = RunMetrics()
+    engine = PrintEngine(PrintRules(MAX_PAGES, MAX_TRIPLICATE, A5_SIZE), render_cache_size=_render_cache_size(options),
+                         metrics=metrics, log=lambda message: None)
+    queue = engine.open_queue(options.queue_depth)
+    tracemalloc.start()
+    try:
+        engine.print_batch(files, queue, HeapReport(),
+                           spool_options={"max_pages_per_chunk": options.chunk_pages, "stream": stream})
+        peak = tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+        engine.wait_for_queue(queue)
+        queue.close()
+    return {"heap_kb": heap, "peak_kb": peak, "jobs": len(heap), "bytes_out": metrics.bytes_written}
+
+
+def run_memory(folder, invoices, options):
+    """
+    The same batch job streamed and kept whole. Streamed, the heap as
+    the last chunks are handed on must stay within MEMORY_GROWTH of the
+    heap at the first ones
+    """
+    from invoice_index import InvoiceIndex
+
+    files, missing = InvoiceIndex(folder).find(PREFIX, 1, invoices)
+    files = [str(path) for path in files]
+    streamed = _batch_heap(files, options, stream=True)
+    whole = _batch_heap(files, options, stream=False)
+    record = {"invoices": len(files), "streamed": streamed, "whole": whole}
+    heap = streamed["heap_kb"]
+    if len(heap) < 4:
+        record["not_run"] = f"Only {len(heap)} streamed job(s); use more --invoices or fewer --chunk-pages"
+        return record
+    half = len(heap) // 2
+    first, last = max(heap[:half]), max(heap[half:])
+    record["memory_bounded"] = last <= first * MEMORY_GROWTH + MEMORY_SLACK_KB
+    if not record["memory_bounded"]:
+        record["error"] = f"Streamed batch heap grew from {first} KB to {last} KB"
+    return record
+
+
+def _gui_import():
+    """
+    Seconds to import the GUI module in a fresh interpreter, and whether that loaded pypdf
+    """
+    code = ("import sys, time; start = time.perf_counter(); import invoice_printer; "
+            "print(time.perf_counter() - start, 'pypdf' in sys.modules)")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)), timeout=STARTUP_TIMEOUT)
+    if result.returncode != 0:
+        raise RuntimeError((result.stderr.strip().splitlines() or ["GUI import failed"])[-1])
+    seconds, pypdf = result.stdout.split()
+    return float(seconds), pypdf == "True"
+
+
+def _first_window(command):
+    """
+    Seconds from launching command to the GUI's first window, or (None, why it didn't show)
+    """
+    from invoice_printer import STARTUP_PROBE_ENV
+
+    fd, probe = tempfile.mkstemp(prefix="invoice_startup_")
+    os.close(fd)
+    os.remove(probe)
+    try:
+        start = time.time()
+        result = subprocess.run(command, capture_output=True, text=True, timeout=STARTUP_TIMEOUT,
+                                env=dict(os.environ, **{STARTUP_PROBE_ENV: probe}))
+        try:
+            with open(probe) as f:
+                return float(f.read()) - start, None
+        except (OSError, ValueError):
+            return None, (result.stderr.strip().splitlines() or [f"exit status {result.returncode}"])[-1]
+    finally:
+        with contextlib.suppress(OSError):
+            os.remove(probe)
+
+
+def _built_executable(options):
+    if options.exe:
+        return options.exe
+    root = os.path.dirname(os.path.abspath(__file__))
+    suffix = ".exe" if platform.system() == "Windows" else ""
+    for path in BUILT_EXECUTABLES:
+        path = os.path.join(root, path + suffix)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def run_startup(options):
+    """
+    Time to the first window of the script and of the built executable,
+    median of STARTUP_RUNS launches each, against options.startup_budget.
+    Without a display (or an executable) that part is reported as not run
+    """
+    import_seconds, pypdf = _gui_import()
+    record = {"import_seconds": round(import_seconds, 4), "pypdf_at_import": pypdf,
+              "budget_seconds": options.startup_budget, "window": {}}
+    errors = []
+    if pypdf:
+        errors.append("Importing the GUI loads pypdf")
+
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "invoice_printer.py")
+    executable = _built_executable(options)
+    for target, command in (("script", [sys.executable, script]), ("exe", [executable] if executable else None)):
+        if command is None:
+            record["window"][target] = {"not_run": "No built executable (run build_exe.py, or pass --exe)"}
+            continue
+        runs = []
+        for _ in range(STARTUP_RUNS):
+            seconds, why = _first_window(command)
+            if seconds is None:
+                record["window"][target] = {"not_run": f"No window: {why}"}
+                break
+            runs.append(round(seconds, 4))
+        else:
+            seconds = sorted(runs)[len(runs) // 2]
+            record["window"][target] = {"seconds": seconds, "runs": runs}
+            if seconds > options.startup_budget:
+                errors.append(f"{target} took {seconds:.2f}s to its first window "
+                              f"(budget {options.startup_budget:.2f}s)")
+    if errors:
+        record["error"] = "; ".join(errors)
+    return record
+
+
+def _optimizer(options):
+    from spool_optimize import SpoolOptimizer
+    return SpoolOptimizer(options.optimize) if options.optimize else None
+
+
+def _spool_record(metrics):
+    """
+    Bytes per job, time to the first job and render cache hit rate of a cli/gui run
+    """
+    summary = metrics.close()
+    jobs = summary["spool_latency"]["count"]
+    record = {"jobs": jobs, "bytes_out": summary["bytes_written"],
+              "bytes_per_job": summary["bytes_written"] // jobs if jobs else 0,
+              "first_job_seconds": summary["first_job_seconds"]}
+    hits = summary["counters"].get("render_cache_hits", 0)
+    lookups = hits + summary["counters"].get("render_cache_misses", 0)
+    if lookups:
+        record["render_cache_hit_rate"] = round(hits / lookups, 4)
+    return record
+
+
+def _render_cache_size(options):
+    """
+    The render cache only carries over between scenarios with --warm-cache
+    """
+    from render_cache import DEFAULT_MAX_BYTES
+    return DEFAULT_MAX_BYTES if options.warm_cache else 0
+
+
+def run_cli(folder, invoices, options, batch):
+    from imposition import two_up_layout
+    from invoice_printer_cli import InvoicePrinterCLI
+    from metrics import RunMetrics
+
+    printer = InvoicePrinterCLI(_render_cache_size(options))
+    if platform.system() == "Windows":
+        printer.print_pdf = lambda path: None
+    metrics = RunMetrics()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        printer.print_invoices(folder, PREFIX, 1, invoices, batch=batch, workers=options.workers,
+                               in_memory=True, max_queue_depth=options.queue_depth, metrics=metrics,
+                               layout=two_up_layout(options.two_up), optimizer=_optimizer(options))
+    record = {"invoices": len(printer.find_invoice_files(folder, PREFIX, 1, invoices))}
+    record.update(_spool_record(metrics))
+    return record
+
+
+def run_gui(folder, invoices, options, batch):
+    """
+    The GUI's print run without a window: the worker thread's body is
+    called directly and its events are drained afterwards
+    """
+    try:
+        import invoice_printer
+    except ImportError as e:
+        return {"not_run": f"GUI not importable: {e}"}
+    from imposition import two_up_layout
+    from invoice_index import InvoiceIndex
+    from metrics import RunMetrics
+
+    app = invoice_printer.TriplicateOnlyPrinter.__new__(invoice_printer.TriplicateOnlyPrinter)
+    app.events = Queue()
+    app.cancel_event = threading.Event()
+    app.resume_event = threading.Event()
+    app.resume_event.set()
+    app.reuse_renders = bool(_render_cache_size(options))
+    if platform.system() == "Windows":
+        app.print_pdf = lambda path: None
+
+    files, missing = InvoiceIndex(folder).find(PREFIX, 1, invoices)
+    metrics = RunMetrics()
+    app.run_printing(files, batch, options.workers, True, options.queue_depth, metrics=metrics,
+                     layout=two_up_layout(options.two_up), optimizer=_optimizer(options))
+    kind = None
+    while not app.events.empty():
+        event = app.events.get()
+        if event[0] in ("done", "error"):
+            kind = event
+    if kind and kind[0] == "error":
+        raise RuntimeError(kind[1])
+    record = {"invoices": len(files)}
+    record.update(_spool_record(metrics))
+    return record
+
+
+def run_scenario(name, folder, invoices, options):
+    """
+    Run one scenario in this process and return its result record
+    """
+    if not options.warm_cache:
+        from page_cache import CACHE_FILENAME
+        with contextlib.suppress(OSError):
+            os.remove(os.path.join(folder, CACHE_FILENAME))
+    # Kept next to the corpus, not in the user's own render cache
+    import render_cache
+    render_cache.RENDER_CACHE_DIR = os.path.join(folder, RENDER_CACHE_FOLDER)
+    stub_folder = install_stub_spooler(tempfile.mkdtemp(prefix="invoice_bench_bin_"), options.print_latency)
+    ipp_stub = None
+    if options.ipp:
+        ipp_stub = start_ipp_stub(options.print_latency)
+    else:
+        # Never the real CUPS server: with a socket path the IPP backend stays off
+        os.environ["CUPS_SERVER"] = os.path.join(stub_folder, "cups.sock")
+
+    start = time.perf_counter()
+    try:
+        if name == "stages":
+            record = run_stages(folder, invoices, options)
+        elif name == "memory":
+            record = run_memory(folder, invoices, options)
+        elif name == "startup":
+            record = run_startup(options)
+        elif name in ("cli", "cli-batch"):
+            record = run_cli(folder, invoices, options, batch=name == "cli-batch")
+        else:
+            record = run_gui(folder, invoices, options, batch=name == "gui-batch")
+    finally:
+        shutil.rmtree(stub_folder, ignore_errors=True)
+        if ipp_stub:
+            ipp_stub.shutdown()
+    seconds = time.perf_counter() - start
+    if ipp_stub and "invoices" in record:
+        record["ipp"] = {"jobs": ipp_stub.jobs, "requests": ipp_stub.requests,
+                         "connections": ipp_stub.connections, "bytes": ipp_stub.bytes}
+
+    own, children = peak_rss_kb()
+    record.update({
+        "scenario": name,
+        "seconds": round(seconds, 4),
+        "peak_rss_kb": own,
+        "peak_rss_children_kb": children,
+    })
+    if record.get("invoices"):
+        record["invoices_per_second"] = round(record["invoices"] / seconds, 2)
+    return record
+
+
+def _run_in_subprocess(name, folder, invoices, options):
+    command = [sys.executable, os.path.abspath(__file__), "--scenario", name, "--folder", folder,
+               "--invoices", str(invoices), "--workers", str(options.workers),
+               "--queue-depth", str(options.queue_depth), "--print-latency", str(options.print_latency)]
+    if options.warm_cache:
+        command.append("--warm-cache")
+    if options.two_up:
+        command.append("--two-up")
+    if options.ipp:
+        command.append("--ipp")
+    if options.optimize:
+        command += ["--optimize", str(options.optimize)]
+    command += ["--chunk-pages", str(options.chunk_pages), "--startup-budget", str(options.startup_budget)]
+    if options.exe:
+        command += ["--exe", options.exe]
+    result = subprocess.run(command, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        return {"scenario": name, "error": result.stderr.strip().splitlines()[-1:] or ["failed"]}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _git_commit():
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def compare(results, baseline_path):
+    """
+    Print the throughput change of every scenario against an earlier results file
+    """
+    with open(baseline_path) as f:
+        baseline = {record["scenario"]: record for record in json.load(f)["results"]}
+    print(f"\nCompared with {baseline_path}:")
+    for record in results:
+        old = baseline.get(record["scenario"], {})
+        new_rate, old_rate = record.get("invoices_per_second"), old.get("invoices_per_second")
+        if not new_rate or not old_rate:
+            continue
+        change = (new_rate - old_rate) / old_rate * 100
+        print(f"  {record['scenario']:<10} {old_rate:>9.2f} → {new_rate:>9.2f} invoices/s ({change:+.1f}%)")
+
+
+def print_report(results):
+    print(f"\n{'Scenario':<10} {'Invoices':>8} {'Seconds':>9} {'Inv/s':>9} {'Peak RSS':>10} {'KB/job':>9} "
+          f"{'1st job':>8}")
+    for record in results:
+        if "window" in record:
+            print(f"{record['scenario']:<10} import {record['import_seconds']:.3f}s, "
+                  f"pypdf {'loaded' if record['pypdf_at_import'] else 'not loaded'}; "
+                  f"budget {record['budget_seconds']:.2f}s to the first window")
+            for target, window in record["window"].items():
+                runs = ", ".join(f"{seconds:.2f}" for seconds in window.get("runs", []))
+                shown = f"{window['seconds']:.3f}s (runs {runs})" if "seconds" in window else window["not_run"]
+                print(f"    {target:<10} {shown}")
+            if "error" in record:
+                print(f"    {record['error']}")
+            continue
+        if "error" in record or "not_run" in record:
+            print(f"{record['scenario']:<10} {record.get('error') or record.get('not_run')}")
+            continue
+        rss = f"{record['peak_rss_kb'] // 1024} MB" if record.get("peak_rss_kb") else "-"
+        per_job = f"{record['bytes_per_job'] / 1024:.1f}" if record.get("jobs") else "-"
+        first_job = f"{record['first_job_seconds']:.2f}s" if record.get("first_job_seconds") is not None else "-"
+        print(f"{record['scenario']:<10} {record['invoices']:>8} {record['seconds']:>9.2f} "
+              f"{record.get('invoices_per_second', 0):>9.2f} {rss:>10} {per_job:>9} {first_job:>8}")
+        if "ipp" in record:
+            ipp = record["ipp"]
+            print(f"    ipp        {ipp['jobs']} job(s), {ipp['requests']} request(s) "
+                  f"over {ipp['connections']} connection(s)")
+        if "render_cache_hit_rate" in record:
+            print(f"    render cache hit rate {record['render_cache_hit_rate']:.0%}")
+        for mode in ("streamed", "whole"):
+            if mode in record:
+                heap = " → ".join(f"{kb / 1024:.0f}" for kb in record[mode]["heap_kb"])
+                print(f"    {mode:<10} heap per job {heap} MB, peak {record[mode]['peak_kb'] / 1024:.1f} MB, "
+                      f"{record[mode]['jobs']} job(s)")
+        stages = record.get("stages")
+        if stages:
+            total = sum(stages.values()) or 1
+            for stage, seconds in stages.items():
+                print(f"    {stage:<10} {seconds:>9.3f}s {seconds / total * 100:5.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the invoice printing pipeline")
+    parser.add_argument("--invoices", type=int, default=200, help="Invoices in the corpus (default 200)")
+    parser.add_argument("--pages", default=DEFAULT_PAGE_MIX, help="Page-count mix as pages:weight,...")
+    parser.add_argument("--sizes", default="a4,letter", help=f"Page sizes: {', '.join(PAGE_SIZES)}")
+    parser.add_argument("--images", type=float, default=0.2, help="Share of invoices with an embedded image")
+    parser.add_argument("--logo", type=int, default=0,
+                        help="Size in pixels of a logo shared by every invoice (default 0: none)")
+    parser.add_argument("--image-size", type=int, default=300, help="Embedded image size in pixels")
+    parser.add_argument("--missing", type=float, default=0.02, help="Share of invoice numbers left out")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--folder", help="Corpus folder; generated if empty or missing, kept afterwards")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes for the cli/gui scenarios")
+    # The queue only throttles on the printer, and the stub prints instantly
+    parser.add_argument("--queue-depth", type=int, default=1000, help="Max jobs in the stub printer queue")
+    parser.add_argument("--print-latency", type=float, default=0.0, help="Seconds the stub lp takes per job")
+    parser.add_argument("--ipp", action="store_true",
+                        help="Print to a stub IPP server over the IPP backend instead of to the stub lp")
+    parser.add_argument("--warm-cache", action="store_true",
+                        help="Keep the page cache and the render cache between scenarios and runs")
+    parser.add_argument("--two-up", action="store_true", help="Print two A5 pages per A4 sheet in the cli/gui scenarios")
+    parser.add_argument("--optimize", type=int, default=0, metavar="DPI",
+                        help="Optimise the print jobs for a printer of this resolution in the cli/gui scenarios")
+    parser.add_argument("--chunk-pages", type=int, default=50,
+                        help="Pages per streamed print job in the memory scenario (default 50)")
+    parser.add_argument("--startup-budget", type=float, default=STARTUP_BUDGET,
+                        help=f"Seconds the startup scenario allows to the first window (default {STARTUP_BUDGET})")
+    parser.add_argument("--exe", help="Built executable for the startup scenario (default: the one in dist/)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated scenarios to run")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Earlier results file to compare throughput with")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.scenario:
+        # Child process: one scenario, result as JSON on the last line
+        print(json.dumps(run_scenario(options.scenario, options.folder, options.invoices, options)))
+        return 0
+
+    folder = options.folder
+    temporary = folder is None
+    if temporary:
+        folder = tempfile.mkdtemp(prefix="invoice_bench_")
+    os.makedirs(folder, exist_ok=True)
+    try:
+        if not any(name.lower().endswith(".pdf") for name in os.listdir(folder) if os.path.isfile(os.path.join(folder, name))):
+            print(f"Generating {options.invoices} invoice(s) in {folder}...")
+            start = time.perf_counter()
+            generate_corpus(folder, options.invoices, options.pages, options.sizes.split(","),
+                            options.images, options.image_size, options.missing, options.seed, options.logo)
+            print(f"  done in {time.perf_counter() - start:.1f}s")
+
+        results = []
+        for name in options.scenarios.split(","):
+            print(f"Running {name}...", flush=True)
+            results.append(_run_in_subprocess(name, folder, options.invoices, options))
+    finally:
+        if temporary:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    print_report(results)
+    if options.output:
+        document = {
+            "commit": _git_commit(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "corpus": {
+                "invoices": options.invoices, "pages": options.pages, "sizes": options.sizes,
+                "images": options.images, "image_size": options.image_size, "logo": options.logo,
+                "missing": options.missing, "seed": options.seed,
+            },
+            "settings": {"workers": options.workers, "queue_depth": options.queue_depth,
+                         "print_latency": options.print_latency, "warm_cache": options.warm_cache,
+                         "two_up": options.two_up, "optimize": options.optimize, "ipp": options.ipp,
+                         "startup_budget": options.startup_budget},
+            "results": results,
+        }
+        with open(options.output, "w") as f:
+            json.dump(document, f, indent=2)
+        print(f"\nResults written to {options.output}")
+    if options.compare:
+        compare(results, options.compare)
+    return 1 if any("error" in record for record in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
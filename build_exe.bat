@@ -37,6 +37,7 @@ echo Building executable (this may take a few minutes)...
 echo.
 
 REM Build the executable using python -m PyInstaller (more reliable than pyinstaller command)
+REM For a faster starting one-folder build use: python build_exe.py --onedir
 python -m PyInstaller --onefile --windowed --name=InvoicePrinter invoice_printer.py
 
 if errorlevel 1 (
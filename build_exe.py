@@ -1,49 +1,63 @@
 #!/usr/bin/env python3
 """
 Build script to create Windows .exe file using PyInstaller
+
+    python build_exe.py            one InvoicePrinter.exe file
+    python build_exe.py --onedir   an InvoicePrinter folder that starts faster
 """
 
 import subprocess
 import sys
 import os
 
-def build_exe():
+def build_exe(onedir=False):
     """Build the Windows executable"""
-    
+
     # Check if PyInstaller is installed
     try:
         import PyInstaller
     except ImportError:
         print("PyInstaller not found. Installing...")
         subprocess.check_call([sys.executable, "-m", "pip", "install", "pyinstaller"])
-    
+
     print("Building Windows executable...")
     print("This may take a few minutes...\n")
-    
+
     # PyInstaller command - use python -m PyInstaller (more reliable)
     cmd = [
         sys.executable, "-m", "PyInstaller",
-        "--onefile",  # Create a single executable file
+        # --onefile: a single executable file, which unpacks Python and every
+        # library to a temp folder each time it starts. --onedir: the files
+        # are unpacked once, here, so the window comes up without that wait
+        "--onedir" if onedir else "--onefile",
         "--windowed",  # No console window (GUI only)
+        "--noconfirm",  # Replace the output of an earlier build
         "--name=InvoicePrinter",  # Name of the executable
         "invoice_printer.py"
     ]
-    
+
     try:
         subprocess.check_call(cmd)
         print("\n" + "="*60)
         print("Build successful!")
         print("="*60)
-        print(f"\nExecutable location: dist/InvoicePrinter.exe")
-        print("\nYou can now:")
-        print("1. Copy InvoicePrinter.exe to your invoice folder")
-        print("2. Double-click to run")
-        print("3. The app will automatically use the current folder")
+        if onedir:
+            print(f"\nExecutable location: {os.path.join('dist', 'InvoicePrinter', 'InvoicePrinter.exe')}")
+            print("\nYou can now:")
+            print("1. Copy the whole dist/InvoicePrinter folder to the computer (the .exe needs the files next to it)")
+            print("2. Make a shortcut to InvoicePrinter.exe with 'Start in' set to your invoice folder")
+            print("3. Double-click the shortcut to run")
+        else:
+            print(f"\nExecutable location: {os.path.join('dist', 'InvoicePrinter.exe')}")
+            print("\nYou can now:")
+            print("1. Copy InvoicePrinter.exe to your invoice folder")
+            print("2. Double-click to run")
+            print("3. The app will automatically use the current folder")
         print("\nNote: The first run may be slower as Windows verifies the executable.")
+        print("Time to the first window: python benchmark.py --scenarios startup")
     except subprocess.CalledProcessError as e:
         print(f"\nBuild failed with error: {e}")
         sys.exit(1)
 
 if __name__ == "__main__":
-    build_exe()
-
+    build_exe(onedir="--onedir" in sys.argv[1:])
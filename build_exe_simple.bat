@@ -8,6 +8,7 @@ pip install -r requirements.txt
 echo.
 echo Building executable...
 REM Use python -m PyInstaller instead of pyinstaller command (more reliable)
+REM For a faster starting one-folder build use: python build_exe.py --onedir
 python -m PyInstaller --onefile --windowed --name=InvoicePrinter invoice_printer.py
 
 if errorlevel 1 (
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+2-up imposition
+Puts two fitted triplicate pages (A5, or any other size that fits
+twice) side by side on each A4 landscape sheet, so every pass through
+the printer carries two pages instead of one. Batch jobs fill the
+sheets across invoice boundaries (see BatchSpoolJob); optional cut
+marks show where to cut the sheets in half
+"""
+
+from pypdf import PageObject
+from page_fit import append_content, draw_form, page_form
+from page_sizes import A5_SIZE
+
+# A4 landscape in points: 297mm x 210mm
+A4_LANDSCAPE = (841.89, 595.28)
+
+CUT_MARK_LENGTH = 14.17  # 5mm, drawn in from the top and bottom edge
+CUT_MARK_WIDTH = 0.5
+
+
+class TwoUpLayout:
+    """
+    Two slot_size pages next to each other on a sheet_size sheet, the
+    pair centred on the sheet. Pages must already be fitted to
+    slot_size (see page_fit); each is drawn as a Form XObject
+    """
+
+    slots = 2
+
+    def __init__(self, slot_size=A5_SIZE, sheet_size=A4_LANDSCAPE, cut_marks=False):
+        slot_width, slot_height = slot_size
+        sheet_width, sheet_height = sheet_size
+        if 2 * slot_width > sheet_width + 1 or slot_height > sheet_height + 1:
+            raise ValueError(f"Two {slot_width:g}x{slot_height:g}pt pages don't fit on a "
+                             f"{sheet_width:g}x{sheet_height:g}pt sheet")
+        self.slot_size = slot_size
+        self.sheet_size = sheet_size
+        self.cut_marks = cut_marks
+        self.offset_x = max((sheet_width - 2 * slot_width) / 2, 0)
+        self.offset_y = max((sheet_height - slot_height) / 2, 0)
+
+    def settings(self):
+        """
+        What a run journal stores to rebuild the layout on resume
+        """
+        return {"two_up": True, "cut_marks": self.cut_marks}
+
+    def sheets_for(self, page_count, free_slots=0):
+        """
+        New sheets needed for page_count more pages when the current
+        sheet still has free_slots empty slots
+        """
+        return max(page_count - free_slots + self.slots - 1, 0) // self.slots
+
+    def new_sheet(self):
+        return PageObject.create_blank_page(width=self.sheet_size[0], height=self.sheet_size[1])
+
+    def place(self, sheet, page, slot):
+        """
+        Draw page into the given slot (0 = left, 1 = right) of sheet
+        """
+        box = page.mediabox
+        x = self.offset_x + slot * self.slot_size[0] - float(box.left)
+        draw_form(sheet, f"/Slot{slot}", page_form(page), (1, 0, 0, 1, x, self.offset_y - float(box.bottom)))
+
+    def finish(self, sheet):
+        """
+        Add the cut marks (if any) once a sheet is complete; returns it
+        """
+        if self.cut_marks:
+            height = self.sheet_size[1]
+            x = self.offset_x + self.slot_size[0]
+            append_content(sheet, (f"q {CUT_MARK_WIDTH} w 0 G "
+                                   f"{x:.2f} 0 m {x:.2f} {CUT_MARK_LENGTH} l S "
+                                   f"{x:.2f} {height - CUT_MARK_LENGTH:.2f} m {x:.2f} {height:.2f} l S Q\n"
+                                   ).encode("ascii"))
+        return sheet
+
+    def impose(self, pages):
+        """
+        The sheets for one list of pages, in order
+        """
+        sheets = []
+        for i in range(0, len(pages), self.slots):
+            sheet = self.new_sheet()
+            for slot, page in enumerate(pages[i:i + self.slots]):
+                self.place(sheet, page, slot)
+            sheets.append(self.finish(sheet))
+        return sheets
+
+
+def two_up_layout(two_up, cut_marks=False, page_size=None):
+    """
+    The TwoUpLayout for a run's settings, or None to print one page per
+    sheet. page_size: the size of the pages on the sheet (default A5)
+    """
+    if not two_up:
+        return None
+    return TwoUpLayout(slot_size=tuple(page_size or A5_SIZE), cut_marks=cut_marks)
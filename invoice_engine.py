@@ -0,0 +1,743 @@
+#!/usr/bin/env python3
+"""
+Invoice print engine
+The print pipeline of both front ends (invoice_printer.py, the window,
+and invoice_printer_cli.py), in explicit stages:
+
+    discover → probe → select → transform → serialize → submit
+
+- discover: the invoices of a range, from one listing of the folder
+  (InvoiceIndex)
+- probe: page counts from the page cache or the trailer (pdf_probe);
+  known skips and render-cache hits never reach the parser
+- select: the triplicate pages, by the PrintRules of the front end
+- transform: every page fitted to the paper size, 2-up imposition
+- serialize: each invoice's print job PDF (optimised on the way out),
+  or its pages for the batch spool job
+- submit: the PrintQueue, which holds back while max_queue_depth jobs
+  wait at the printer
+
+probe → transform run in parallel_render, by a worker pool with
+workers > 1. Everything up to serialize runs on a render thread of its
+own, which hands finished invoices to submit through a queue of at most
+render_ahead invoices: rendering keeps ahead of the printer, but a slow
+printer holds it back instead of filling memory. The caches, the pool,
+the optimizer and IPP are set up here once, for both front ends; what
+to tell the user about each invoice stays with the front end, which
+hears about the run through a RunReport
+"""
+
+import os
+import platform
+import subprocess
+import threading
+from queue import Full, Queue
+from invoice_index import InvoiceIndex
+from ipp_client import connect_ipp
+from metrics import RunMetrics
+from page_cache import PageCountCache
+from page_sizes import page_size_name
+from render_cache import DEFAULT_MAX_BYTES, RenderCache
+from run_journal import FAILED, RENDERED, SKIPPED
+from shared_queue import CLAIM_BATCH, QUEUED
+from spooler import DEFAULT_QUEUE_DEPTH, PrintQueue
+
+# parallel_render and batch_spool load pypdf, which the window doesn't
+# need to come up; they are imported where rendering starts
+
+# Rendered invoices waiting for the submit stage
+RENDER_AHEAD = 4
+
+# How long to wait at the end of a run for the printer to finish (seconds)
+QUEUE_WAIT_TIMEOUT = 600
+
+# How often the render thread looks whether the run was abandoned while the queue is full (seconds)
+HANDOFF_POLL = 0.5
+
+ACROBAT_PATHS = [
+    r"C:\Program Files\Adobe\Acrobat DC\Acrobat\Acrobat.exe",
+    r"C:\Program Files (x86)\Adobe\Acrobat Reader DC\Reader\AcroRd32.exe",
+    r"C:\Program Files\Adobe\Acrobat Reader DC\Reader\AcroRd32.exe",
+]
+
+
+def print_pdf(pdf_path):
+    """
+    Print a PDF file on the default printer: lp on Linux, lpr on macOS;
+    on Windows the PDF application's print verb, through os.startfile
+    or PowerShell, or Adobe Reader
+    """
+    if not os.path.exists(pdf_path):
+        raise FileNotFoundError(f"File not found: {pdf_path}")
+
+    system = platform.system()
+    try:
+        if system == "Windows":
+            errors = []
+            # Method 1: os.startfile - simplest and often silent
+            try:
+                os.startfile(pdf_path, "print")
+                return
+            except Exception as e:
+                errors.append(f"os.startfile: {e}")
+
+            # Method 2: PowerShell with Start-Process and the Print verb
+            try:
+                ps_command = f'Start-Process -FilePath "{pdf_path}" -Verb Print -WindowStyle Hidden'
+                subprocess.run(["powershell", "-Command", ps_command], check=True, timeout=20, capture_output=True)
+                return
+            except Exception as e:
+                errors.append(f"PowerShell: {e}")
+
+            # Method 3: Adobe Reader, if installed
+            for acrobat_path in ACROBAT_PATHS:
+                if os.path.exists(acrobat_path):
+                    try:
+                        subprocess.run([acrobat_path, "/t", pdf_path], check=True, timeout=20)
+                        return
+                    except Exception as e:
+                        errors.append(f"Adobe Reader: {e}")
+
+            raise Exception(
+                "All print methods failed.\n\n"
+                "Errors: " + "\n".join(errors) + "\n\n"
+                "Solutions:\n"
+                "1. Set a default PDF application (Edge, Chrome, or any PDF app)\n"
+                "2. Install Adobe Reader (free) from adobe.com\n"
+                f"3. Print manually: {pdf_path}"
+            )
+        elif system == "Darwin":
+            subprocess.run(["lpr", pdf_path], check=True, timeout=30)
+        else:
+            subprocess.run(["lp", pdf_path], check=True, timeout=30)
+    except subprocess.TimeoutExpired:
+        raise Exception("Print command timed out")
+
+
+def open_ipp(log=print):
+    """
+    The IPP connection to CUPS for a run, or None where printing goes
+    through lp (or the platform's own print methods)
+    """
+    ipp = connect_ipp()
+    if ipp:
+        log(f"Printing over IPP to {ipp.printer} ({ipp.host}:{ipp.port})")
+    return ipp
+
+
+def discover(folder, prefixes, ranges):
+    """
+    The discover stage: invoice files for every prefix and every
+    (start, end) range, from a single listing of the folder, in the
+    order given and without duplicates. Returns (paths, missing), with
+    missing a list of (prefix, invoice numbers not found)
+    """
+    if not os.path.isdir(str(folder)):
+        raise FileNotFoundError(f"Folder not found: {folder}")
+
+    index = InvoiceIndex(folder)
+    paths, seen, missing = [], set(), []
+    for prefix in prefixes:
+        for start_no, end_no in ranges:
+            found, not_found = index.find(prefix or "", start_no, end_no)
+            if not_found:
+                missing.append((prefix or "", not_found))
+            for path in found:
+                if path not in seen:
+                    seen.add(path)
+                    paths.append(path)
+    return paths, missing
+
+
+def write_print_file(pdf_path, data):
+    """
+    Save an invoice's print job next to it, for printing from a file
+    """
+    temp_path = os.path.join(os.path.dirname(str(pdf_path)),
+                             os.path.splitext(os.path.basename(str(pdf_path)))[0] + "_triplicate_only.pdf")
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    return temp_path
+
+
+def new_counts():
+    return {"printed": 0, "skipped": 0, "failed": 0, "planned": 0}
+
+
+class PrintRules:
+    """
+    What prints of each invoice, and how: the skip rule (max_pages),
+    the triplicate rule (see parallel_render.triplicate_count, capped at
+    max_triplicate), the page size pages are fitted to (None keeps
+    them as they are), the 2-up layout and the spool optimizer
+    """
+
+    def __init__(self, max_pages=None, max_triplicate=None, page_size=None, layout=None, optimizer=None):
+        self.max_pages = max_pages
+        self.max_triplicate = max_triplicate
+        self.page_size = tuple(page_size) if page_size else None
+        self.layout = layout
+        self.optimizer = optimizer
+
+    @property
+    def fit_size(self):
+        # 2-up always fits the pages to the layout's slots
+        return self.layout.slot_size if self.layout else self.page_size
+
+    def triplicate_count(self, total_pages):
+        from parallel_render import triplicate_count
+        return triplicate_count(total_pages, self.max_triplicate)
+
+    def settings(self):
+        """
+        The rules as plain values, the way the run journal and the shared
+        queue store them (see from_settings)
+        """
+        settings = {"max_pages": self.max_pages, "max_triplicate": self.max_triplicate,
+                    "page_size": list(self.page_size) if self.page_size else None,
+                    "optimize_dpi": self.optimizer.dpi if self.optimizer else None}
+        settings.update(self.layout.settings() if self.layout else {"two_up": False, "cut_marks": False})
+        return settings
+
+    @classmethod
+    def from_settings(cls, settings):
+        from imposition import two_up_layout
+        from spool_optimize import SpoolOptimizer
+        page_size = settings.get("page_size")
+        dpi = settings.get("optimize_dpi")
+        return cls(settings.get("max_pages"), settings.get("max_triplicate"), page_size,
+                   two_up_layout(settings.get("two_up"), settings.get("cut_marks", False), page_size),
+                   SpoolOptimizer(dpi) if dpi else None)
+
+    def describe(self):
+        """
+        "skip over 11 pages, at most 3 triplicate page(s), A5, 2-up" and the like
+        """
+        parts = [f"skip over {self.max_pages} pages" if self.max_pages is not None else "no page limit"]
+        if self.max_triplicate is not None:
+            parts.append(f"at most {self.max_triplicate} triplicate page(s)")
+        parts.append(page_size_name(self.page_size) if self.page_size else "page size kept")
+        if self.layout:
+            parts.append("2-up")
+        if self.optimizer:
+            parts.append(f"optimised to {self.optimizer.dpi} dpi")
+        return ", ".join(parts)
+
+    def render_options(self, impose=True):
+        """
+        The options of parallel_render.render_in_order. impose=True puts
+        the pages on their sheets and optimises each invoice's PDF; batch
+        jobs do both across invoices (see BatchSpoolJob)
+        """
+        options = {"max_pages": self.max_pages, "max_triplicate": self.max_triplicate}
+        if self.fit_size:
+            options["fit_size"] = self.fit_size
+        if impose and self.layout:
+            options["layout"] = self.layout
+        if impose and self.optimizer:
+            options["optimizer"] = self.optimizer
+        return options
+
+
+class RunReport:
+    """
+    What a front end hears about a run. Every method does nothing here;
+    the front ends override the ones they report
+    - path is the invoice's path as given; total is None for invoices
+      claimed from the shared queue, whose number isn't known
+    - status is "skipped" (the page rules) or "failed"
+    """
+
+    def keep_going(self):
+        """
+        Called before every invoice: False stops the run (may block while paused)
+        """
+        return True
+
+    def cancelled(self):
+        return False
+
+    def invoice(self, index, total, path):
+        pass
+
+    def rendered(self, path, result):
+        """
+        A single job's PDF is ready: result.output_pages says how many pages (sheets) it prints
+        """
+
+    def planned(self, path, result):
+        """
+        Dry run: the job would have been sent
+        """
+
+    def sent(self, path, result, job):
+        pass
+
+    def added(self, path, result):
+        """
+        An invoice's pages are going into the batch job
+        """
+
+    def not_printed(self, path, status, error, total_pages=None):
+        pass
+
+    def progress(self, done, total):
+        pass
+
+    def batch_ready(self, job, chunk_count, stream, dry_run):
+        """
+        Every invoice is in the batch job; its chunks are sent next (stream: were sent already)
+        """
+
+    def chunk_sent(self, chunk, print_job):
+        pass
+
+    def chunk_failed(self, chunk, error):
+        pass
+
+    def chunk_cancelled(self, chunk):
+        pass
+
+    def batch_entry(self, entry, path, result, status, chunk_count, print_job=None):
+        """
+        Where an invoice ended up in the batch job; status is "printed", "failed" or "planned"
+        """
+
+    def queued(self, added, total):
+        """
+        added of total invoices were new to the shared queue
+        """
+
+    def handed(self, path, result, handed):
+        """
+        Rendered for the print station; handed is False if another workstation took it over
+        """
+
+
+class PrintEngine:
+    """
+    The stages of print runs with one set of PrintRules:
+    - render(): probe → select → transform, in invoice order, with the
+      page cache, the render cache and (workers > 1) the worker pool
+    - pipeline(): render() and serialize on the render thread, handed
+      over through a bounded queue
+    - print_each() / print_batch() / render_shared(): whole runs, from
+      the rendered invoices to the submit stage
+    log takes the engine's own messages (cache hits, batch totals,
+    waiting for the printer); metrics, a RunMetrics, the timings
+    print_file is the front end's print_pdf, for the PrintQueue
+    """
+
+    def __init__(self, rules=None, workers=1, render_cache_size=DEFAULT_MAX_BYTES, metrics=None, log=print,
+                 print_file=print_pdf, render_ahead=RENDER_AHEAD):
+        self.rules = rules or PrintRules()
+        self.workers = max(workers, 1)
+        # Size cap of the rendered-triplicate cache in bytes; 0 turns it off
+        self.render_cache_size = render_cache_size
+        self.metrics = metrics or RunMetrics()
+        self.log = log
+        self.print_file = print_file
+        self.render_ahead = render_ahead
+
+    def open_queue(self, max_queue_depth=DEFAULT_QUEUE_DEPTH, ipp=None, journal=None, log=None):
+        """
+        The PrintQueue of the submit stage
+        """
+        return PrintQueue(print_file=self.print_file, max_queue_depth=max_queue_depth, log=log,
+                          on_complete=journal.job_completed if journal else None, ipp=ipp)
+
+    def render(self, paths, impose=True, folder=None, log=None, rules=None):
+        """
+        The probe, select and transform stages: yield a RenderOutcome
+        per path, in order (see parallel_render.render_in_order). paths
+        may be lazy (e.g. claimed from the shared queue); folder then
+        says where they are. The caches belong to the thread that reads
+        the generator; their hits go to log (default the engine's)
+        rules: instead of the engine's (the shared queue's own)
+        """
+        from parallel_render import render_in_order
+        log = log or self.log
+        rules = rules or self.rules
+        # Page counts from earlier runs let known skips go by without parsing
+        page_cache = PageCountCache.for_folder(folder or os.path.dirname(str(paths[0])))
+        render_cache = RenderCache.open(max_bytes=self.render_cache_size)
+        try:
+            yield from render_in_order([str(path) for path in paths] if isinstance(paths, list) else paths,
+                                       workers=self.workers, page_cache=page_cache, render_cache=render_cache,
+                                       **rules.render_options(impose))
+        finally:
+            if page_cache:
+                log(f"Page cache: {page_cache.hits} hit(s), {page_cache.misses} miss(es)")
+                self.metrics.count("page_cache_hits", page_cache.hits)
+                self.metrics.count("page_cache_misses", page_cache.misses)
+                page_cache.close()
+            if render_cache:
+                log(f"Render cache: {render_cache.hits} hit(s), {render_cache.misses} miss(es)")
+                self.metrics.count("render_cache_hits", render_cache.hits)
+                self.metrics.count("render_cache_misses", render_cache.misses)
+                render_cache.close()
+
+    def serialize(self, outcome, impose=True):
+        """
+        The serialize stage: with impose the invoice's print job PDF,
+        otherwise its pages for a batch job (parsed back from a worker's
+        PDF). Returns the outcome, with the error if that fails
+        """
+        if outcome.result is not None:
+            try:
+                if impose:
+                    outcome.result.get_data()
+                else:
+                    outcome.result.get_pages()
+            except Exception as e:
+                outcome.result, outcome.error = None, e
+        return outcome
+
+    def pipeline(self, paths, impose=True):
+        """
+        render() and serialize() on the render thread: yields the
+        RenderOutcomes in order, with at most render_ahead of them
+        waiting for the caller. Closing the generator (or an exception
+        in the caller) stops the render thread, and with it the pool
+        paths must be a list; render_ahead 0 runs every stage on the
+        caller's thread
+        """
+        if not self.render_ahead:
+            outcomes = self.render(paths, impose)
+            try:
+                for outcome in outcomes:
+                    yield self.serialize(outcome, impose)
+            finally:
+                outcomes.close()
+            return
+
+        handoff = Queue(maxsize=self.render_ahead)
+        stop = threading.Event()
+        done = object()
+        notes = []  # the render thread's messages, logged once it is done
+
+        def hand_over(item):
+            # Blocks while the queue is full: backpressure from the submit stage
+            while not stop.is_set():
+                try:
+                    handoff.put(item, timeout=HANDOFF_POLL)
+                    return True
+                except Full:
+                    pass
+            return False
+
+        def run():
+            try:
+                outcomes = self.render(paths, impose, log=notes.append)
+                try:
+                    for outcome in outcomes:
+                        if not hand_over(self.serialize(outcome, impose)):
+                            break
+                finally:
+                    outcomes.close()
+            except BaseException as e:
+                hand_over(PipelineError(e))
+            hand_over(done)
+
+        thread = threading.Thread(target=run, name="render", daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = handoff.get()
+                if item is done:
+                    break
+                if isinstance(item, PipelineError):
+                    raise item.error
+                yield item
+        finally:
+            stop.set()
+            thread.join()
+            for note in notes:
+                self.log(note)
+
+    def submit(self, queue, data, name, pdf_path, in_memory=True):
+        """
+        The submit stage: one print job through the print queue, which
+        waits while the printer already has enough jobs queued. Without
+        in_memory the PDF is written next to the invoice first and
+        deleted by the queue once the job has printed
+        """
+        try:
+            if in_memory:
+                return queue.submit_data(data, name)
+            return queue.submit_file(write_print_file(pdf_path, data), name, cleanup=True)
+        except subprocess.TimeoutExpired:
+            raise Exception("Print command timed out")
+
+    def _not_printed(self, outcome, report, counts, journal=None):
+        from parallel_render import InvoiceSkipped
+        status = "skipped" if isinstance(outcome.error, InvoiceSkipped) else "failed"
+        counts[status] += 1
+        if journal:
+            journal.mark(outcome.path, SKIPPED if status == "skipped" else FAILED)
+        report.not_printed(outcome.path, status, outcome.error, getattr(outcome.error, "total_pages", None))
+        return status
+
+    def print_each(self, paths, queue, report=None, in_memory=True, dry_run=False, journal=None):
+        """
+        One print job per invoice, in order. With dry_run everything is
+        rendered and nothing sent; a started RunJournal records every
+        invoice's state. Returns the counts per status: printed,
+        skipped, failed, planned
+        """
+        report = report or RunReport()
+        counts = new_counts()
+        outcomes = self.pipeline(paths, impose=True)
+        try:
+            for i, outcome in enumerate(outcomes, 1):
+                if not report.keep_going():
+                    break
+                report.invoice(i, len(paths), outcome.path)
+                self._print_one(outcome, queue, report, counts, in_memory, dry_run, journal)
+                report.progress(i, len(paths))
+        finally:
+            outcomes.close()
+        return counts
+
+    def _print_one(self, outcome, queue, report, counts, in_memory, dry_run, journal):
+        if outcome.error:
+            self._not_printed(outcome, report, counts, journal)
+            return
+        path, result = outcome.path, outcome.result
+        name = os.path.basename(str(path))
+        self.metrics.record_timings(name, result.timings)
+        if result.optimized and result.optimized["images_downsampled"]:
+            self.metrics.count("images_downsampled", result.optimized["images_downsampled"])
+        if journal:
+            journal.mark(path, RENDERED)
+        report.rendered(path, result)
+        if dry_run:
+            counts["planned"] += 1
+            report.planned(path, result)
+            return
+
+        data = result.get_data()
+        try:
+            with self.metrics.stage("submit", name):
+                job = self.submit(queue, data, name, path, in_memory)
+        except Exception as e:
+            counts["failed"] += 1
+            if journal:
+                journal.mark(path, FAILED)
+            report.not_printed(path, "failed", e, result.total_pages)
+            return
+        self.metrics.record_job(name, job, len(data))
+        if journal:
+            journal.submitted([path], job)
+        counts["printed"] += 1
+        report.sent(path, result, job)
+
+    def print_batch(self, paths, queue, report=None, in_memory=True, dry_run=False, journal=None,
+                    spool_options=None, folder=None):
+        """
+        Merge the triplicate pages of all invoices, in order, into one
+        spool job (see BatchSpoolJob), sheets filled across invoices
+        with a layout. spool_options: max_pages_per_chunk /
+        max_bytes_per_chunk, and stream=True to send every chunk as soon
+        as it is full instead of after the last invoice. Print files
+        (without in_memory) go to folder, by default the invoices'
+        Returns the counts per status, like print_each
+        """
+        from batch_spool import BatchSpoolJob
+        from resource_dedup import format_bytes
+        report = report or RunReport()
+        counts = new_counts()
+        spool_options = dict(spool_options or {})
+        stream = spool_options.pop("stream", False)
+        folder = str(folder or os.path.dirname(str(paths[0])))
+        sources = {}  # invoice name → (path, RenderResult without its pages or data)
+        printed = {}  # chunk → PrintJob
+
+        def send_chunk(chunk, data):
+            if dry_run:
+                return
+            if report.cancelled():
+                report.chunk_cancelled(chunk)
+                return
+            name = f"triplicate_batch_{chunk}"
+            try:
+                with self.metrics.stage("submit", name):
+                    print_job = self.submit(queue, data, name, os.path.join(folder, f"_batch_{chunk}.pdf"),
+                                            in_memory)
+            except Exception as e:
+                report.chunk_failed(chunk, e)
+                return
+            self.metrics.record_job(name, print_job, len(data))
+            printed[chunk] = print_job
+            if journal:
+                journal.submitted([sources[entry.name][0] for entry in job.entries if entry.chunk == chunk],
+                                  print_job)
+            report.chunk_sent(chunk, print_job)
+
+        job = BatchSpoolJob(layout=self.rules.layout, optimizer=self.rules.optimizer,
+                            on_chunk=send_chunk if stream else None, **spool_options)
+        outcomes = self.pipeline(paths, impose=False)
+        try:
+            for i, outcome in enumerate(outcomes, 1):
+                if not report.keep_going():
+                    break
+                report.invoice(i, len(paths), outcome.path)
+                if outcome.error:
+                    self._not_printed(outcome, report, counts, journal)
+                else:
+                    path, result = outcome.path, outcome.result
+                    name = os.path.basename(str(path))
+                    sources[name] = (path, result)
+                    self.metrics.record_timings(name, result.timings)
+                    if journal:
+                        journal.mark(path, RENDERED)
+                    report.added(path, result)
+                    try:
+                        # Streaming, this may send a full chunk
+                        job.add_invoice(name, result.get_pages())
+                    except Exception as e:
+                        counts["failed"] += 1
+                        if journal:
+                            journal.mark(path, FAILED)
+                        report.not_printed(path, "failed", e, result.total_pages)
+                    # The job holds the pages now (until their chunk is sent,
+                    # streaming); the source reader and bytes can go
+                    result.pages = result.data = None
+                report.progress(i, len(paths))
+        finally:
+            outcomes.close()
+
+        if stream:
+            job.finish()
+            self.metrics.record("write", job.write_seconds, "batch")
+        if not job.entries:
+            self.log("No triplicate pages to print")
+            return counts
+        if report.cancelled() and not stream:
+            return counts
+
+        chunk_count = len(job.chunks)
+        report.batch_ready(job, chunk_count, stream, dry_run)
+        if job.shared_resources:
+            self.log(f"  Shared resources: {job.shared_resources} repeated image(s)/font(s)/form(s) written once, "
+                     f"{format_bytes(job.bytes_saved)} saved")
+            self.metrics.count("shared_resources", job.shared_resources)
+            self.metrics.count("dedup_bytes_saved", job.bytes_saved)
+
+        if not dry_run:
+            chunks = []
+            if not stream:
+                with self.metrics.stage("write", "batch"):
+                    chunks = job.chunk_data()
+            optimizer = self.rules.optimizer
+            if optimizer:
+                self.metrics.record("optimize", job.optimize_seconds, "batch")
+                self.metrics.count("images_downsampled", job.optimized.get("images_downsampled", 0))
+                self.log(f"  Optimised: {job.optimized.get('images_downsampled', 0)} image(s) downsampled to "
+                         f"{optimizer.dpi} dpi, {job.optimized.get('resources_removed', 0)} unused resource(s) "
+                         f"dropped, {format_bytes(job.bytes_out)} to send")
+            for chunk, data in enumerate(chunks, 1):
+                send_chunk(chunk, data)
+
+        for entry in job.entries:
+            path, result = sources[entry.name]
+            if dry_run:
+                status = "planned"
+            elif entry.chunk in printed:
+                status = "printed"
+            else:
+                status = "failed"
+                if journal:
+                    journal.mark(path, FAILED)
+            counts[status] += 1
+            report.batch_entry(entry, path, result, status, chunk_count, printed.get(entry.chunk))
+        return counts
+
+    def render_shared(self, shared, paths, report=None, requeue=False):
+        """
+        Workstation of a shared queue: add the invoices to the queue
+        (requeue: again, even those printed already), then render queued
+        invoices (these and other workstations') and leave them for the
+        print station, until nothing is left to claim
+        Every invoice in the queue prints by the same rules: those of the
+        workstation that queued the first of them, which may not be this
+        engine's. Claims go through the queue's own connection, so
+        everything runs on the caller's thread. Returns the counts per
+        status: queued (handed to the print station), skipped, failed
+        """
+        report = report or RunReport()
+        counts = {"queued": 0, "skipped": 0, "failed": 0}
+        settings = self.rules.settings()
+        added = shared.requeue(paths, settings) if requeue else shared.enqueue(paths, settings)
+        report.queued(len(added), len(paths))
+        rules = self.rules
+        if shared.rules != settings:
+            rules = PrintRules.from_settings(shared.rules)
+            self.log(f"The shared queue prints by the rules it was started with: {rules.describe()}")
+
+        outcomes = self.render(shared.claimed(CLAIM_BATCH * self.workers), impose=True, folder=shared.folder,
+                               rules=rules)
+        try:
+            for i, outcome in enumerate(outcomes, 1):
+                if not report.keep_going():
+                    break
+                report.invoice(i, None, outcome.path)
+                outcome = self.serialize(outcome)
+                if outcome.error:
+                    if self._not_printed(outcome, report, counts) == "skipped":
+                        shared.skipped(outcome.path, str(outcome.error), getattr(outcome.error, "total_pages", None))
+                    else:
+                        shared.failed(outcome.path, str(outcome.error))
+                else:
+                    result = outcome.result
+                    name = os.path.basename(str(outcome.path))
+                    self.metrics.record_timings(name, result.timings)
+                    with self.metrics.stage("handoff", name):
+                        handed = shared.rendered(outcome.path, result.get_data(), result.total_pages,
+                                                 result.triplicate_count)
+                    if handed:
+                        counts["queued"] += 1
+                    report.handed(outcome.path, result, handed)
+                report.progress(i, i + shared.counts().get(QUEUED, 0))
+        finally:
+            outcomes.close()
+            # Whatever was claimed but not rendered goes back to the other workstations
+            shared.release_claims()
+        return counts
+
+    def wait_for_queue(self, queue, report=None):
+        """
+        Wait for the submitted jobs to leave the print queue, giving up
+        after QUEUE_WAIT_TIMEOUT or when the run is cancelled. True if
+        every job finished
+        """
+        report = report or RunReport()
+        finished = True
+        if queue.active or queue.cleanups:
+            self.log(f"\nWaiting for {len(queue.active)} print job(s) to complete...")
+            waited = 0
+            while not queue.wait_all(timeout=1):
+                waited += 1
+                if report.cancelled():
+                    self.log("Stopped waiting for the printer (cancelled)")
+                    finished = False
+                    break
+                if waited >= QUEUE_WAIT_TIMEOUT:
+                    self.log(f"Print jobs still queued after {QUEUE_WAIT_TIMEOUT // 60} minutes")
+                    finished = False
+                    break
+            if not finished:
+                for temp_file in queue.pending_files():
+                    self.log(f"  Left in place: {temp_file}")
+        self.metrics.record_completed(queue)
+        return finished
+
+
+class PipelineError(Exception):
+    """
+    An exception of the render thread, on its way to the caller
+    """
+
+    def __init__(self, error):
+        Exception.__init__(self, str(error))
+        self.error = error
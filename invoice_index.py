@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Invoice folder index
+Lists the invoice folder once with os.scandir and maps invoice numbers
+to files, instead of probing the disk once per number in the range.
+On network shares a sparse range like 1-200000 goes from 200000 stats
+to a single directory listing
+"""
+
+import os
+
+
+class InvoiceIndex:
+    """
+    Index of {prefix}{number}.pdf files in one folder
+    - Numbers may be zero-padded: C0300.pdf is invoice 300 for prefix "C"
+    - Folders with mixed prefixes work: each prefix is matched separately,
+      so prefix "C" never picks up CN300.pdf or C300_triplicate_only.pdf
+    """
+
+    def __init__(self, folder):
+        self.folder = str(folder)
+        self.names = []
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith(".pdf") and entry.is_file():
+                    self.names.append(entry.name)
+        self._by_prefix = {}
+
+    def numbers(self, prefix=""):
+        """
+        Return {invoice number: file path} for one prefix
+        """
+        key = os.path.normcase(prefix)
+        if key not in self._by_prefix:
+            found = {}
+            for name in self.names:
+                digits = invoice_digits(name, prefix)
+                if digits is None:
+                    continue
+                number = int(digits)
+                # C300.pdf wins over a zero-padded C0300.pdf duplicate
+                if number in found and len(digits) >= len(found[number][0]):
+                    continue
+                found[number] = (digits, name)
+            self._by_prefix[key] = {
+                number: os.path.join(self.folder, name) for number, (digits, name) in found.items()
+            }
+        return self._by_prefix[key]
+
+    def find(self, prefix, start, end):
+        """
+        Return (paths, missing) for start..end inclusive
+        - paths: file paths in invoice-number order
+        - missing: (first, last) ranges of numbers with no file
+        """
+        numbers = self.numbers(prefix)
+        present = sorted(number for number in numbers if start <= number <= end)
+        return [numbers[number] for number in present], missing_ranges(present, start, end)
+
+
+def invoice_digits(name, prefix=""):
+    """
+    The number part of a {prefix}{number}.pdf file name, as the digits
+    string (zero padding kept), or None if the name doesn't match
+    """
+    if not name.lower().endswith(".pdf"):
+        return None
+    stem = os.path.normcase(name[:-4])
+    key = os.path.normcase(prefix)
+    if not stem.startswith(key):
+        return None
+    digits = stem[len(key):]
+    # ASCII only: isdigit() alone also takes "²", which int() refuses
+    return digits if digits.isascii() and digits.isdigit() else None
+
+
+def missing_ranges(present, start, end):
+    """
+    Compress the gaps between sorted present numbers into (first, last) ranges
+    """
+    ranges = []
+    expected = start
+    for number in present:
+        if number > expected:
+            ranges.append((expected, number - 1))
+        expected = number + 1
+    if expected <= end:
+        ranges.append((expected, end))
+    return ranges
+
+
+def format_ranges(ranges, prefix="", limit=20):
+    """
+    "C6, C9-C11, C15" style summary of (first, last) ranges,
+    truncated after limit ranges
+    """
+    parts = []
+    for first, last in ranges[:limit]:
+        if first == last:
+            parts.append(f"{prefix}{first}")
+        else:
+            parts.append(f"{prefix}{first}-{prefix}{last}")
+    if len(ranges) > limit:
+        parts.append(f"... and {len(ranges) - limit} more range(s)")
+    return ", ".join(parts)
+
+
+def count_numbers(ranges):
+    return sum(last - first + 1 for first, last in ranges)
@@ -6,32 +6,170 @@ Skips any invoice with more than 11 pages
 """
 
 import os
+import multiprocessing
+import threading
+import time
+from queue import Queue, Empty
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from pathlib import Path
-from pypdf import PdfReader, PdfWriter
-try:
-    from pypdf.generic import Transformation
-except ImportError:
-    # For older pypdf versions
-    from pypdf import Transformation
-import platform
-import subprocess
-import time
+from invoice_engine import PrintEngine, PrintRules, RunReport, discover, open_ipp, print_pdf
+from invoice_index import count_numbers, format_ranges
+from page_cache import PageCountCache
+from render_cache import DEFAULT_MAX_BYTES
+from spooler import DEFAULT_QUEUE_DEPTH, cleanup_stale_temp
+from metrics import RunMetrics, format_summary, profiled
+from page_sizes import A5_SIZE, DEFAULT_DPI, DEFAULT_PAGE_SIZE, PAGE_SIZES, page_size_name, parse_page_size
+from run_journal import resume_journal, start_journal
+from shared_queue import SharedQueue
+from status_log import ALL_MESSAGES, ERROR_MESSAGES, LOG_DIR, SKIP_MESSAGES, SPILL_FILENAME, StatusLog
+
+# Skip rule: invoices with more than this many pages are not printed
+MAX_PAGES = 11
+MAX_TRIPLICATE = 3
+
+# The status log and progress bar are refreshed from the worker's events this often (ms)
+UI_REFRESH_MS = 50
+MAX_EVENTS_PER_REFRESH = 2000
+
+# The status log shows at most this many lines; the full log is in LOG_DIR
+LOG_VIEW_LINES = 2000
+
+# Where "Save timing metrics" and "Profile" put their files
+METRICS_DIR = os.path.join(os.path.expanduser("~"), "invoice_printer_metrics")
+
+# The modules that render and spool (batch_spool, imposition, parallel_render,
+# resource_dedup, spool_optimize) all load pypdf, which takes longer than
+# building the window. They are imported where they are first used (the
+# print engine's stages included), so the window comes up without them
+
+# For the startup benchmark (benchmark.py --scenarios startup): when set,
+# the app writes the time its window was up to this file and exits
+STARTUP_PROBE_ENV = "INVOICE_PRINTER_STARTUP_PROBE"
+
+def describe_job(job):
+    if job.unknown:
+        return "print job (no answer from the printer, not sent again)"
+    return f"print job {job.job_id}" if job.job_id else "print command"
+
+class LogReport(RunReport):
+    """A print run as the status log tells it; pause and cancel come from the window"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def keep_going(self):
+        return self.app.checkpoint()
+
+    def cancelled(self):
+        return self.app.cancel_event.is_set()
+
+    def invoice(self, index, total, path):
+        filename = Path(path).name
+        self.app.log(f"Rendering: {filename}" if total is None else f"Processing [{index}/{total}]: {filename}")
+
+    def rendered(self, path, result):
+        sheets = f", {result.output_pages} sheet(s)" if self.app.layout else ""
+        size = page_size_name(self.app.page_size)
+        self.app.log(f"  → {result.total_pages} pages → printing last {result.triplicate_count} triplicate page(s) "
+                     f"({size} size{sheets})")
+        self.app.log(f"  → Sending to printer...")
+
+    def sent(self, path, result, job):
+        self.app.log(f"  → {describe_job(job)} sent successfully\n")
+
+    def added(self, path, result):
+        size = page_size_name(self.app.page_size)
+        self.app.log(f"  → {result.total_pages} pages → adding last {result.triplicate_count} triplicate page(s) "
+                     f"to batch ({size} size)\n")
+
+    def not_printed(self, path, status, error, total_pages=None):
+        # The file name is on the line itself, so it still shows with "Skipped only" / "Errors only"
+        if status == "skipped":
+            self.app.log(f"  → ⚠ SKIPPED {Path(path).name}: {error}\n")
+        else:
+            self.app.log(f"  → ✗ Error ({Path(path).name}): {error}\n")
+
+    def progress(self, done, total):
+        self.app.post_progress(done, total)
+
+    def batch_ready(self, job, chunk_count, stream, dry_run):
+        self.app.log(f"Sending {job.describe_size()} for {len(job.entries)} invoice(s) "
+                     f"as {chunk_count} print job(s)...")
+
+    def chunk_sent(self, chunk, print_job):
+        self.app.log(f"  → Job {chunk}: {describe_job(print_job)} sent successfully")
+
+    def chunk_failed(self, chunk, error):
+        self.app.log(f"  → ✗ Job {chunk}: print error: {error}")
+
+    def chunk_cancelled(self, chunk):
+        self.app.log(f"  → Job {chunk}: cancelled")
+
+    def batch_entry(self, entry, path, result, status, chunk_count, print_job=None):
+        status = "printed" if status == "printed" else "NOT printed"
+        self.app.log(f"{entry.name}: {entry.describe(chunk_count)} ({status})")
+
+    def queued(self, added, total):
+        self.app.log(f"Queued {added} of {total} invoice(s) for the print station "
+                     f"({total - added} already in the shared queue)\n")
+
+    def handed(self, path, result, handed):
+        if handed:
+            self.app.log(f"  → last {result.triplicate_count} page(s) handed to the print station\n")
+        else:
+            self.app.log("  → taken over by another workstation\n")
 
 class TriplicateOnlyPrinter:
     def __init__(self, root):
         self.root = root
         self.root.title("Triplicate Pages Only Printer (Skip >11 Pages)")
-        self.root.geometry("700x550")
+        self.root.geometry("700x795")
         self.root.resizable(False, False)
 
         self.folder_var = tk.StringVar()
         self.prefix_var = tk.StringVar()
         self.start_var = tk.StringVar()
         self.end_var = tk.StringVar()
+        self.batch_var = tk.BooleanVar(value=False)
+        self.workers_var = tk.StringVar(value="1")
+        self.in_memory_var = tk.BooleanVar(value=True)
+        self.two_up_var = tk.BooleanVar(value=False)
+        self.cut_marks_var = tk.BooleanVar(value=False)
+        self.page_size_var = tk.StringVar(value=DEFAULT_PAGE_SIZE)
+        self.optimize_var = tk.BooleanVar(value=False)
+        self.dpi_var = tk.StringVar(value=str(DEFAULT_DPI))
+        self.render_cache_var = tk.BooleanVar(value=True)
+        self.shared_var = tk.BooleanVar(value=False)
+        self.queue_depth_var = tk.StringVar(value=str(DEFAULT_QUEUE_DEPTH))
+        self.metrics_var = tk.BooleanVar(value=False)
+        self.profile_var = tk.BooleanVar(value=False)
+        self.progress_var = tk.StringVar(value="")
+        self.log_filter_var = tk.StringVar(value=ALL_MESSAGES)
+        self.metrics = RunMetrics()
+        self.journal = None
+        self.layout = None  # TwoUpLayout while printing 2-up
+        self.page_size = A5_SIZE  # what every page is fitted to, in points
+        self.optimizer = None  # SpoolOptimizer while optimising the print jobs
+        # The skip and triplicate rules of the current run; a resumed run keeps its own
+        self.max_pages = MAX_PAGES
+        self.max_triplicate = MAX_TRIPLICATE
+        self.reuse_renders = True  # read from render_cache_var when a run starts
+
+        # Every message, whatever the view shows: ring buffers per kind and the spill file
+        self.status_log = StatusLog(LOG_VIEW_LINES, os.path.join(LOG_DIR, SPILL_FILENAME))
+        self.view_lines = 0  # lines in the status text widget
+
+        # The print run happens on a worker thread; it talks to the UI only through events
+        self.events = Queue()
+        self.worker = None
+        self.cancel_event = threading.Event()
+        self.resume_event = threading.Event()  # cleared while paused
+        self.resume_event.set()
 
         self.setup_ui()
+        self.root.protocol("WM_DELETE_WINDOW", self.exit)
+        self.root.after(UI_REFRESH_MS, self.process_events)
 
     def setup_ui(self):
         main_frame = ttk.Frame(self.root, padding="20")
@@ -59,19 +197,101 @@ class TriplicateOnlyPrinter:
         ttk.Label(main_frame, text="Note: Invoices with more than 11 pages will be SKIPPED", 
                   foreground="red", font=("Arial", 9, "bold")).grid(row=5, column=0, columnspan=3, pady=10)
 
+        # Batch mode: one spool job for the whole range
+        options_frame = ttk.Frame(main_frame)
+        options_frame.grid(row=6, column=0, columnspan=3, sticky=tk.W)
+        ttk.Checkbutton(options_frame, text="Send all invoices as a single print job",
+                        variable=self.batch_var).grid(row=0, column=0, sticky=tk.W)
+
+        # Parallel rendering: 1 = process invoices one after another
+        ttk.Label(options_frame, text="Worker processes:").grid(row=0, column=1, padx=(30, 5))
+        ttk.Spinbox(options_frame, from_=1, to=max(os.cpu_count() or 1, 1), width=4,
+                    textvariable=self.workers_var).grid(row=0, column=2, sticky=tk.W)
+
+        # In-memory printing: no temp PDFs written to the invoice folder
+        ttk.Checkbutton(options_frame, text="Print from memory (no temp files in invoice folder)",
+                        variable=self.in_memory_var).grid(row=1, column=0, sticky=tk.W)
+
+        # Throttle on jobs still waiting at the printer instead of fixed pauses
+        ttk.Label(options_frame, text="Max jobs in queue:").grid(row=1, column=1, padx=(30, 5))
+        ttk.Spinbox(options_frame, from_=1, to=50, width=4,
+                    textvariable=self.queue_depth_var).grid(row=1, column=2, sticky=tk.W)
+
+        # Page size every page is fitted to (a name or e.g. 105x148mm);
+        # 2-up: two of those pages side by side on each A4 landscape sheet
+        layout_frame = ttk.Frame(options_frame)
+        layout_frame.grid(row=2, column=0, columnspan=3, sticky=tk.W)
+        ttk.Label(layout_frame, text="Page size:").pack(side=tk.LEFT)
+        ttk.Combobox(layout_frame, values=list(PAGE_SIZES), width=10,
+                     textvariable=self.page_size_var).pack(side=tk.LEFT, padx=(5, 30))
+        ttk.Checkbutton(layout_frame, text="Two pages per A4 sheet (landscape)",
+                        variable=self.two_up_var).pack(side=tk.LEFT)
+        ttk.Checkbutton(layout_frame, text="Cut marks",
+                        variable=self.cut_marks_var).pack(side=tk.LEFT, padx=(30, 0))
+
+        # Downsample images to what the printer can resolve, drop unused objects
+        optimize_frame = ttk.Frame(options_frame)
+        optimize_frame.grid(row=3, column=0, columnspan=3, sticky=tk.W)
+        ttk.Checkbutton(optimize_frame, text="Optimise images for the printer at",
+                        variable=self.optimize_var).pack(side=tk.LEFT)
+        ttk.Spinbox(optimize_frame, from_=72, to=1200, increment=50, width=5,
+                    textvariable=self.dpi_var).pack(side=tk.LEFT, padx=5)
+        ttk.Label(optimize_frame, text="dpi").pack(side=tk.LEFT)
+        # Reprints come straight from the rendered-triplicate cache
+        ttk.Checkbutton(optimize_frame, text="Keep rendered invoices for reprints",
+                        variable=self.render_cache_var).pack(side=tk.LEFT, padx=(30, 0))
+
+        # Diagnostics for slow runs, saved to METRICS_DIR
+        diagnostics_frame = ttk.Frame(options_frame)
+        diagnostics_frame.grid(row=4, column=0, columnspan=3, sticky=tk.W)
+        ttk.Checkbutton(diagnostics_frame, text="Save timing metrics",
+                        variable=self.metrics_var).pack(side=tk.LEFT)
+        ttk.Checkbutton(diagnostics_frame, text="Profile (cProfile, slower)",
+                        variable=self.profile_var).pack(side=tk.LEFT, padx=(30, 0))
+
+        # Several workstations, one print station (invoice_printer_cli.py --print-station)
+        ttk.Checkbutton(options_frame, text="Render here, print on the shared print station",
+                        variable=self.shared_var).grid(row=5, column=0, columnspan=3, sticky=tk.W)
+
         # Buttons
         btn_frame = ttk.Frame(main_frame)
-        btn_frame.grid(row=6, column=0, columnspan=3, pady=20)
-        ttk.Button(btn_frame, text="Print Triplicate Pages Only", command=self.start_printing).pack(side=tk.LEFT, padx=10)
-        ttk.Button(btn_frame, text="Exit", command=self.root.quit).pack(side=tk.LEFT, padx=10)
+        btn_frame.grid(row=7, column=0, columnspan=3, pady=(20, 10))
+        self.print_button = ttk.Button(btn_frame, text="Print Triplicate Pages Only", command=self.start_printing)
+        self.print_button.pack(side=tk.LEFT, padx=10)
+        self.plan_button = ttk.Button(btn_frame, text="Plan Only", command=self.start_planning)
+        self.plan_button.pack(side=tk.LEFT, padx=10)
+        self.pause_button = ttk.Button(btn_frame, text="Pause", command=self.toggle_pause, state=tk.DISABLED)
+        self.pause_button.pack(side=tk.LEFT, padx=10)
+        self.cancel_button = ttk.Button(btn_frame, text="Cancel", command=self.cancel_printing, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, padx=10)
+        self.resume_run_button = ttk.Button(btn_frame, text="Resume Last Run", command=self.resume_last_run)
+        self.resume_run_button.pack(side=tk.LEFT, padx=10)
+        ttk.Button(btn_frame, text="Exit", command=self.exit).pack(side=tk.LEFT, padx=10)
+
+        # Progress
+        progress_frame = ttk.Frame(main_frame)
+        progress_frame.grid(row=8, column=0, columnspan=3, sticky=(tk.W, tk.E))
+        self.progress_bar = ttk.Progressbar(progress_frame, orient=tk.HORIZONTAL, length=520, mode="determinate")
+        self.progress_bar.pack(side=tk.LEFT)
+        ttk.Label(progress_frame, textvariable=self.progress_var).pack(side=tk.LEFT, padx=10)
 
         # Status log
         self.status_text = tk.Text(main_frame, height=15, width=80, wrap=tk.WORD)
-        self.status_text.grid(row=7, column=0, columnspan=3, pady=10)
+        self.status_text.grid(row=9, column=0, columnspan=3, pady=10)
         scrollbar = ttk.Scrollbar(main_frame, orient=tk.VERTICAL, command=self.status_text.yview)
-        scrollbar.grid(row=7, column=3, sticky=(tk.N, tk.S))
+        scrollbar.grid(row=9, column=3, sticky=(tk.N, tk.S))
         self.status_text.configure(yscrollcommand=scrollbar.set)
 
+        # What the status log shows; the filters read the ring buffers, not the widget
+        filter_frame = ttk.Frame(main_frame)
+        filter_frame.grid(row=10, column=0, columnspan=3, sticky=tk.W)
+        ttk.Label(filter_frame, text="Show:").pack(side=tk.LEFT)
+        for text, kind in (("All", ALL_MESSAGES), ("Errors only", ERROR_MESSAGES), ("Skipped only", SKIP_MESSAGES)):
+            ttk.Radiobutton(filter_frame, text=text, value=kind, variable=self.log_filter_var,
+                            command=self.show_log).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Label(filter_frame, text=f"Full log: {os.path.join(LOG_DIR, SPILL_FILENAME)}",
+                  foreground="gray").pack(side=tk.LEFT, padx=(30, 0))
+
         # Default folder
         self.folder_var.set(os.getcwd())
 
@@ -81,118 +301,142 @@ class TriplicateOnlyPrinter:
             self.folder_var.set(folder)
 
     def log(self, message):
-        self.status_text.insert(tk.END, message + "\n")
+        # Safe from any thread; the text widget is updated in process_events
+        self.events.put(("log", message))
+
+    def post_progress(self, done, total):
+        self.events.put(("progress", done, total))
+
+    def process_events(self):
+        """Apply the worker's queued events in one go, then reschedule (runs on the Tk thread)"""
+        lines = []
+        finished = None
+        try:
+            for _ in range(MAX_EVENTS_PER_REFRESH):
+                event = self.events.get_nowait()
+                if event[0] == "log":
+                    lines.append(event[1])
+                elif event[0] == "progress":
+                    done, total = event[1], event[2]
+                    self.progress_bar.configure(maximum=max(total, 1), value=done)
+                    self.progress_var.set(f"{done} / {total}")
+                else:
+                    finished = event
+                    break
+        except Empty:
+            pass
+
+        if lines:
+            shown = self.log_filter_var.get()
+            visible = []
+            for line in lines:
+                kind = self.status_log.add(line)
+                if shown in (ALL_MESSAGES, kind):
+                    visible.append(line)
+            self.status_log.flush()
+            if visible:
+                self.append_log(visible)
+        if finished:
+            self.finish_printing(*finished)
+
+        self.root.after(UI_REFRESH_MS, self.process_events)
+
+    def append_log(self, lines):
+        """Add lines to the status text widget, dropping the oldest beyond LOG_VIEW_LINES (Tk thread)"""
+        # One insert per refresh instead of one redraw per line
+        text = "\n".join(lines) + "\n"
+        self.status_text.insert(tk.END, text)
+        self.view_lines += text.count("\n")
+        excess = self.view_lines - LOG_VIEW_LINES
+        if excess > 0:
+            self.status_text.delete("1.0", f"{excess + 1}.0")
+            self.view_lines -= excess
         self.status_text.see(tk.END)
-        self.root.update()
+
+    def show_log(self):
+        """Refill the status text widget from the ring buffer of the chosen filter (Tk thread)"""
+        self.status_text.delete("1.0", tk.END)
+        self.view_lines = 0
+        lines = self.status_log.lines(self.log_filter_var.get())
+        if lines:
+            self.append_log(lines)
+
+    def clear_log(self):
+        """Empty the status log for a new run; the full log file keeps the old one"""
+        self.status_log.clear()
+        self.status_text.delete("1.0", tk.END)
+        self.view_lines = 0
+
+    def checkpoint(self):
+        """Called by the worker between invoices: waits while paused, returns False once cancelled"""
+        while not self.resume_event.wait(0.2):
+            if self.cancel_event.is_set():
+                break
+        return not self.cancel_event.is_set()
+
+    def toggle_pause(self):
+        if self.resume_event.is_set():
+            self.resume_event.clear()
+            self.pause_button.configure(text="Resume")
+            self.log("Paused (the current invoice finishes first)")
+        else:
+            self.resume_event.set()
+            self.pause_button.configure(text="Pause")
+            self.log("Resumed")
+
+    def cancel_printing(self):
+        if self.worker and not self.cancel_event.is_set():
+            self.cancel_event.set()
+            self.cancel_button.configure(state=tk.DISABLED)
+            self.pause_button.configure(state=tk.DISABLED)
+            self.log("Cancelling... (jobs already sent to the printer are not recalled)")
+
+    def exit(self):
+        if self.worker:
+            if not messagebox.askyesno("Printing", "Invoices are still being printed. Cancel and exit?"):
+                return
+            self.cancel_event.set()
+            self.resume_event.set()
+        self.status_log.close()
+        self.root.quit()
 
     def get_triplicate_count(self, total_pages):
-        if total_pages < 3:
-            return 0
+        from parallel_render import triplicate_count
         # 3-5 → 1, 6-8 → 2, 9-11 → 3
-        return min(((total_pages - 2) + 2) // 3, 3)  # Max 3 triplicate pages
-
-    def create_triplicate_pdf(self, pdf_path):
-        reader = PdfReader(pdf_path)
-        total_pages = len(reader.pages)
-
-        if total_pages > 11:
-            raise ValueError(f"Too many pages ({total_pages} > 11)")
-
-        triplicate_count = self.get_triplicate_count(total_pages)
-        if triplicate_count == 0:
-            raise ValueError("Less than 3 pages: no triplicate pages")
-
-        # A5 size in points: 148mm x 210mm = 419.53 x 595.28 points
-        A5_WIDTH = 419.53
-        A5_HEIGHT = 595.28
-
-        writer = PdfWriter()
-        # Add only the last N pages, resized to A5
-        for i in range(total_pages - triplicate_count, total_pages):
-            page = reader.pages[i]
-            
-            # Get original page dimensions
-            original_width = float(page.mediabox.width)
-            original_height = float(page.mediabox.height)
-            
-            # Calculate scale to fit A5 while maintaining aspect ratio
-            scale_x = A5_WIDTH / original_width
-            scale_y = A5_HEIGHT / original_height
-            scale = min(scale_x, scale_y)  # Use smaller scale to fit both dimensions
-            
-            # Calculate new dimensions
-            new_width = original_width * scale
-            new_height = original_height * scale
-            
-            # Center the page on A5
-            offset_x = (A5_WIDTH - new_width) / 2
-            offset_y = (A5_HEIGHT - new_height) / 2
-            
-            # Create transformation: scale and translate
-            transformation = Transformation().scale(scale, scale).translate(offset_x, offset_y)
-            page.add_transformation(transformation)
-            
-            # Set mediabox to A5 size
-            page.mediabox.lower_left = (0, 0)
-            page.mediabox.upper_right = (A5_WIDTH, A5_HEIGHT)
-            
-            writer.add_page(page)
-
-        temp_path = str(Path(pdf_path).with_name(Path(pdf_path).stem + "_triplicate_only.pdf"))
-        with open(temp_path, "wb") as f:
-            writer.write(f)
-
-        return temp_path, triplicate_count, total_pages
+        return triplicate_count(total_pages, MAX_TRIPLICATE)  # Max 3 triplicate pages
 
-    def print_pdf(self, pdf_path):
-        if not os.path.exists(pdf_path):
-            raise FileNotFoundError(f"File not found: {pdf_path}")
+    def get_workers(self):
+        try:
+            return max(int(self.workers_var.get()), 1)
+        except ValueError:
+            raise ValueError("Invalid number of worker processes")
 
-        system = platform.system()
+    def get_optimizer(self):
+        if not self.optimize_var.get():
+            return None
+        try:
+            dpi = int(self.dpi_var.get())
+        except ValueError:
+            dpi = 0
+        if dpi < 1:
+            raise ValueError("Invalid printer resolution (dpi)")
+        from spool_optimize import SpoolOptimizer
+        return SpoolOptimizer(dpi)
 
-        if system == "Windows":
-            # Method 1: os.startfile - simplest and often silent
-            try:
-                os.startfile(pdf_path, "print")
-                time.sleep(2)
-                return
-            except Exception as e:
-                self.log(f"  → os.startfile failed: {e}")
+    def get_queue_depth(self):
+        try:
+            return max(int(self.queue_depth_var.get()), 1)
+        except ValueError:
+            raise ValueError("Invalid maximum number of queued jobs")
 
-            # Method 2: PowerShell
-            try:
-                ps_cmd = f'Start-Process -FilePath "{pdf_path}" -Verb Print'
-                subprocess.run(["powershell", "-Command", ps_cmd], check=True, timeout=15)
-                time.sleep(2)
-                return
-            except Exception as e:
-                self.log(f"  → PowerShell failed: {e}")
-
-            # Method 3: Adobe Reader
-            adobe_paths = [
-                r"C:\Program Files\Adobe\Acrobat Reader DC\Reader\AcroRd32.exe",
-                r"C:\Program Files (x86)\Adobe\Acrobat Reader DC\Reader\AcroRd32.exe",
-            ]
-            for path in adobe_paths:
-                if os.path.exists(path):
-                    try:
-                        subprocess.run([path, "/t", pdf_path], timeout=20)
-                        time.sleep(2)
-                        return
-                    except:
-                        pass
-
-            raise Exception(
-                "All print methods failed. Please ensure:\n"
-                "1. A PDF viewer is installed (Edge, Chrome, or any PDF app)\n"
-                "2. PDF files are associated with a default application\n"
-                "3. Or install Adobe Reader for more reliable printing"
-            )
-
-        elif system == "Darwin":
-            subprocess.run(["lpr", pdf_path], check=True, timeout=30)
-        else:
-            subprocess.run(["lp", pdf_path], check=True, timeout=30)
+    def engine(self, workers=1):
+        """The PrintEngine of the current run: fitted to the page size, with the run's skip and triplicate rules"""
+        rules = PrintRules(self.max_pages, self.max_triplicate, self.page_size, self.layout, self.optimizer)
+        return PrintEngine(rules, workers, DEFAULT_MAX_BYTES if self.reuse_renders else 0, self.metrics,
+                           log=self.log, print_file=self.print_pdf)
+
+    def print_pdf(self, pdf_path):
+        print_pdf(pdf_path)
 
     def find_files(self):
         folder = Path(self.folder_var.get())
@@ -208,93 +452,278 @@ class TriplicateOnlyPrinter:
         except ValueError:
             raise ValueError("Invalid start/end numbers")
 
-        files = []
-        for num in range(start, end + 1):
-            filename = f"{prefix}{num}.pdf"
-            filepath = folder / filename
-            if filepath.exists():
-                files.append(str(filepath))
-            else:
-                self.log(f"Missing: {filename}")
+        files, missing = discover(folder, [prefix], [(start, end)])
+        for prefix, numbers in missing:
+            self.log(f"Missing ({count_numbers(numbers)}): {format_ranges(numbers, prefix)}")
 
         return files
 
     def start_printing(self):
-        self.status_text.delete(1.0, tk.END)
+        if self.worker:
+            return
+        self.clear_log()
 
         try:
-            files = self.find_files()
-            if not files:
-                messagebox.showwarning("No Files", "No matching invoice files found!")
-                return
-
-            self.log(f"Found {len(files)} invoice(s). Processing (skipping >11 pages)...\n")
-
-            printed_count = 0
-            skipped_count = 0
-            temp_files = []  # Keep track of all temp files
-
-            for i, pdf in enumerate(files, 1):
-                filename = Path(pdf).name
-                self.log(f"Processing [{i}/{len(files)}]: {filename}")
-
-                temp_pdf = None
-                try:
-                    # This will raise error if >11 pages
-                    temp_pdf, count, total_pages = self.create_triplicate_pdf(pdf)
-                    temp_files.append(temp_pdf)  # Track for later deletion
-
-                    self.log(f"  → {total_pages} pages → printing last {count} triplicate page(s) (A5 size)")
-                    self.log(f"  → Sending to printer...")
-                    self.print_pdf(temp_pdf)
-                    self.log(f"  → Print command sent successfully\n")
-                    printed_count += 1
-                    
-                    # Wait longer to ensure print job is queued before moving to next file
-                    time.sleep(3)  # Increased delay to let print job start
-
-                except ValueError as ve:
-                    msg = str(ve)
-                    if "Too many pages" in msg:
-                        self.log(f"  → ⚠ SKIPPED: {msg}\n")
-                        skipped_count += 1
-                    elif "Less than 3 pages" in msg:
-                        self.log(f"  → ⚠ SKIPPED: {msg}\n")
-                        skipped_count += 1
-                    else:
-                        self.log(f"  → Error: {msg}\n")
-
-                except Exception as e:
-                    self.log(f"  → ✗ Print error: {e}\n")
-                    # Keep temp file on error for debugging
-
-            # Wait 30 seconds to ensure all print jobs are fully processed
-            if temp_files:
-                self.log(f"\nWaiting 30 seconds for print jobs to complete...")
-                time.sleep(30)
-                
-                # Now delete all temp files
-                self.log(f"Cleaning up {len(temp_files)} temporary file(s)...")
-                for temp_file in temp_files:
-                    try:
-                        if os.path.exists(temp_file):
-                            os.remove(temp_file)
-                            self.log(f"  → Deleted: {Path(temp_file).name}")
-                    except Exception as e:
-                        self.log(f"  → Warning: Could not delete {Path(temp_file).name}: {e}")
-
-            summary = f"\nFinished!\nPrinted triplicate for {printed_count} invoice(s)"
-            if skipped_count > 0:
-                summary += f"\nSkipped {skipped_count} invoice(s) (>11 pages or <3 pages)"
-            self.log(summary)
-
-            messagebox.showinfo("Complete", summary)
+            # Settings are read here: Tk variables belong to the main thread
+            metrics, profile_path = self.open_diagnostics()
+            with metrics.stage("discovery"):
+                files = self.find_files()
+            workers = self.get_workers()
+            queue_depth = self.get_queue_depth()
+            optimizer = self.get_optimizer()
+            page_size = parse_page_size(self.page_size_var.get())
+            from imposition import two_up_layout
+            layout = two_up_layout(self.two_up_var.get(), self.cut_marks_var.get(), page_size)
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+            self.log(f"Error: {e}")
+            return
+        if not files:
+            messagebox.showwarning("No Files", "No matching invoice files found!")
+            return
+
+        batch, in_memory = self.batch_var.get(), self.in_memory_var.get()
+        if self.shared_var.get():
+            # The shared queue keeps its own record of every invoice
+            self.start_worker(files, False, workers, in_memory, queue_depth, metrics, profile_path, None, layout,
+                              optimizer, shared=True, page_size=page_size)
+            return
+        journal = start_journal(self.folder_var.get().strip(), files,
+                                {"batch": batch, "workers": workers, "in_memory": in_memory,
+                                 "max_queue_depth": queue_depth, "two_up": layout is not None,
+                                 "cut_marks": self.cut_marks_var.get(),
+                                 "optimize_dpi": optimizer.dpi if optimizer else None,
+                                 "page_size": list(page_size), "max_pages": MAX_PAGES,
+                                 "max_triplicate": MAX_TRIPLICATE}, log=self.log)
+        self.start_worker(files, batch, workers, in_memory, queue_depth, metrics, profile_path, journal, layout,
+                          optimizer, page_size=page_size)
+
+    def start_planning(self):
+        """Log what printing the range would take, from the page counts alone, without printing"""
+        if self.worker:
+            return
+        self.clear_log()
 
+        try:
+            files = self.find_files()
+            page_size = parse_page_size(self.page_size_var.get())
+            from imposition import two_up_layout
+            layout = two_up_layout(self.two_up_var.get(), self.cut_marks_var.get(), page_size)
         except Exception as e:
             messagebox.showerror("Error", str(e))
             self.log(f"Error: {e}")
+            return
+        if not files:
+            messagebox.showwarning("No Files", "No matching invoice files found!")
+            return
+
+        self.print_button.configure(state=tk.DISABLED)
+        self.plan_button.configure(state=tk.DISABLED)
+        self.resume_run_button.configure(state=tk.DISABLED)
+        settings = {"batch": self.batch_var.get() and not self.shared_var.get(), "two_up": layout is not None}
+        self.worker = threading.Thread(target=self.run_plan, args=(files, settings), daemon=True)
+        self.worker.start()
+
+    def run_plan(self, files, settings):
+        """The plan of a run, on the worker thread; ends with a "done" or "error" event"""
+        try:
+            from batch_spool import DEFAULT_CHUNK_PAGES
+            from print_plan import format_totals, plan_invoices
+            settings = dict(settings, spool={"max_pages_per_chunk": DEFAULT_CHUNK_PAGES})
+            folder = Path(files[0]).parent
+            page_cache = PageCountCache.for_folder(folder)
+            try:
+                # The same rules as printing: get_triplicate_count and the >11 pages skip
+                plan = plan_invoices(folder, files, settings, MAX_PAGES, MAX_TRIPLICATE, page_cache)
+            finally:
+                if page_cache is not None:
+                    page_cache.close()
+            for invoice in plan.invoices:
+                if invoice.status == "planned":
+                    pages = ", ".join(str(page) for page in invoice.pages)
+                    self.log(f"{invoice.name}: {invoice.total_pages} pages → print page(s) {pages}")
+                elif invoice.skip:
+                    self.log(f"{invoice.name}: ⚠ SKIPPED: {invoice.skip}")
+                else:
+                    self.log(f"{invoice.name}: Error: {invoice.error}")
+            totals = "\n".join(format_totals(plan.totals()))
+            self.log(f"\nPlan (nothing printed):\n{totals}")
+            result = ("done", totals)
+        except Exception as e:
+            self.log(f"Error: {e}")
+            result = ("error", str(e))
+        self.events.put(result)
+
+    def resume_last_run(self):
+        """Print what an interrupted run in this folder didn't get to, with that run's settings"""
+        if self.worker:
+            return
+        folder = self.folder_var.get().strip()
+        self.clear_log()
+        try:
+            resumed = resume_journal(folder, log=self.log) if folder else None
+        except OSError as e:
+            messagebox.showerror("Error", f"Can't open the run journal: {e}")
+            return
+        if resumed is None:
+            messagebox.showinfo("Nothing to Resume", "The last run in this folder finished.")
+            return
+        files, settings, journal = resumed
+        metrics, profile_path = self.open_diagnostics()
+        from imposition import two_up_layout
+        from spool_optimize import SpoolOptimizer
+        # Runs from before the page size was a setting printed on A5
+        page_size = tuple(settings.get("page_size") or A5_SIZE)
+        layout = two_up_layout(settings.get("two_up", False), settings.get("cut_marks", False), page_size)
+        dpi = settings.get("optimize_dpi")
+        # A CLI run (no page limit) is finished under its own rules, not the window's
+        self.start_worker(files, settings.get("batch", False), settings.get("workers", 1),
+                          settings.get("in_memory", True), settings.get("max_queue_depth", DEFAULT_QUEUE_DEPTH),
+                          metrics, profile_path, journal, layout, SpoolOptimizer(dpi) if dpi else None,
+                          page_size=page_size, max_pages=settings.get("max_pages", MAX_PAGES),
+                          max_triplicate=settings.get("max_triplicate", MAX_TRIPLICATE))
+
+    def start_worker(self, files, batch, workers, in_memory, queue_depth, metrics, profile_path, journal, layout,
+                     optimizer=None, shared=False, page_size=A5_SIZE, max_pages=MAX_PAGES,
+                     max_triplicate=MAX_TRIPLICATE):
+        self.reuse_renders = self.render_cache_var.get()
+        self.cancel_event.clear()
+        self.resume_event.set()
+        self.print_button.configure(state=tk.DISABLED)
+        self.plan_button.configure(state=tk.DISABLED)
+        self.pause_button.configure(state=tk.NORMAL, text="Pause")
+        self.cancel_button.configure(state=tk.NORMAL)
+        self.resume_run_button.configure(state=tk.DISABLED)
+        self.post_progress(0, len(files))
+
+        self.worker = threading.Thread(
+            target=self.run_printing,
+            args=(files, batch, workers, in_memory, queue_depth, metrics, profile_path, journal, layout, optimizer,
+                  shared, page_size, max_pages, max_triplicate),
+            daemon=True)
+        self.worker.start()
+
+    def open_diagnostics(self):
+        """RunMetrics for the next run (writing to METRICS_DIR if asked) and the profile path, or None"""
+        if not (self.metrics_var.get() or self.profile_var.get()):
+            return RunMetrics(), None
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        stem = os.path.join(METRICS_DIR, time.strftime("run_%Y%m%d_%H%M%S"))
+        metrics_path = stem + ".jsonl" if self.metrics_var.get() else None
+        profile_path = stem + ".prof" if self.profile_var.get() else None
+        return RunMetrics(metrics_path), profile_path
+
+    def run_printing(self, files, batch, workers, in_memory, queue_depth, metrics=None, profile_path=None,
+                     journal=None, layout=None, optimizer=None, shared=False, page_size=A5_SIZE,
+                     max_pages=MAX_PAGES, max_triplicate=MAX_TRIPLICATE):
+        """The whole print run, on the worker thread; ends with a "done" or "error" event"""
+        self.metrics = metrics or RunMetrics()
+        self.journal = journal
+        self.layout = layout
+        self.page_size = page_size
+        self.optimizer = optimizer
+        self.max_pages = max_pages
+        self.max_triplicate = max_triplicate
+        try:
+            with profiled(profile_path):
+                if shared:
+                    result = ("done", self.render_shared(files, workers))
+                else:
+                    result = ("done", self.print_files(files, batch, workers, in_memory, queue_depth))
+            # A cancelled run stays resumable
+            if journal and not self.cancel_event.is_set():
+                journal.finish()
+        except Exception as e:
+            self.log(f"Error: {e}")
+            result = ("error", str(e))
+        finally:
+            if journal:
+                journal.close()
+            self.journal = None
+
+        run_summary = self.metrics.close()
+        if self.metrics.path:
+            self.log("\n".join(format_summary(run_summary)))
+            self.log(f"Metrics saved to {self.metrics.path}")
+        if profile_path:
+            self.log(f"Profile saved to {profile_path}")
+        self.events.put(result)
+
+    def print_files(self, files, batch, workers, in_memory, queue_depth):
+        """Print every file and wait for the printer; returns the summary text"""
+        # Local temp files (Windows) left behind by a run that crashed
+        cleanup_stale_temp()
+
+        self.log(f"Found {len(files)} invoice(s). Processing (skipping {self.skip_rule()})...\n")
+
+        engine = self.engine(workers)
+        # One IPP connection to CUPS for the whole run, where it answers; lp otherwise
+        queue = engine.open_queue(queue_depth, open_ipp(self.log), self.journal, log=self.log)
+        report = LogReport(self)
+        try:
+            if batch:
+                counts = engine.print_batch(files, queue, report, in_memory, journal=self.journal)
+            else:
+                counts = engine.print_each(files, queue, report, in_memory, journal=self.journal)
+
+            # Wait for the spooler to finish; temp files go as each job completes
+            engine.wait_for_queue(queue, report)
+        finally:
+            queue.close()
+
+        heading = "Cancelled!" if self.cancel_event.is_set() else "Finished!"
+        summary = f"\n{heading}\nPrinted triplicate for {counts['printed']} invoice(s)"
+        if counts["skipped"] > 0:
+            summary += f"\nSkipped {counts['skipped']} invoice(s) ({self.skip_rule()})"
+        self.log(summary)
+        return summary
+
+    def skip_rule(self):
+        """The run's skip rule as the log tells it"""
+        return "<3 pages" if self.max_pages is None else f">{self.max_pages} pages or <3 pages"
+
+    def render_shared(self, files, workers):
+        """Queue the files for the shared print station, then render queued invoices (other workstations' too)
+        until none are left; returns the summary text"""
+        shared = SharedQueue(Path(files[0]).parent)
+        try:
+            counts = self.engine(workers).render_shared(shared, files, LogReport(self))
+        finally:
+            shared.close()
+
+        heading = "Cancelled!" if self.cancel_event.is_set() else "Finished!"
+        summary = f"\n{heading}\nHanded {counts['queued']} invoice(s) to the print station"
+        if counts["skipped"] > 0:
+            summary += f"\nSkipped {counts['skipped']} invoice(s) ({self.skip_rule()})"
+        self.log(summary)
+        return summary
+
+    def finish_printing(self, kind, message):
+        """Re-enable the controls once the worker has finished (Tk thread)"""
+        self.worker = None
+        self.print_button.configure(state=tk.NORMAL)
+        self.plan_button.configure(state=tk.NORMAL)
+        self.pause_button.configure(state=tk.DISABLED, text="Pause")
+        self.cancel_button.configure(state=tk.DISABLED)
+        self.resume_run_button.configure(state=tk.NORMAL)
+        if kind == "error":
+            messagebox.showerror("Error", message)
+        else:
+            messagebox.showinfo("Complete", message)
+
+def report_first_window(root, probe_path):
+    """Draw the window, write the time it was up to probe_path and close it (the startup benchmark)"""
+    root.update()
+    with open(probe_path, "w") as f:
+        f.write(repr(time.time()))
+    root.destroy()
 
 if __name__ == "__main__":
+    # Needed for the worker processes in the frozen .exe
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = TriplicateOnlyPrinter(root)
-    root.mainloop()
\ No newline at end of file
+    if os.environ.get(STARTUP_PROBE_ENV):
+        report_first_window(root, os.environ[STARTUP_PROBE_ENV])
+    else:
+        root.mainloop()
\ No newline at end of file
@@ -5,18 +5,61 @@ Automatically prints invoices with triplicate copies of last pages
 Works on both Windows and Mac
 """
 
+import argparse
+import contextlib
+import json
 import os
 import sys
-from pathlib import Path
-from pypdf import PdfReader, PdfWriter
-import subprocess
-import platform
 import time
+import multiprocessing
+from pathlib import Path
+from batch_spool import DEFAULT_CHUNK_PAGES
+from invoice_engine import PrintEngine, PrintRules, RunReport, discover, open_ipp, print_pdf
+from invoice_index import count_numbers, format_ranges
+from page_cache import PageCountCache
+from render_cache import DEFAULT_MAX_BYTES
+from spooler import DEFAULT_QUEUE_DEPTH, cleanup_stale_temp
+from parallel_render import triplicate_count
+from print_plan import DEFAULT_PAGES_PER_MINUTE, format_totals, load_plan, plan_invoices
+from imposition import two_up_layout
+from page_sizes import DEFAULT_DPI, page_size_name, parse_page_size
+from spool_optimize import SpoolOptimizer
+from metrics import RunMetrics, format_summary, profiled
+from watch_folder import DEFAULT_POLL_INTERVAL, DEFAULT_SETTLE, FolderWatcher
+from run_journal import load_journal, resume_journal, start_journal
+from shared_queue import STATION_POLL_INTERVAL, SharedQueue, SharedQueueError
+
+# Exit status of the headless mode (argparse exits with 2 on bad arguments)
+EXIT_OK = 0
+EXIT_FAILED = 1  # at least one invoice could not be printed
+EXIT_NOTHING_FOUND = 3
 
 
 class InvoicePrinterCLI:
-    def __init__(self):
-        pass
+    def __init__(self, render_cache_size=DEFAULT_MAX_BYTES, use_ipp=True, page_size=None):
+        # Size cap of the rendered-triplicate cache in bytes; 0 turns it off
+        self.render_cache_size = render_cache_size
+        # (width, height) in points every page is fitted to; None keeps the
+        # pages as they are (2-up always fits them to the layout's slots)
+        self.page_size = page_size
+        # The skip and triplicate rules (see PrintRules): every invoice and
+        # all of its triplicate pages, unless a resumed run or a plan says otherwise
+        self.max_pages = None
+        self.max_triplicate = None
+        # Talk IPP to CUPS where it answers, instead of running lp and lpstat
+        self.use_ipp = use_ipp
+        self._ipp = None
+        self._ipp_checked = False
+    
+    def ipp_printer(self):
+        """
+        The IPP connection to CUPS, opened on first use and kept for every
+        later job (watch mode included); None where printing goes through lp
+        """
+        if self.use_ipp and not self._ipp_checked:
+            self._ipp_checked = True
+            self._ipp = open_ipp()
+        return self._ipp
         
     def get_triplicate_pages(self, total_pages):
         """
@@ -26,120 +69,26 @@ class InvoicePrinterCLI:
         - 9-11 pages: last 3 pages triplicate
         - Pattern: for pages in range (3n, 3n+2], last n pages triplicate
         """
-        if total_pages < 3:
-            return 0
-        
         # Calculate: pages 3-5 -> 1, pages 6-8 -> 2, pages 9-11 -> 3, etc.
-        # Formula: ceil((total_pages - 2) / 3)
-        triplicate_count = ((total_pages - 2) + 2) // 3
-        return min(triplicate_count, total_pages)  # Don't exceed total pages
+        # Formula: ceil((total_pages - 2) / 3), never more than total pages
+        return triplicate_count(total_pages, self.max_triplicate)
         
-    def create_triplicate_pdf(self, pdf_path):
+    def engine(self, workers=1, metrics=None, layout=None, optimizer=None):
         """
-        Create a new PDF with ONLY the triplicate pages (last page(s))
-        (No original pages, just the last page(s) printed once)
+        The PrintEngine of a run: pages fitted to page_size (to the
+        layout's slots with 2-up), under max_pages and max_triplicate
+        (by default no page limit, every page of the triplicate rule)
         """
-        try:
-            reader = PdfReader(pdf_path)
-            writer = PdfWriter()
-            total_pages = len(reader.pages)
-            
-            triplicate_count = self.get_triplicate_pages(total_pages)
-            
-            if triplicate_count == 0:
-                raise Exception("PDF has less than 3 pages - no triplicate pages to print")
-            
-            # Add ONLY the triplicate pages (last page(s), printed once)
-            start_triplicate = total_pages - triplicate_count
-            # Add the last page(s) once
-            for i in range(start_triplicate, total_pages):
-                page = reader.pages[i]
-                writer.add_page(page)
-            
-            # Save to temporary file
-            temp_path = pdf_path.replace('.pdf', '_temp_print.pdf')
-            with open(temp_path, 'wb') as output_file:
-                writer.write(output_file)
-                
-            return temp_path, total_pages, triplicate_count
-            
-        except Exception as e:
-            raise Exception(f"Error processing PDF {pdf_path}: {str(e)}")
+        rules = PrintRules(self.max_pages, self.max_triplicate, self.page_size, layout, optimizer)
+        return PrintEngine(rules, workers, self.render_cache_size, metrics, log=print, print_file=self.print_pdf)
     
     def print_pdf(self, pdf_path):
         """
         Print PDF using system default printer
-        Works on both Windows and Mac
+        Works on Windows, Mac and Linux (see invoice_engine.print_pdf)
         """
-        system = platform.system()
-        errors = []
-        
         try:
-            if system == "Windows":
-                # Windows: Try multiple methods to print PDF
-                
-                # Method 1: Try using Adobe Reader if available (most reliable)
-                acroread_paths = [
-                    r"C:\Program Files\Adobe\Acrobat DC\Acrobat\Acrobat.exe",
-                    r"C:\Program Files (x86)\Adobe\Acrobat Reader DC\Reader\AcroRd32.exe",
-                    r"C:\Program Files\Adobe\Acrobat Reader DC\Reader\AcroRd32.exe",
-                ]
-                for acroread_path in acroread_paths:
-                    if os.path.exists(acroread_path):
-                        try:
-                            subprocess.run([
-                                acroread_path, "/t", pdf_path
-                            ], check=True, timeout=20)
-                            time.sleep(2)
-                            return  # Success!
-                        except Exception as e:
-                            errors.append(f"Adobe Reader: {str(e)}")
-                            continue
-                
-                # Method 2: Try PowerShell with Start-Process and Print verb
-                try:
-                    ps_command = f'Start-Process -FilePath "{pdf_path}" -Verb Print -WindowStyle Hidden'
-                    result = subprocess.run([
-                        "powershell", "-Command", ps_command
-                    ], check=True, timeout=20, capture_output=True, text=True)
-                    if result.returncode == 0:
-                        time.sleep(2)
-                        return  # Success!
-                    else:
-                        errors.append(f"PowerShell: {result.stderr}")
-                except Exception as e:
-                    errors.append(f"PowerShell: {str(e)}")
-                
-                # Method 3: Try os.startfile with print verb
-                try:
-                    os.startfile(pdf_path, "print")
-                    time.sleep(2)
-                    return  # Success!
-                except Exception as e:
-                    errors.append(f"os.startfile: {str(e)}")
-                
-                # If all methods fail, provide helpful error
-                error_details = "\n".join(errors) if errors else "All print methods failed"
-                raise Exception(
-                    f"Could not print PDF.\n\n"
-                    f"Errors: {error_details}\n\n"
-                    f"Solutions:\n"
-                    f"1. Install Adobe Reader (free) from adobe.com\n"
-                    f"2. Set a default PDF application\n"
-                    f"3. Manually print: {pdf_path}"
-                )
-            elif system == "Darwin":  # macOS
-                # macOS: use lpr command
-                subprocess.run(["lpr", pdf_path], check=True, timeout=30)
-            else:
-                # Linux fallback
-                subprocess.run(["lp", pdf_path], check=True, timeout=30)
-                
-            # Small delay to allow print job to be queued
-            time.sleep(1)
-                
-        except subprocess.TimeoutExpired:
-            raise Exception("Print command timed out")
+            print_pdf(pdf_path)
         except Exception as e:
             raise Exception(f"Error printing PDF: {str(e)}")
     
@@ -147,100 +96,804 @@ class InvoicePrinterCLI:
         """
         Find all invoice PDF files in the given range
         """
-        files = []
-        folder = Path(folder_path)
-        
-        if not folder.exists():
-            raise FileNotFoundError(f"Folder not found: {folder_path}")
-        
-        for invoice_no in range(start_no, end_no + 1):
-            # Try with prefix
-            if prefix:
-                filename = f"{prefix}{invoice_no}.pdf"
-            else:
-                filename = f"{invoice_no}.pdf"
-            
-            file_path = folder / filename
-            if file_path.exists():
-                files.append(file_path)
-            else:
-                print(f"Warning: {filename} not found")
-        
-        return files
+        paths, _ = self.collect_invoice_files(folder_path, [prefix or ""], [(start_no, end_no)])
+        return paths
     
-    def print_invoices(self, folder_path, prefix, start_no, end_no):
+    def collect_invoice_files(self, folder_path, prefixes, ranges):
+        """
+        Invoice files for every prefix and every (start, end) range, from
+        a single listing of the folder, in the order given and without
+        duplicates. Returns (paths, number of missing invoices)
+        """
+        paths, missing = discover(folder_path, prefixes, ranges)
+        for prefix, numbers in missing:
+            print(f"Warning: {count_numbers(numbers)} invoice(s) not found: {format_ranges(numbers, prefix)}")
+        return [Path(path) for path in paths], sum(count_numbers(numbers) for prefix, numbers in missing)
+    
+    def print_invoices(self, folder_path, prefix, start_no, end_no, batch=False, workers=1, in_memory=True,
+                       max_queue_depth=DEFAULT_QUEUE_DEPTH, metrics=None, layout=None, optimizer=None):
         """
         Main function to process and print invoices
+        With batch=True every invoice's triplicate pages are merged into
+        one spool job (split into chunks for very large ranges)
+        With workers > 1 invoices are parsed by a pool of worker processes
+        With in_memory=True nothing is written to the invoice folder
+        At most max_queue_depth jobs are kept waiting at the printer
+        Stage timings go to metrics (a RunMetrics) when given
+        With a layout (imposition.TwoUpLayout) two pages go on each sheet
+        With an optimizer (spool_optimize.SpoolOptimizer) images are
+        downsampled to the printer's resolution and unused objects dropped
         """
+        metrics = metrics or RunMetrics()
         print(f"\n{'='*60}")
         print("Invoice Printer - Triplicate Last Pages")
         print(f"{'='*60}\n")
         
         # Find invoice files
         print(f"Searching for invoices from {start_no} to {end_no}...")
-        invoice_files = self.find_invoice_files(folder_path, prefix, start_no, end_no)
+        with metrics.stage("discovery"):
+            invoice_files = self.find_invoice_files(folder_path, prefix, start_no, end_no)
         
         if not invoice_files:
             print("No invoice files found in the specified range")
             return False
         
         print(f"Found {len(invoice_files)} invoice file(s)\n")
+        journal = start_journal(folder_path, invoice_files,
+                                journal_settings(batch, workers, in_memory, max_queue_depth, layout, optimizer,
+                                                 page_size=self.page_size, max_pages=self.max_pages,
+                                                 max_triplicate=self.max_triplicate))
+        try:
+            self.print_files(folder_path, invoice_files, batch, workers, in_memory, max_queue_depth, metrics,
+                             journal=journal, layout=layout, optimizer=optimizer)
+            if journal:
+                journal.finish()
+        finally:
+            if journal:
+                journal.close()
+        return True
+    
+    def print_files(self, folder_path, invoice_files, batch=False, workers=1, in_memory=True,
+                    max_queue_depth=DEFAULT_QUEUE_DEPTH, metrics=None, dry_run=False, on_result=None, journal=None,
+                    layout=None, optimizer=None, spool_options=None, queue=None):
+        """
+        Print the triplicate pages of the given invoice files, in order.
+        Shared by the interactive and the headless CLI
+        - batch: merge every invoice's pages into one spool job (split into
+          chunks for very large ranges)
+        - dry_run: read and select the pages, but send nothing to the printer
+        - on_result: called with a dict per invoice (see report)
+        - journal: a started RunJournal that records every invoice's state
+        - layout: impose the pages (fitted to its slots) two per sheet; batch
+          jobs fill sheets across invoices, single jobs per invoice
+        - optimizer: a SpoolOptimizer run on every print job before it is sent
+        - spool_options: how batch jobs are chunked and streamed (see
+          PrintEngine.print_batch)
+        - queue: a PrintQueue the caller keeps open across runs (watch
+          mode); its jobs are left to the caller instead of waited for
+        Returns the counts per status: printed, skipped, failed, planned
+        """
+        # Local temp files (Windows) left behind by a run that crashed
+        cleanup_stale_temp()
         
-        # Process each invoice
-        temp_files = []
-        success_count = 0
+        engine = self.engine(workers, metrics, layout, optimizer)
+        own_queue = queue is None
+        if own_queue:
+            queue = engine.open_queue(max_queue_depth, ipp=None if dry_run else self.ipp_printer(), journal=journal)
+        report = ConsoleReport(engine.rules, on_result, batch, dry_run)
+        if batch:
+            counts = engine.print_batch(invoice_files, queue, report, in_memory, dry_run, journal, spool_options,
+                                        folder=folder_path)
+        else:
+            counts = engine.print_each(invoice_files, queue, report, in_memory, dry_run, journal)
+        if own_queue:
+            engine.wait_for_queue(queue)
         
-        for i, pdf_path in enumerate(invoice_files, 1):
-            print(f"\n[{i}/{len(invoice_files)}] Processing {pdf_path.name}...")
-            temp_path = None
-            
+        print(f"\n{'='*60}")
+        print(f"Process completed! Successfully printed {counts['printed']}/{len(invoice_files)} invoice(s)")
+        print(f"{'='*60}\n")
+        return counts
+    
+    def render_shared(self, shared, invoice_files, workers=1, metrics=None, layout=None, optimizer=None,
+                      on_result=None, requeue=False):
+        """
+        Workstation of a shared queue: add the invoices to the queue
+        (requeue: again, even those printed already), then render queued
+        invoices (these and other workstations') and leave them for the
+        print station, until nothing is left to claim
+        Returns the counts per status: queued (handed to the print
+        station), skipped, failed
+        """
+        engine = self.engine(workers, metrics, layout, optimizer)
+        return engine.render_shared(shared, invoice_files, ConsoleReport(engine.rules, on_result), requeue)
+    
+    def serve_print_station(self, shared, max_queue_depth=DEFAULT_QUEUE_DEPTH, metrics=None, on_result=None,
+                            counts=None):
+        """
+        Print station of a shared queue: send the invoices the
+        workstations render to the printer, in queue order, until
+        Ctrl+C. Adds the printed and failed invoices to counts
+        """
+        engine = PrintEngine(metrics=metrics, print_file=self.print_pdf)
+        metrics = engine.metrics
+        counts = counts if counts is not None else {"printed": 0, "failed": 0}
+        queue = engine.open_queue(max_queue_depth, ipp=self.ipp_printer())
+        try:
+            while True:
+                queue.wait_for_slot()
+                # Only as many as the printer takes now: an invoice marked printing is never sent again
+                invoices = shared.take_rendered(max_queue_depth - len(queue.active))
+                if not invoices:
+                    queue.poll()
+                    time.sleep(STATION_POLL_INTERVAL)
+                    continue
+                for invoice in invoices:
+                    path = shared.output_path(invoice)
+                    pdf_path = Path(shared.folder) / invoice.name
+                    try:
+                        size = os.path.getsize(path)
+                        with metrics.stage("submit", invoice.name):
+                            job = queue.submit_file(path, invoice.name, cleanup=True)
+                    except Exception as e:
+                        shared.print_failed(invoice, str(e))
+                        print(f"{invoice.name}: ✗ {e}")
+                        self.report(on_result, counts, pdf_path, "failed", invoice.total_pages,
+                                    invoice.triplicate_count, error=str(e), station=invoice.station)
+                        continue
+                    shared.printed(invoice, job.job_id)
+                    metrics.record_job(invoice.name, job, size)
+                    print(f"{invoice.name}: last {invoice.triplicate_count} page(s) from {invoice.station} "
+                          f"✓ {job.job_id or ''}".rstrip())
+                    self.report(on_result, counts, pdf_path, "printed", invoice.total_pages,
+                                invoice.triplicate_count, job_id=job.job_id, station=invoice.station)
+        finally:
+            engine.wait_for_queue(queue)
+    
+    def planned_files(self, plan, counts, on_result=None):
+        """
+        The invoices a print plan prints, in order. Those it skips or
+        couldn't read are reported as such without being opened again
+        """
+        files = []
+        for invoice in plan.invoices:
+            path = Path(plan.folder) / invoice.name
+            if invoice.status == "planned":
+                if invoice.changed(plan.folder):
+                    print(f"Warning: {invoice.name} changed since it was planned; printing it as it is now")
+                files.append(path)
+            else:
+                reason = invoice.skip or invoice.error
+                print(f"{invoice.name}: {invoice.status} in the plan ({reason})")
+                self.report(on_result, counts, path, invoice.status, invoice.total_pages, error=reason)
+        return files
+    
+    def report(self, on_result, counts, pdf_path, status, total_pages=None, triplicate_count=None, **extra):
+        """
+        Count one invoice's outcome and pass it on as a result record
+        """
+        counts[status] += 1
+        if on_result:
+            on_result(result_record(pdf_path, status, total_pages, triplicate_count, **extra))
+
+
+def result_record(pdf_path, status, total_pages=None, triplicate_count=None, **extra):
+    """
+    The result record of one invoice (see --results)
+    """
+    record = {"type": "invoice", "invoice": Path(pdf_path).name, "path": str(pdf_path), "status": status,
+              "pages": total_pages, "triplicate_pages": triplicate_count}
+    record.update(extra)
+    return record
+
+
+class ConsoleReport(RunReport):
+    """
+    A print run as the CLI tells it: progress lines on stdout, and a
+    result record per invoice to on_result
+    """
+    
+    def __init__(self, rules, on_result=None, batch=False, dry_run=False):
+        self.rules = rules
+        self.on_result = on_result
+        self.batch = batch
+        self.dry_run = dry_run
+        self.claimed = False  # the invoice came from the shared queue
+    
+    def record(self, pdf_path, status, total_pages=None, triplicate_count=None, **extra):
+        if self.on_result:
+            self.on_result(result_record(pdf_path, status, total_pages, triplicate_count, **extra))
+    
+    def invoice(self, index, total, path):
+        self.claimed = total is None
+        if self.claimed:
+            return
+        if self.batch:
+            print(f"[{index}/{total}] Processing {Path(path).name}...", end=" ", flush=True)
+        else:
+            print(f"\n[{index}/{total}] Processing {Path(path).name}...")
+    
+    def rendered(self, path, result):
+        print(f"  - Original PDF pages: {result.total_pages}")
+        print(f"  - Triplicate pages: last {result.triplicate_count} page(s)")
+        if self.rules.fit_size:
+            print(f"  - Fitted to: {page_size_name(self.rules.fit_size)}")
+        # Counted by the writer, not by parsing the PDF again
+        if self.rules.layout:
+            print(f"  - Sheets to print: {result.output_pages} ({self.rules.layout.slots} pages per sheet)")
+        else:
+            print(f"  - Pages to print: {result.output_pages} (once)")
+        if result.optimized and result.optimized["images_downsampled"]:
+            print(f"  - Images downsampled to {self.rules.optimizer.dpi} dpi: "
+                  f"{result.optimized['images_downsampled']}")
+        if not self.dry_run:
+            print(f"  - Sending to printer...", end=" ", flush=True)
+    
+    def planned(self, path, result):
+        print("  - Dry run: not sent")
+        self.record(path, "planned", result.total_pages, result.triplicate_count)
+    
+    def sent(self, path, result, job):
+        if job.unknown:
+            print("? no answer from the printer, not sent again")
+            self.record(path, "printed", result.total_pages, result.triplicate_count, job_unknown=True)
+            return
+        print(f"✓ {job.job_id or ''}".rstrip())
+        self.record(path, "printed", result.total_pages, result.triplicate_count, job_id=job.job_id)
+    
+    def added(self, path, result):
+        print(f"{result.total_pages} page(s), last {result.triplicate_count} added")
+    
+    def not_printed(self, path, status, error, total_pages=None):
+        if self.claimed:
+            print(f"  {Path(path).name}: ✗ {error}")
+        else:
+            print(f"✗ Error: {error}")
+        self.record(path, status, total_pages, error=str(error))
+    
+    def batch_ready(self, job, chunk_count, stream, dry_run):
+        if dry_run:
+            print(f"\nDry run: {job.describe_size()} for {len(job.entries)} invoice(s) "
+                  f"would be sent as {chunk_count} print job(s)")
+        elif stream:
+            print(f"\nSent {job.describe_size()} for {len(job.entries)} invoice(s) "
+                  f"as {chunk_count} print job(s)")
+        else:
+            print(f"\nSending {job.describe_size()} for {len(job.entries)} invoice(s) "
+                  f"as {chunk_count} print job(s)...")
+    
+    def chunk_sent(self, chunk, print_job):
+        if print_job.unknown:
+            print(f"  - Job {chunk}: ? no answer from the printer, not sent again")
+        else:
+            print(f"  - Job {chunk}: ✓ {print_job.job_id or ''}".rstrip())
+    
+    def chunk_failed(self, chunk, error):
+        print(f"  - Job {chunk}: ✗ Error: {error}")
+    
+    def batch_entry(self, entry, path, result, status, chunk_count, print_job=None):
+        where = {"batch_job": entry.chunk, f"first_{entry.unit}": entry.first_page,
+                 f"last_{entry.unit}": entry.last_page}
+        if status == "planned":
+            print(f"  {entry.name}: {entry.describe(chunk_count)}")
+        elif status == "printed":
+            where["job_id"] = print_job.job_id
+            if print_job.unknown:
+                where["job_unknown"] = True
+            print(f"  {entry.name}: {entry.describe(chunk_count)} ✓")
+        else:
+            where["error"] = "Batch print job failed"
+            print(f"  {entry.name}: {entry.describe(chunk_count)} ✗ not printed")
+        self.record(path, status, result.total_pages, result.triplicate_count, **where)
+    
+    def queued(self, added, total):
+        print(f"Queued {added} invoice(s) for the print station", end="")
+        if added < total:
+            print(f", {total - added} already in the shared queue", end="")
+        print()
+    
+    def handed(self, path, result, handed):
+        if handed:
+            print(f"  {Path(path).name}: last {result.triplicate_count} page(s) → print station")
+            self.record(path, "queued", result.total_pages, result.triplicate_count)
+        else:
+            print(f"  {Path(path).name}: taken over by another workstation")
+
+
+def parse_range(text):
+    """
+    "300-450" → [(300, 450)], "305" → [(305, 305)], "1-5,9" → [(1, 5), (9, 9)]
+    """
+    ranges = []
+    for part in text.split(","):
+        start, _, end = part.strip().partition("-")
+        try:
+            start_no = int(start)
+            end_no = int(end) if end else start_no
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid range: {part!r} (expected e.g. 300-450)")
+        if start_no > end_no:
+            raise argparse.ArgumentTypeError(f"invalid range: {part!r} (start is after end)")
+        ranges.append((start_no, end_no))
+    return ranges
+
+
+def page_size_arg(text):
+    """
+    --page-size: a paper name or WIDTHxHEIGHT, see page_sizes.parse_page_size
+    """
+    try:
+        return parse_page_size(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Print the triplicate last pages of a range of invoices. "
+                    "Without --folder the options are asked for interactively")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="Append per-invoice stage timings and a percentile summary to FILE (JSON Lines)")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="Save a cProfile of the run to FILE (open with pstats or snakeviz)")
+    parser.add_argument("--render-cache", type=float, default=DEFAULT_MAX_BYTES / (1024 * 1024), metavar="MB",
+                        help=f"Keep up to MB megabytes of rendered invoices for reprints "
+                             f"(default {DEFAULT_MAX_BYTES // (1024 * 1024)}, 0 to turn off)")
+    parser.add_argument("--no-ipp", action="store_true",
+                        help="Print through lp and lpstat instead of talking IPP to CUPS directly")
+    
+    headless = parser.add_argument_group("headless mode (no prompts)")
+    headless.add_argument("--folder", help="Invoice folder; runs without any prompts")
+    headless.add_argument("--prefix", action="append", dest="prefixes", metavar="PREFIX",
+                          help="Invoice prefix, e.g. C for C300.pdf; repeat for several (default: none)")
+    headless.add_argument("--range", action="append", dest="ranges", type=parse_range, metavar="START-END",
+                          help="Invoice numbers, e.g. 300-450 or 1-99,120; repeat for several")
+    headless.add_argument("--workers", type=int, default=1, help="Worker processes (default 1)")
+    headless.add_argument("--batch", action="store_true", help="Send all invoices as a single print job")
+    headless.add_argument("--page-size", type=page_size_arg, metavar="SIZE",
+                          help="Fit every page to this size: A5, A4, Letter, Legal or WIDTHxHEIGHT[mm|cm|in] "
+                               "(default: pages keep their size, A5 with --two-up)")
+    headless.add_argument("--two-up", action="store_true",
+                          help="Print two pages (A5 or --page-size) side by side on each A4 landscape sheet")
+    headless.add_argument("--cut-marks", action="store_true", help="With --two-up: mark where to cut the sheets")
+    headless.add_argument("--optimize", type=int, nargs="?", const=DEFAULT_DPI, metavar="DPI",
+                          help=f"Downsample images to the printer resolution (default {DEFAULT_DPI} dpi), "
+                               f"compress and drop unused objects before sending")
+    headless.add_argument("--stream", action="store_true",
+                          help="With --batch: send each print job as soon as it is full, keeping memory flat")
+    headless.add_argument("--chunk-pages", type=int, default=DEFAULT_CHUNK_PAGES, metavar="N",
+                          help=f"With --batch: at most N pages (sheets) per print job (default {DEFAULT_CHUNK_PAGES})")
+    headless.add_argument("--chunk-size", type=float, metavar="MB",
+                          help="With --batch: start a new print job once one reaches about MB megabytes")
+    headless.add_argument("--dry-run", action="store_true", help="Read and check the invoices but print nothing")
+    headless.add_argument("--plan", metavar="FILE",
+                          help="Print nothing: write a manifest of the pages each invoice would print (or why it "
+                               "is skipped) with the sheets, spool size and print time to FILE ('-' for stdout), "
+                               "reading only page counts")
+    headless.add_argument("--from-plan", metavar="FILE",
+                          help="Print the invoices of a --plan manifest, with the settings it was planned with")
+    headless.add_argument("--pages-per-minute", type=float, default=DEFAULT_PAGES_PER_MINUTE, metavar="N",
+                          help=f"With --plan: printer speed for the print time (default {DEFAULT_PAGES_PER_MINUTE})")
+    headless.add_argument("--resume", action="store_true",
+                          help="Finish the interrupted run in --folder: print only what it hadn't sent yet")
+    headless.add_argument("--queue-depth", type=int, default=DEFAULT_QUEUE_DEPTH,
+                          help=f"Max jobs waiting at the printer (default {DEFAULT_QUEUE_DEPTH})")
+    headless.add_argument("--temp-files", action="store_true",
+                          help="Print via temporary files next to the invoices instead of from memory")
+    headless.add_argument("--results", metavar="FILE",
+                          help="Write one JSON line per invoice plus a summary line to FILE ('-' for stdout)")
+    
+    watch = parser.add_argument_group("watch mode (print new invoices as they arrive)")
+    watch.add_argument("--watch", action="store_true",
+                       help="Keep running and print every new invoice in --folder (no --range)")
+    watch.add_argument("--start", type=int, metavar="N",
+                       help="First invoice number to print when a prefix is watched for the first time "
+                            "(default: only invoices that arrive from now on)")
+    watch.add_argument("--settle", type=float, default=DEFAULT_SETTLE,
+                       help=f"Seconds a new file must stay unchanged before printing (default {DEFAULT_SETTLE:g})")
+    watch.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                       help=f"Seconds between folder listings without inotify (default {DEFAULT_POLL_INTERVAL:g})")
+    
+    shared = parser.add_argument_group("shared queue (several workstations feeding one print station)")
+    shared.add_argument("--shared", action="store_true",
+                        help="Hand the invoices to the shared queue in --folder: render them here and "
+                             "let the print station print them")
+    shared.add_argument("--requeue", action="store_true",
+                        help="With --shared: queue the invoices again even if they were printed or skipped "
+                             "already (a reprint)")
+    shared.add_argument("--print-station", action="store_true",
+                        help="Print everything the workstations hand to the shared queue in --folder, until Ctrl+C")
+    shared.add_argument("--release-printing", action="store_true",
+                        help="With --print-station: send again what the last print station left marked printing "
+                             "(check the printer first: they may have printed)")
+    
+    args = parser.parse_args(argv)
+    if args.print_station:
+        if not args.folder:
+            parser.error("--print-station needs --folder")
+        if args.ranges or args.shared or args.watch or args.batch or args.resume or args.dry_run:
+            parser.error("--print-station only prints what the workstations render; "
+                         "drop --range/--shared/--watch/--batch/--resume/--dry-run")
+    elif args.watch:
+        if not args.folder:
+            parser.error("--watch needs --folder")
+        if args.ranges or args.batch:
+            parser.error("--watch prints invoices one by one as they arrive; drop --range/--batch")
+    elif args.resume:
+        if not args.folder or args.ranges:
+            parser.error("--resume needs --folder and takes the invoices from the interrupted run, not --range")
+    elif args.from_plan:
+        if args.ranges or args.plan or args.shared:
+            parser.error("--from-plan prints the invoices of the plan; drop --range/--plan/--shared")
+    elif args.folder and not args.ranges:
+        parser.error("--folder needs at least one --range")
+    if args.ranges and not args.folder:
+        parser.error("--range needs --folder")
+    if args.requeue and not args.shared:
+        parser.error("--requeue needs --shared")
+    if args.release_printing and not args.print_station:
+        parser.error("--release-printing needs --print-station")
+    if args.shared and (args.watch or args.batch or args.resume or args.dry_run):
+        parser.error("--shared hands single invoices to the print station; drop --watch/--batch/--resume/--dry-run")
+    if args.plan and (not args.folder or args.resume or args.watch or args.shared or args.dry_run):
+        parser.error("--plan needs --folder and --range; drop --resume/--watch/--shared/--dry-run")
+    if args.plan == "-" and args.results == "-":
+        parser.error("--plan and --results can't both go to stdout")
+    if args.pages_per_minute <= 0:
+        parser.error("--pages-per-minute must be positive")
+    if args.cut_marks and not args.two_up:
+        parser.error("--cut-marks needs --two-up")
+    if args.two_up and args.page_size:
+        try:
+            two_up_layout(True, page_size=args.page_size)
+        except ValueError as e:
+            parser.error(f"--page-size with --two-up: {e}")
+    chunking = args.stream or args.chunk_size or args.chunk_pages != DEFAULT_CHUNK_PAGES
+    if chunking and not (args.batch or args.resume or args.from_plan):
+        parser.error("--stream, --chunk-pages and --chunk-size need --batch")
+    if args.chunk_pages < 1 or (args.chunk_size is not None and args.chunk_size <= 0):
+        parser.error("--chunk-pages and --chunk-size must be positive")
+    if args.render_cache < 0:
+        parser.error("--render-cache can't be negative")
+    if args.optimize is not None and args.optimize < 1:
+        parser.error("--optimize needs a positive DPI")
+    if args.workers < 1 or args.queue_depth < 1:
+        parser.error("--workers and --queue-depth must be at least 1")
+    return args
+
+
+class ResultWriter:
+    """
+    JSON Lines results: to a file, to stdout ("-"), or nowhere (None)
+    """
+    
+    def __init__(self, path):
+        self.to_stdout = path == "-"
+        self.file = sys.stdout if self.to_stdout else (open(path, "w", encoding="utf-8") if path else None)
+    
+    def write(self, record):
+        if self.file:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+    
+    def progress(self):
+        """
+        Where progress messages go: stderr while stdout carries the results
+        """
+        return contextlib.redirect_stdout(sys.stderr) if self.to_stdout else contextlib.nullcontext()
+    
+    def close(self):
+        if self.file and not self.to_stdout:
+            self.file.close()
+
+
+def exit_status(found, counts):
+    if not found:
+        return EXIT_NOTHING_FOUND
+    return EXIT_FAILED if counts["failed"] else EXIT_OK
+
+
+def journal_settings(batch, workers, in_memory, max_queue_depth, layout=None, optimizer=None, spool_options=None,
+                     page_size=None, max_pages=None, max_triplicate=None):
+    settings = {"batch": batch, "workers": workers, "in_memory": in_memory, "max_queue_depth": max_queue_depth,
+                "optimize_dpi": optimizer.dpi if optimizer else None, "spool": spool_options,
+                "page_size": list(page_size) if page_size else None, "max_pages": max_pages,
+                "max_triplicate": max_triplicate}
+    settings.update(layout.settings() if layout else {"two_up": False})
+    return settings
+
+
+def make_optimizer(dpi):
+    return SpoolOptimizer(dpi) if dpi else None
+
+
+def render_cache_size(args):
+    return int(args.render_cache * 1024 * 1024)
+
+
+def spool_options(args):
+    """
+    The BatchSpoolJob chunking and streaming options of the command line
+    """
+    options = {"stream": args.stream, "max_pages_per_chunk": args.chunk_pages}
+    if args.chunk_size:
+        options["max_bytes_per_chunk"] = int(args.chunk_size * 1024 * 1024)
+    return options
+
+
+def run_plan(args):
+    """
+    Write the --plan manifest for every --prefix × --range: what each
+    invoice would print and what the run would cost, printing nothing.
+    Returns the exit status
+    """
+    printer = InvoicePrinterCLI(render_cache_size(args), use_ipp=False, page_size=args.page_size)
+    prefixes = args.prefixes or [""]
+    ranges = [r for group in args.ranges or [] for r in group]
+    results = ResultWriter(args.results)
+    start = time.monotonic()
+    counts = {"printed": 0, "skipped": 0, "failed": 0, "planned": 0}
+    # The manifest may be what goes to stdout
+    progress = contextlib.redirect_stdout(sys.stderr) if args.plan == "-" else results.progress()
+    try:
+        with progress:
+            invoice_files, missing_count = printer.collect_invoice_files(args.folder, prefixes, ranges)
+            layout = two_up_layout(args.two_up, args.cut_marks, args.page_size)
+            settings = journal_settings(args.batch, args.workers, not args.temp_files, args.queue_depth, layout,
+                                        make_optimizer(args.optimize), spool_options(args), args.page_size,
+                                        printer.max_pages, printer.max_triplicate)
+            # The same rules as printing (see engine)
+            page_cache = PageCountCache.for_folder(args.folder)
+            try:
+                plan = plan_invoices(args.folder, invoice_files, settings, printer.max_pages, printer.max_triplicate,
+                                     page_cache, pages_per_minute=args.pages_per_minute)
+            finally:
+                if page_cache is not None:
+                    page_cache.close()
+            print(f"Found {len(invoice_files)} invoice file(s)")
+            for invoice in plan.invoices:
+                if invoice.status != "planned":
+                    print(f"  {invoice.name}: {invoice.status} ({invoice.skip or invoice.error})")
+                if invoice.status == "planned":
+                    extra = {"print": invoice.pages, "sheets": invoice.sheets, "spool_bytes": invoice.spool_bytes}
+                else:
+                    extra = {"error": invoice.skip or invoice.error}
+                printer.report(results.write, counts, Path(args.folder) / invoice.name, invoice.status,
+                               invoice.total_pages, len(invoice.pages), **extra)
+            totals = plan.totals()
+            print("\n".join(format_totals(totals)))
+            if args.plan != "-":
+                print(f"Plan written to {args.plan}; print it with --from-plan {args.plan}")
+        plan.save(args.plan)
+        
+        status = exit_status(invoice_files, counts)
+        summary = {"type": "summary", "found": len(invoice_files), "missing": missing_count, "plan": True,
+                   "seconds": round(time.monotonic() - start, 3), "exit_status": status}
+        summary.update(counts)
+        summary.update({key: totals[key] for key in ("sheets", "jobs", "spool_bytes", "print_seconds")})
+        results.write(summary)
+        return status
+    finally:
+        results.close()
+
+
+def run_headless(args):
+    """
+    Print every --prefix × --range without asking anything, finish
+    the interrupted run with --resume, or print a --from-plan manifest.
+    Returns the exit status
+    """
+    plan = None
+    if args.from_plan:
+        try:
+            plan = load_plan(args.from_plan)
+        except (OSError, ValueError) as e:
+            print(f"Error: can't read the plan: {e}", file=sys.stderr)
+            return EXIT_FAILED
+        # --folder points the plan at the same folder mounted elsewhere
+        plan.folder = args.folder = args.folder or plan.folder
+    printer = InvoicePrinterCLI(render_cache_size(args), use_ipp=not args.no_ipp, page_size=args.page_size)
+    prefixes = args.prefixes or [""]
+    ranges = [r for group in args.ranges or [] for r in group]
+    results = ResultWriter(args.results)
+    
+    metrics = RunMetrics(args.metrics)
+    start = time.monotonic()
+    counts = {"printed": 0, "skipped": 0, "failed": 0, "planned": 0}
+    journal = None
+    missing_count = 0
+    try:
+        with results.progress():
+            with profiled(args.profile):
+                batch, workers, queue_depth = args.batch, args.workers, args.queue_depth
+                in_memory = not args.temp_files
+                layout = two_up_layout(args.two_up, args.cut_marks, args.page_size)
+                optimizer = make_optimizer(args.optimize)
+                spooling = spool_options(args)
+                settings = None
+                if args.resume:
+                    resumed = resume_journal(args.folder)
+                    if resumed is None:
+                        print(f"Nothing to resume in {args.folder}")
+                        invoice_files = []
+                    else:
+                        paths, settings, journal = resumed
+                        invoice_files = [Path(path) for path in paths]
+                elif plan:
+                    settings = plan.settings
+                    invoice_files = printer.planned_files(plan, counts, results.write)
+                else:
+                    with metrics.stage("discovery"):
+                        invoice_files, missing_count = printer.collect_invoice_files(args.folder, prefixes, ranges)
+                if settings:
+                    # The settings of the interrupted run, or of the plan
+                    batch, workers = settings.get("batch", batch), settings.get("workers", workers)
+                    in_memory = settings.get("in_memory", in_memory)
+                    queue_depth = settings.get("max_queue_depth", queue_depth)
+                    if "page_size" in settings:
+                        printer.page_size = tuple(settings["page_size"]) if settings["page_size"] else None
+                    if "two_up" in settings:
+                        layout = two_up_layout(settings["two_up"], settings.get("cut_marks", False),
+                                               printer.page_size)
+                    if "optimize_dpi" in settings:
+                        optimizer = make_optimizer(settings["optimize_dpi"])
+                    if settings.get("spool"):
+                        spooling = settings["spool"]
+                    if "max_pages" in settings:
+                        # A run the GUI started keeps its >11 pages skip and 3 triplicate pages
+                        printer.max_pages = settings["max_pages"]
+                        printer.max_triplicate = settings.get("max_triplicate")
+                if not args.resume:
+                    # The shared queue keeps its own record of every invoice
+                    if invoice_files and not args.dry_run and not args.shared:
+                        journal = start_journal(args.folder, invoice_files,
+                                                journal_settings(batch, workers, in_memory, queue_depth, layout,
+                                                                 optimizer, spooling, printer.page_size,
+                                                                 printer.max_pages, printer.max_triplicate))
+                print(f"Found {len(invoice_files)} invoice file(s)")
+                if invoice_files and args.shared:
+                    shared = SharedQueue(args.folder)
+                    try:
+                        counts = printer.render_shared(shared, invoice_files, workers, metrics, layout, optimizer,
+                                                       on_result=results.write, requeue=args.requeue)
+                    finally:
+                        shared.close()
+                elif invoice_files:
+                    printed = printer.print_files(args.folder, invoice_files, batch, workers, in_memory,
+                                                  queue_depth, metrics, dry_run=args.dry_run,
+                                                  on_result=results.write, journal=journal, layout=layout,
+                                                  optimizer=optimizer, spool_options=spooling)
+                    for status, count in printed.items():
+                        counts[status] += count
+                if journal:
+                    journal.finish()
+            run_summary = metrics.close()
+            if args.metrics:
+                print("\n".join(format_summary(run_summary)))
+        
+        found = len(plan.invoices) if plan else len(invoice_files)
+        status = exit_status(found, counts)
+        summary = {"type": "summary", "found": found, "missing": missing_count,
+                   "dry_run": args.dry_run, "seconds": round(time.monotonic() - start, 3), "exit_status": status}
+        summary.update(counts)
+        results.write(summary)
+        return status
+    finally:
+        if journal:
+            journal.close()
+        results.close()
+
+
+def run_watch(args):
+    """
+    Print new invoices in --folder as they arrive, until Ctrl+C.
+    Returns the exit status
+    """
+    printer = InvoicePrinterCLI(render_cache_size(args), use_ipp=not args.no_ipp, page_size=args.page_size)
+    prefixes = args.prefixes or [""]
+    results = ResultWriter(args.results)
+    metrics = RunMetrics(args.metrics)
+    start = time.monotonic()
+    counts = {"printed": 0, "skipped": 0, "failed": 0, "planned": 0}
+    layout = two_up_layout(args.two_up, args.cut_marks, args.page_size)
+    optimizer = make_optimizer(args.optimize)
+    # One print queue for the whole session: new invoices don't wait for
+    # the ones before them to print, and the queue depth still holds
+    engine = printer.engine(metrics=metrics)
+    queue = engine.open_queue(args.queue_depth, ipp=None if args.dry_run else printer.ipp_printer())
+    
+    def print_new_invoice(prefix, number, path):
+        invoice_counts = printer.print_files(args.folder, [Path(path)], workers=1, in_memory=not args.temp_files,
+                                             max_queue_depth=args.queue_depth, metrics=metrics,
+                                             dry_run=args.dry_run, on_result=results.write, layout=layout,
+                                             optimizer=optimizer, queue=queue)
+        for status, count in invoice_counts.items():
+            counts[status] += count
+    
+    try:
+        with results.progress():
+            watcher = FolderWatcher(args.folder, prefixes, print_new_invoice, settle=args.settle,
+                                    poll_interval=args.poll_interval)
+            watcher.start({prefix: args.start for prefix in prefixes} if args.start is not None else None)
             try:
-                # Create triplicate PDF
-                temp_path, total_pages, triplicate_count = self.create_triplicate_pdf(str(pdf_path))
-                temp_files.append(temp_path)
-                
-                # Verify temp file
-                verify_reader = PdfReader(temp_path)
-                final_pages = len(verify_reader.pages)
-                
-                print(f"  - Original PDF pages: {total_pages}")
-                print(f"  - Triplicate pages: last {triplicate_count} page(s)")
-                print(f"  - Pages to print: {final_pages} (once)")
-                print(f"  - Sending to printer...", end=" ", flush=True)
-                
-                # Print
-                self.print_pdf(temp_path)
-                print("✓")
-                success_count += 1
-                
-                # Small delay between print jobs to avoid overwhelming printer
-                if i < len(invoice_files):
-                    time.sleep(2)
-                
-            except Exception as e:
-                print(f"✗ Error: {str(e)}")
-                # Still try to clean up temp file on error if it was created
-                if temp_path and os.path.exists(temp_path):
-                    temp_files.append(temp_path)
-                continue
+                with profiled(args.profile):
+                    watcher.run()
+            except KeyboardInterrupt:
+                print("\nStopped watching.")
+            try:
+                engine.wait_for_queue(queue)
+            except KeyboardInterrupt:
+                print("Stopped waiting for the printer.")
+            run_summary = metrics.close()
+            if args.metrics:
+                print("\n".join(format_summary(run_summary)))
         
-        # Cleanup temporary files
-        print(f"\nCleaning up temporary files...")
-        for temp_file in temp_files:
+        found = sum(counts.values())
+        summary = {"type": "summary", "found": found, "dry_run": args.dry_run,
+                   "seconds": round(time.monotonic() - start, 3), "exit_status": EXIT_OK}
+        summary.update(counts)
+        results.write(summary)
+        return EXIT_FAILED if counts["failed"] else EXIT_OK
+    finally:
+        results.close()
+
+
+def run_print_station(args):
+    """
+    Be the print station of the shared queue in --folder until Ctrl+C.
+    Returns the exit status
+    """
+    printer = InvoicePrinterCLI(render_cache_size(args), use_ipp=not args.no_ipp)
+    shared = SharedQueue(args.folder)
+    try:
+        shared.become_print_station()
+    except SharedQueueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        shared.close()
+        return EXIT_FAILED
+    if args.release_printing:
+        released = shared.release_printing()
+        print(f"Released {len(released)} invoice(s) the last print station left printing")
+        for name in released:
+            print(f"  {name}")
+    results = ResultWriter(args.results)
+    metrics = RunMetrics(args.metrics)
+    start = time.monotonic()
+    counts = {"printed": 0, "failed": 0}
+    
+    try:
+        with results.progress():
+            print(f"Print station for {args.folder}: {shared.outstanding()} invoice(s) waiting. Stop with Ctrl+C")
             try:
-                if os.path.exists(temp_file):
-                    os.remove(temp_file)
-            except:
-                pass
+                with profiled(args.profile):
+                    printer.serve_print_station(shared, args.queue_depth, metrics, results.write, counts)
+            except KeyboardInterrupt:
+                print("\nPrint station stopped.")
+            run_summary = metrics.close()
+            if args.metrics:
+                print("\n".join(format_summary(run_summary)))
         
-        print(f"\n{'='*60}")
-        print(f"Process completed! Successfully printed {success_count}/{len(invoice_files)} invoice(s)")
-        print(f"{'='*60}\n")
-        return True
+        summary = {"type": "summary", "found": sum(counts.values()), "seconds": round(time.monotonic() - start, 3),
+                   "exit_status": EXIT_FAILED if counts["failed"] else EXIT_OK}
+        summary.update(counts)
+        results.write(summary)
+        return summary["exit_status"]
+    finally:
+        shared.leave_print_station()
+        shared.close()
+        results.close()
 
 
-def main():
-    printer = InvoicePrinterCLI()
+def main(argv=None):
+    args = parse_args(argv)
+    if args.print_station:
+        return run_print_station(args)
+    if args.watch:
+        return run_watch(args)
+    if args.plan:
+        return run_plan(args)
+    if args.folder or args.from_plan:
+        return run_headless(args)
+    printer = InvoicePrinterCLI(render_cache_size(args), use_ipp=not args.no_ipp)
     
     print("\nInvoice Printer - CLI Version")
     print("=" * 60)
@@ -255,6 +908,15 @@ def main():
         print(f"Error: Folder not found: {folder_path}")
         return
     
+    # An earlier run in this folder that didn't finish
+    state = load_journal(folder_path)
+    if state and state.resumable:
+        print(f"\nThe run started {state.started} stopped with {len(state.pending())} of "
+              f"{len(state.invoices)} invoice(s) not yet sent to the printer.")
+        if input("Resume it? (y/n): ").strip().lower() == 'y':
+            args.folder, args.resume = folder_path, True
+            return run_headless(args)
+    
     # Get prefix
     prefix = input("Enter prefix (optional, e.g., 'C' for C300.pdf, or press Enter for none): ").strip()
     
@@ -284,18 +946,60 @@ def main():
     print(f"  Prefix: {prefix if prefix else '(none)'}")
     print(f"  Range: {start_no} to {end_no}")
     
+    batch = input("\nSend all invoices as a single print job? (y/n): ").strip().lower() == 'y'
+    
+    size_str = input("Fit pages to a page size (A5, A4, Letter, Legal or WxHmm, press Enter to keep them): ").strip()
+    try:
+        printer.page_size = parse_page_size(size_str) if size_str else None
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    
+    layout = None
+    if input("Print two pages per A4 sheet (landscape)? (y/n): ").strip().lower() == 'y':
+        cut_marks = input("Add cut marks? (y/n): ").strip().lower() == 'y'
+        try:
+            layout = two_up_layout(True, cut_marks, printer.page_size)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+    
+    optimizer = None
+    if input(f"Downsample images to the printer resolution ({DEFAULT_DPI} dpi)? (y/n): ").strip().lower() == 'y':
+        optimizer = make_optimizer(DEFAULT_DPI)
+    
+    workers_str = input(f"Number of worker processes (1-{os.cpu_count() or 1}, press Enter for 1): ").strip()
+    try:
+        workers = max(int(workers_str), 1) if workers_str else 1
+    except ValueError:
+        print("Error: Number of worker processes must be an integer")
+        return
+    
     confirm = input("\nProceed with printing? (y/n): ").strip().lower()
     if confirm != 'y':
         print("Cancelled.")
         return
     
     # Print invoices
-    printer.print_invoices(folder_path, prefix, start_no, end_no)
+    metrics = RunMetrics(args.metrics)
+    try:
+        with profiled(args.profile):
+            printer.print_invoices(folder_path, prefix, start_no, end_no, batch=batch, workers=workers,
+                                   metrics=metrics, layout=layout, optimizer=optimizer)
+    finally:
+        summary = metrics.close()
+    if args.metrics:
+        print("\n".join(format_summary(summary)))
+        print(f"Metrics appended to {args.metrics}")
+    if args.profile:
+        print(f"Profile saved to {args.profile}")
 
 
 if __name__ == "__main__":
+    # Needed for the worker processes in a frozen executable
+    multiprocessing.freeze_support()
     try:
-        main()
+        sys.exit(main() or EXIT_OK)
     except KeyboardInterrupt:
         print("\n\nCancelled by user.")
         sys.exit(0)
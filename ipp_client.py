@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+IPP print backend
+Talks IPP/1.1 to the local CUPS server over one keep-alive HTTP
+connection: Print-Job sends a PDF, Get-Job-Attributes follows the job
+until it has printed. Starting lp and lpstat for every job costs far
+more than a request on an open connection. Where no CUPS server answers
+over TCP (Windows, a socket-only CUPS_SERVER, CUPS not running)
+connect_ipp returns None and PrintQueue keeps using lp and lpstat
+"""
+
+import getpass
+import http.client
+import os
+import platform
+import socket
+import struct
+
+DEFAULT_HOST = "localhost"
+DEFAULT_PORT = 631
+DEFAULT_TIMEOUT = 30  # seconds per request
+
+# Status codes
+STATUS_NOT_FOUND = 0x0406  # client-error-not-found: a job CUPS no longer keeps
+
+# Operations
+PRINT_JOB = 0x0002
+GET_JOB_ATTRIBUTES = 0x0009
+CUPS_GET_DEFAULT = 0x4001
+
+# Delimiter tags
+OPERATION_ATTRIBUTES = 0x01
+JOB_ATTRIBUTES = 0x02
+END_OF_ATTRIBUTES = 0x03
+PRINTER_ATTRIBUTES = 0x04
+
+# Value tags
+INTEGER = 0x21
+BOOLEAN = 0x22
+ENUM = 0x23
+TEXT = 0x41
+NAME = 0x42
+KEYWORD = 0x44
+URI = 0x45
+CHARSET = 0x47
+NATURAL_LANGUAGE = 0x48
+MIME_MEDIA_TYPE = 0x49
+
+# job-state values
+JOB_PENDING = 3
+JOB_PROCESSING = 5
+# ... and those of a job that has left the queue
+JOB_CANCELED = 7
+JOB_ABORTED = 8
+JOB_COMPLETED = 9
+FINISHED_JOB_STATES = (JOB_CANCELED, JOB_ABORTED, JOB_COMPLETED)
+
+# What a kept-alive connection the server has already closed fails with
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError)
+
+
+class IppError(Exception):
+    """
+    The server answered, but refused the request; status is the IPP
+    status code, where there was one
+    """
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class IppNoAnswer(Exception):
+    """
+    A Print-Job went out but no answer came back (timed out, connection
+    lost): CUPS may well have the job, so it must not be sent again
+    """
+
+
+def encode_message(code, request_id, groups, data=b""):
+    """
+    An IPP/1.1 message: header (operation of a request, status of a
+    response), the attribute groups [(group tag, [(value tag, name, value), ...])]
+    and the document data, if any
+    """
+    parts = [struct.pack(">BBHI", 1, 1, code, request_id)]
+    for group_tag, attributes in groups:
+        parts.append(bytes([group_tag]))
+        for tag, name, value in attributes:
+            if tag in (INTEGER, ENUM):
+                value = struct.pack(">i", value)
+            elif tag == BOOLEAN:
+                value = bytes([1 if value else 0])
+            else:
+                value = value.encode("utf-8")
+            name = name.encode("ascii")
+            parts.append(struct.pack(">BH", tag, len(name)) + name + struct.pack(">H", len(value)) + value)
+    parts.append(bytes([END_OF_ATTRIBUTES]))
+    parts.append(data)
+    return b"".join(parts)
+
+
+def encode_request(operation, request_id, attributes, data=b""):
+    """
+    An IPP/1.1 request with the operation attributes [(value tag, name, value), ...]
+    """
+    return encode_message(operation, request_id, [(OPERATION_ATTRIBUTES, attributes)], data)
+
+
+def decode_message(body):
+    """
+    (status code or operation, request id, [(group tag, {name: [values]})], data)
+    of an IPP response or request
+    """
+    if len(body) < 9:
+        raise IppError("Truncated IPP message")
+    code, request_id = struct.unpack(">HI", body[2:8])
+    groups = []
+    current = None
+    name = None
+    pos = 8
+    while pos < len(body):
+        tag = body[pos]
+        pos += 1
+        if tag == END_OF_ATTRIBUTES:
+            break
+        if tag < 0x10:
+            current = {}
+            groups.append((tag, current))
+            continue
+        name_length = struct.unpack(">H", body[pos:pos + 2])[0]
+        pos += 2
+        if name_length:
+            name = body[pos:pos + name_length].decode("ascii", "replace")
+        pos += name_length
+        value_length = struct.unpack(">H", body[pos:pos + 2])[0]
+        pos += 2
+        value = body[pos:pos + value_length]
+        pos += value_length
+        if current is None:
+            raise IppError("IPP attribute outside a group")
+        if tag in (INTEGER, ENUM) and value_length == 4:
+            value = struct.unpack(">i", value)[0]
+        elif tag == BOOLEAN and value_length == 1:
+            value = bool(value[0])
+        elif tag in (TEXT, NAME, KEYWORD, URI, CHARSET, NATURAL_LANGUAGE, MIME_MEDIA_TYPE):
+            value = value.decode("utf-8", "replace")
+        if name_length:
+            current[name] = [value]
+        else:
+            # An additional value of the previous attribute
+            current.setdefault(name, []).append(value)
+    return code, request_id, groups, body[pos:]
+
+
+def attribute(groups, group_tag, name, default=None):
+    """
+    The first value of name in the first group_tag group
+    """
+    for tag, values in groups:
+        if tag == group_tag and name in values:
+            return values[name][0]
+    return default
+
+
+class IppPrinter:
+    """
+    One printer on one CUPS server, over a persistent HTTP connection.
+    Not thread safe: each print run uses its own
+    """
+
+    def __init__(self, printer=None, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=DEFAULT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.user = _user_name()
+        self.connection = None
+        self.request_id = 0
+        self.requests = 0  # sent on the connection, for the log and the benchmark
+        self.printer = printer or self.default_printer()
+
+    @property
+    def uri(self):
+        return f"ipp://{self.host}:{self.port}/printers/{self.printer}"
+
+    def _request(self, path, operation, attributes, data=b""):
+        self.request_id += 1
+        body = encode_request(operation, self.request_id, [
+            (CHARSET, "attributes-charset", "utf-8"),
+            (NATURAL_LANGUAGE, "attributes-natural-language", "en"),
+        ] + attributes, data)
+        headers = {"Content-Type": "application/ipp"}
+        for attempt in (1, 2):
+            reused = self.connection is not None
+            sent = False
+            try:
+                if not reused:
+                    self.connection = self._connect()
+                self.connection.request("POST", path, body, headers)
+                sent = True
+                response = self.connection.getresponse()
+                payload = response.read()
+                break
+            except (http.client.HTTPException, OSError) as e:
+                self.close()
+                stale = reused and isinstance(e, STALE_CONNECTION_ERRORS)
+                if operation == PRINT_JOB and sent and not stale:
+                    # CUPS may have accepted the job: sending it again could print it twice
+                    raise IppNoAnswer(f"No answer to Print-Job from {self.host}:{self.port} ({e})") from e
+                # Only a kept-alive connection the server had already closed is retried
+                if attempt == 2 or not reused:
+                    raise
+        self.requests += 1
+        if response.will_close:
+            self.close()
+        if response.status != 200:
+            raise IppError(f"HTTP {response.status} {response.reason} from {self.host}:{self.port}")
+        status, request_id, groups, _ = decode_message(payload)
+        if status >= 0x0400:
+            message = attribute(groups, OPERATION_ATTRIBUTES, "status-message", "")
+            raise IppError(f"IPP status 0x{status:04x} {message}".rstrip(), status)
+        return groups
+
+    def _connect(self):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        connection.connect()
+        # Small request/response pairs: don't let Nagle hold them back for the peer's delayed ACK
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return connection
+
+    def default_printer(self):
+        name = os.environ.get("LPDEST") or os.environ.get("PRINTER")
+        if name:
+            return name
+        groups = self._request("/", CUPS_GET_DEFAULT, [(KEYWORD, "requested-attributes", "printer-name")])
+        name = attribute(groups, PRINTER_ATTRIBUTES, "printer-name")
+        if not name:
+            raise IppError("No default printer")
+        return name
+
+    def print_job(self, data, title=None):
+        """
+        Send one PDF; returns its job ID (a number)
+        """
+        attributes = [
+            (URI, "printer-uri", self.uri),
+            (NAME, "requesting-user-name", self.user),
+        ]
+        if title:
+            attributes.append((NAME, "job-name", title))
+        attributes.append((MIME_MEDIA_TYPE, "document-format", "application/pdf"))
+        groups = self._request(f"/printers/{self.printer}", PRINT_JOB, attributes, data)
+        job_id = attribute(groups, JOB_ATTRIBUTES, "job-id")
+        if job_id is None:
+            raise IppError("Print-Job response without a job-id")
+        return job_id
+
+    def job_state(self, job_id):
+        """
+        The job's job-state (3 pending ... 9 completed)
+        """
+        groups = self._request(f"/printers/{self.printer}", GET_JOB_ATTRIBUTES, [
+            (URI, "printer-uri", self.uri),
+            (INTEGER, "job-id", job_id),
+            (NAME, "requesting-user-name", self.user),
+            (KEYWORD, "requested-attributes", "job-state"),
+        ])
+        return attribute(groups, JOB_ATTRIBUTES, "job-state")
+
+    def job_name(self, job_id):
+        """
+        The job ID as lp and lpstat show it: Printer-123
+        """
+        return f"{self.printer}-{job_id}"
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def _user_name():
+    try:
+        return getpass.getuser()
+    except Exception:
+        return "invoice-printer"
+
+
+def cups_server():
+    """
+    (host, port) of the CUPS server lp would use, or None where it can't
+    be reached over TCP (a domain socket)
+    """
+    server = os.environ.get("CUPS_SERVER", "")
+    if server.startswith("/"):
+        return None
+    if not server:
+        return DEFAULT_HOST, DEFAULT_PORT
+    host, _, port = server.rpartition(":") if server.count(":") == 1 else (server, "", "")
+    try:
+        return host, int(port) if port else DEFAULT_PORT
+    except ValueError:
+        return server, DEFAULT_PORT
+
+
+def connect_ipp(timeout=DEFAULT_TIMEOUT):
+    """
+    An IppPrinter for the default printer, or None where printing has to
+    go through lp (Windows, no CUPS server listening, no default printer)
+    """
+    if platform.system() == "Windows":
+        return None
+    server = cups_server()
+    if server is None:
+        return None
+    try:
+        return IppPrinter(host=server[0], port=server[1], timeout=timeout)
+    except (IppError, http.client.HTTPException, OSError):
+        return None
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Run metrics and profiling
+Records how long each invoice spends in each stage (discovery, parse,
+select, transform, write, submit, ...), the bytes sent to the printer
+and the spooler latency, and appends them to a JSON Lines file: one
+line per measurement, then one "summary" line with percentiles per stage
+
+    {"type": "stage", "stage": "parse", "invoice": "C301.pdf", "seconds": 0.0123}
+    {"type": "job", "invoice": "C301.pdf", "bytes": 48213, "queue_wait": 0.0, "spool": 0.0101}
+    {"type": "summary", "stages": {"parse": {"count": 250, "p50": ..., "p90": ..., ...}}, ...}
+"""
+
+import contextlib
+import json
+import threading
+import time
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(sorted_values, p):
+    """
+    Nearest-rank percentile of an already sorted list
+    """
+    if not sorted_values:
+        return None
+    rank = max(int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def distribution(values):
+    """
+    count / total / mean / percentiles / max of a list of numbers
+    """
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    result = {
+        "count": len(values),
+        "total": round(sum(values), 6),
+        "mean": round(sum(values) / len(values), 6),
+    }
+    for p in PERCENTILES:
+        result[f"p{p}"] = round(percentile(values, p), 6)
+    result["max"] = round(values[-1], 6)
+    return result
+
+
+class RunMetrics:
+    """
+    Collects the measurements of one print run. With a path, every
+    measurement is also appended to that file as it happens; without
+    one it only keeps them in memory, which costs next to nothing
+    Safe to use from the GUI's worker thread
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.stages = {}  # stage name → [seconds, ...]
+        self.bytes_written = 0
+        self.spool_latency = []
+        self.queue_wait = []
+        self.print_latency = []
+        self.counters = {}
+        self.started = time.perf_counter()
+        self.first_job = None  # seconds from the start of the run to the first job handed to the spooler
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8") if path else None
+
+    def _write(self, record):
+        if self._file:
+            self._file.write(json.dumps(record) + "\n")
+
+    def record(self, stage, seconds, invoice=None):
+        with self._lock:
+            self.stages.setdefault(stage, []).append(seconds)
+            self._write({"type": "stage", "stage": stage, "invoice": invoice, "seconds": round(seconds, 6)})
+
+    @contextlib.contextmanager
+    def stage(self, name, invoice=None):
+        """
+        Time the body of a with block as one measurement of stage name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, invoice)
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_timings(self, invoice, timings):
+        """
+        The per-stage timings a render worker measured for one invoice
+        """
+        for stage, seconds in (timings or {}).items():
+            self.record(stage, seconds, invoice)
+
+    def record_job(self, invoice, job, size):
+        """
+        One print job handed to the spooler: its size, how long it
+        waited for room in the queue and how long the spooler took
+        """
+        with self._lock:
+            if self.first_job is None:
+                self.first_job = time.perf_counter() - self.started
+            self.bytes_written += size
+            if job.queue_wait is not None:
+                self.queue_wait.append(job.queue_wait)
+            if job.spool_seconds is not None:
+                self.spool_latency.append(job.spool_seconds)
+            self._write({"type": "job", "invoice": invoice, "job_id": job.job_id, "bytes": size,
+                         "queue_wait": job.queue_wait and round(job.queue_wait, 6),
+                         "spool": job.spool_seconds and round(job.spool_seconds, 6)})
+
+    def record_completed(self, queue):
+        """
+        Submit-to-finished time of the jobs the print queue saw complete
+        """
+        with self._lock:
+            for job in queue.completed_jobs:
+                if job.job_id and job.completed is not None:
+                    self.print_latency.append(job.completed - job.submitted)
+
+    def summary(self):
+        with self._lock:
+            return {
+                "type": "summary",
+                "seconds": round(time.perf_counter() - self.started, 6),
+                "stages": {stage: distribution(values) for stage, values in self.stages.items()},
+                "bytes_written": self.bytes_written,
+                "first_job_seconds": self.first_job and round(self.first_job, 6),
+                "queue_wait": distribution(self.queue_wait),
+                "spool_latency": distribution(self.spool_latency),
+                "print_latency": distribution(self.print_latency),
+                "counters": dict(self.counters),
+            }
+
+    def close(self):
+        """
+        Append the summary line, close the file and return the summary
+        """
+        summary = self.summary()
+        with self._lock:
+            if self._file:
+                self._write(summary)
+                self._file.close()
+                self._file = None
+        return summary
+
+
+def format_summary(summary):
+    """
+    The summary as lines of text for the log
+    """
+    lines = [f"Timing ({summary['seconds']:.2f}s total):"]
+    for stage, stats in summary["stages"].items():
+        if stats["count"]:
+            lines.append(f"  {stage:<10} {stats['total']:8.3f}s  n={stats['count']:<5} "
+                         f"p50={stats['p50'] * 1000:.1f}ms p90={stats['p90'] * 1000:.1f}ms "
+                         f"max={stats['max'] * 1000:.1f}ms")
+    spool = summary["spool_latency"]
+    if spool["count"]:
+        lines.append(f"  spooler    p50={spool['p50'] * 1000:.1f}ms p90={spool['p90'] * 1000:.1f}ms "
+                     f"({spool['count']} job(s), {summary['bytes_written'] / 1024:.0f} KB)")
+    if summary.get("first_job_seconds") is not None:
+        lines.append(f"  first job  {summary['first_job_seconds']:.3f}s after the start")
+    for cache in ("page", "render"):
+        hits = summary["counters"].get(f"{cache}_cache_hits", 0)
+        lookups = hits + summary["counters"].get(f"{cache}_cache_misses", 0)
+        if lookups:
+            lines.append(f"  {cache + ' cache':<10} {hits}/{lookups} hit(s), {hits / lookups:.0%} hit rate")
+    downsampled = summary["counters"].get("images_downsampled")
+    if downsampled:
+        lines.append(f"  optimise   {downsampled} image(s) downsampled")
+    saved = summary["counters"].get("dedup_bytes_saved")
+    if saved:
+        lines.append(f"  dedup      {summary['counters'].get('shared_resources', 0)} shared resource(s), "
+                     f"{saved / 1024:.0f} KB not spooled again")
+    return lines
+
+
+@contextlib.contextmanager
+def profiled(path):
+    """
+    Run the body of a with block under cProfile and save the stats to
+    path (open them with pstats or snakeviz). Does nothing without a path
+    Only the calling thread is profiled; with worker processes that is
+    the collecting and printing side, not the PDF rendering
+    """
+    if not path:
+        yield
+        return
+    import cProfile
+
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
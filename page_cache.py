@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Persistent page-count cache
+Remembers the page count, page sizes and skip decision of every invoice
+in a small SQLite database inside the invoice folder, keyed on file
+name, size and modification time. Reprinting an unchanged range then
+needs no PDF parsing at all to decide what to skip
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+CACHE_FILENAME = ".invoice_printer_cache.sqlite"
+
+
+class PageInfo:
+    """
+    What the cache knows about one invoice file
+    """
+
+    def __init__(self, page_count, mediaboxes, skip_reason=None, max_pages=None):
+        self.page_count = page_count
+        # [(width, height), ...] per page, in points; empty when the
+        # invoice was skipped on its page count alone
+        self.mediaboxes = mediaboxes
+        self.cached_skip_reason = skip_reason
+        self.cached_max_pages = max_pages
+
+    def skip_reason(self, max_pages=None):
+        """
+        Why this invoice is skipped under the given page limit, or None
+        """
+        if max_pages == self.cached_max_pages:
+            return self.cached_skip_reason
+        return skip_reason(self.page_count, max_pages)
+
+
+def skip_reason(page_count, max_pages=None):
+    if max_pages is not None and page_count > max_pages:
+        return f"Too many pages ({page_count} > {max_pages})"
+    if page_count < 3:
+        return "Less than 3 pages: no triplicate pages"
+    return None
+
+
+class PageCountCache:
+    """
+    SQLite-backed cache with least-recently-used eviction
+    - get(path) returns a PageInfo only if size and mtime still match
+    - put(path, ...) records a freshly parsed file
+    """
+
+    def __init__(self, db_path, max_entries=100000):
+        self.db_path = str(db_path)
+        self.folder = os.path.dirname(os.path.abspath(self.db_path))
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS page_info ("
+            " name TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " page_count INTEGER NOT NULL,"
+            " mediaboxes TEXT NOT NULL,"
+            " skip_reason TEXT,"
+            " max_pages INTEGER,"
+            " last_used REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS page_info_last_used ON page_info (last_used)")
+        self.conn.commit()
+
+    @classmethod
+    def for_folder(cls, folder, max_entries=100000):
+        """
+        Open the cache stored in an invoice folder. Returns None when the
+        folder is read-only or the database can't be used, so callers can
+        simply carry on without a cache
+        """
+        try:
+            return cls(os.path.join(str(folder), CACHE_FILENAME), max_entries)
+        except sqlite3.Error:
+            return None
+
+    def _key(self, path):
+        path = os.path.abspath(str(path))
+        if os.path.dirname(path) == self.folder:
+            # Relative keys keep the cache valid when the share is mounted elsewhere
+            return os.path.basename(path)
+        return path
+
+    def get(self, path):
+        try:
+            st = os.stat(path)
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, page_count, mediaboxes, skip_reason, max_pages"
+                " FROM page_info WHERE name = ?", (self._key(path),)
+            ).fetchone()
+        except (OSError, sqlite3.Error):
+            return None
+
+        if row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._touch(path)
+        return PageInfo(row[2], [tuple(box) for box in json.loads(row[3])], row[4], row[5])
+
+    def put(self, path, page_count, mediaboxes, max_pages=None):
+        try:
+            st = os.stat(path)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO page_info"
+                " (name, size, mtime_ns, page_count, mediaboxes, skip_reason, max_pages, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self._key(path), st.st_size, st.st_mtime_ns, page_count,
+                 json.dumps([list(box) for box in mediaboxes]),
+                 skip_reason(page_count, max_pages), max_pages, time.time())
+            )
+        except (OSError, sqlite3.Error):
+            return
+        self._changed()
+
+    def _touch(self, path):
+        try:
+            self.conn.execute("UPDATE page_info SET last_used = ? WHERE name = ?", (time.time(), self._key(path)))
+        except sqlite3.Error:
+            return
+        self._changed()
+
+    def _changed(self):
+        # Commit in batches; one fsync per file would cost more than parsing it
+        self._pending += 1
+        if self._pending >= 200:
+            self.flush()
+
+    def evict(self):
+        """
+        Drop the least recently used entries above max_entries
+        """
+        self.conn.execute(
+            "DELETE FROM page_info WHERE name IN ("
+            " SELECT name FROM page_info ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+
+    def flush(self):
+        try:
+            self.evict()
+            self.conn.commit()
+        except sqlite3.Error:
+            pass
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+        self.conn.close()
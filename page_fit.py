@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Page fitting
+Scales invoice pages to the paper they are printed on (A5 by default;
+A4, Letter or any custom size, see page_sizes) without rewriting their
+content:
+- each source page becomes a Form XObject that carries its content
+  stream as stored (still compressed, never parsed) and its resources
+- a new page of the target size draws that form with a single cm
+Invoices come in two or three page sizes, so the scale and centring of
+each distinct mediabox is worked out once and then reused. Annotations
+are not carried over: what prints is the page content
+"""
+
+from pypdf import PageObject
+from pypdf.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject, FloatObject,
+                           NameObject, StreamObject)
+from page_sizes import A5_SIZE
+
+FORM_NAME = "/Invoice"  # the source page's form on the fitted page
+
+
+def _number(value):
+    text = f"{value:.4f}".rstrip("0").rstrip(".")
+    return "0" if text in ("", "-0") else text
+
+
+def page_form(page):
+    """
+    The page as a Form XObject: its content (taken as stored, not
+    decoded, when it is one stream), resources and mediabox
+    """
+    box = page.mediabox
+    contents = page.get("/Contents")
+    contents = contents.get_object() if contents is not None else None
+    if isinstance(contents, StreamObject) and "/Filter" in contents:
+        form = EncodedStreamObject()
+        form._data = contents._data
+        for key in ("/Filter", "/DecodeParms"):
+            if key in contents:
+                form[NameObject(key)] = contents.raw_get(key)
+    else:
+        form = DecodedStreamObject()
+        if isinstance(contents, StreamObject):
+            form.set_data(contents.get_data())
+        elif contents is not None:
+            # An array of streams: one content stream split in parts
+            form.set_data(b"\n".join(part.get_object().get_data() for part in contents))
+    form[NameObject("/Type")] = NameObject("/XObject")
+    form[NameObject("/Subtype")] = NameObject("/Form")
+    form[NameObject("/BBox")] = ArrayObject(FloatObject(value) for value in
+                                            (box.left, box.bottom, box.right, box.top))
+    resources = page.raw_get("/Resources") if "/Resources" in page else None
+    form[NameObject("/Resources")] = resources if resources is not None else DictionaryObject()
+    return form
+
+
+def draw_form(page, name, form, matrix):
+    """
+    Add form to page's resources as name and draw it with matrix
+    (a b c d e f). page must be one made here (its content is appended to)
+    """
+    resources = page[NameObject("/Resources")]
+    xobjects = resources.get("/XObject")
+    if xobjects is None:
+        xobjects = resources[NameObject("/XObject")] = DictionaryObject()
+    xobjects[NameObject(name)] = form
+    append_content(page, f"q {' '.join(_number(value) for value in matrix)} cm {name} Do Q\n".encode("ascii"))
+
+
+def append_content(page, data):
+    """
+    Append data to the content stream of a page made here
+    """
+    contents = page.get("/Contents")
+    if contents is None:
+        contents = page[NameObject("/Contents")] = DecodedStreamObject()
+        contents.set_data(data)
+    else:
+        contents.set_data(contents.get_data() + data)
+
+
+class PageFitter:
+    """
+    Fits pages to one target size (width, height) in points, keeping
+    their aspect ratio, centred. The matrix of every mediabox seen is
+    kept, so pages of a size seen before cost a dictionary lookup
+    """
+
+    def __init__(self, size=A5_SIZE):
+        self.size = tuple(size)
+        self.matrices = {}  # (left, bottom, right, top) → (a b c d e f)
+
+    def matrix(self, box):
+        """
+        The matrix that fits box (left, bottom, right, top) to the target size
+        """
+        key = tuple(round(float(value), 2) for value in box)
+        matrix = self.matrices.get(key)
+        if matrix is None:
+            left, bottom, right, top = key
+            width, height = self.size
+            scale = min(width / ((right - left) or 1), height / ((top - bottom) or 1))
+            # Centred on the target size, the box's own origin moved to (0, 0)
+            offset_x = (width - (right - left) * scale) / 2 - left * scale
+            offset_y = (height - (top - bottom) * scale) / 2 - bottom * scale
+            matrix = self.matrices[key] = (scale, 0, 0, scale, offset_x, offset_y)
+        return matrix
+
+    def fit(self, page):
+        """
+        A new page of the target size showing page, scaled and centred
+        """
+        box = page.mediabox
+        fitted = PageObject.create_blank_page(width=self.size[0], height=self.size[1])
+        draw_form(fitted, FORM_NAME, page_form(page), self.matrix((box.left, box.bottom, box.right, box.top)))
+        for key in ("/Rotate", "/Group"):
+            if key in page:
+                fitted[NameObject(key)] = page.raw_get(key)
+        return fitted
+
+
+# One fitter per target size and process, so the matrices carry over between invoices
+_fitters = {}
+
+
+def page_fitter(size):
+    size = tuple(size)
+    if size not in _fitters:
+        _fitters[size] = PageFitter(size)
+    return _fitters[size]
+
+
+def fit_page(page, width, height):
+    """
+    The page scaled to fit width x height (keeping its aspect ratio) and
+    centred on a new page of that size
+    """
+    return page_fitter((width, height)).fit(page)
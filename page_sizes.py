@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Paper sizes
+The sizes pages can be fitted to (see page_fit), and the parsing of
+custom sizes given on the command line or typed into the GUI, plus the
+printer resolution spool_optimize downsamples to by default. Without
+pypdf, so the GUI can offer them before its first print run
+"""
+
+# Paper sizes in points (1/72 inch); portrait
+A5_SIZE = (419.53, 595.28)  # 148mm x 210mm
+A4_SIZE = (595.28, 841.89)  # 210mm x 297mm
+LETTER_SIZE = (612.0, 792.0)  # 8.5in x 11in
+LEGAL_SIZE = (612.0, 1008.0)  # 8.5in x 14in
+
+PAGE_SIZES = {"A5": A5_SIZE, "A4": A4_SIZE, "Letter": LETTER_SIZE, "Legal": LEGAL_SIZE}
+DEFAULT_PAGE_SIZE = "A5"
+
+DEFAULT_DPI = 300  # printer resolution images are downsampled to (see spool_optimize)
+
+# Units a custom size may be given in, in points
+UNITS = {"pt": 1.0, "mm": 72 / 25.4, "cm": 72 / 2.54, "in": 72.0}
+
+
+def parse_page_size(text):
+    """
+    (width, height) in points for a paper name (A5, A4, Letter, Legal;
+    any case) or a custom WIDTHxHEIGHT with an optional unit: pt (the
+    default), mm, cm or in, e.g. 105x148mm or 5.5x8.5in
+    """
+    text = str(text).strip()
+    for name, size in PAGE_SIZES.items():
+        if text.lower() == name.lower():
+            return size
+    spec = text.lower().replace(" ", "")
+    unit = next((unit for unit in UNITS if spec.endswith(unit)), "pt")
+    if spec.endswith(unit):
+        spec = spec[:-len(unit)]
+    try:
+        width, height = (float(value) * UNITS[unit] for value in spec.split("x"))
+    except ValueError:
+        raise ValueError(f"Unknown page size {text!r}: use {', '.join(PAGE_SIZES)} or WIDTHxHEIGHT "
+                         f"in {', '.join(UNITS)} (e.g. 148x210mm)")
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Invalid page size {text!r}")
+    return round(width, 2), round(height, 2)
+
+
+def page_size_name(size):
+    """
+    The paper name of a size, or WIDTHxHEIGHTmm
+    """
+    for name, known in PAGE_SIZES.items():
+        if abs(known[0] - size[0]) < 0.5 and abs(known[1] - size[1]) < 0.5:
+            return name
+    return f"{size[0] / UNITS['mm']:.0f}x{size[1] / UNITS['mm']:.0f}mm"
@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Parallel triplicate rendering
+A pool of worker processes parses each invoice, picks its triplicate
+pages and fits them to the output page size. A reorder buffer hands
+the results back strictly in input (invoice number) order, and a slow
+or corrupt file only costs its own timeout instead of stalling the batch
+"""
+
+import io
+import multiprocessing
+import time
+from collections import deque
+from pypdf import PdfReader, PdfWriter
+from page_cache import skip_reason
+from page_fit import page_fitter
+from pdf_probe import probe_page_count
+from render_cache import render_settings
+
+DEFAULT_TIMEOUT = 120  # seconds per invoice
+
+
+class InvoiceSkipped(ValueError):
+    """
+    Raised for invoices the rules say not to print (too many / too few
+    pages). Carries the page information so it can still be cached
+    """
+
+    def __init__(self, message, total_pages=None, mediaboxes=None):
+        ValueError.__init__(self, message)
+        self.total_pages = total_pages
+        self.mediaboxes = mediaboxes
+
+
+def triplicate_count(total_pages, max_count=None):
+    """
+    3-5 pages → 1, 6-8 → 2, 9-11 → 3, ... optionally capped at max_count
+    """
+    if total_pages < 3:
+        return 0
+    count = ((total_pages - 2) + 2) // 3
+    if max_count is not None:
+        count = min(count, max_count)
+    return count
+
+
+def select_triplicate_pages(pdf_path, fit_size=None, max_pages=None, max_triplicate=None, timings=None,
+                            layout=None):
+    """
+    Return (pages, triplicate_count, total_pages, mediaboxes) for one invoice
+    - mediaboxes: original (width, height) of every page, for the page cache
+    - max_pages: raise InvoiceSkipped("Too many pages ...") above this count
+    - fit_size: (width, height) in points to fit every page to (see
+      page_fit), or None to keep the pages as they are
+    - timings: dict that receives the seconds spent in parse / select / transform
+    - layout: an imposition layout (e.g. TwoUpLayout); pages then holds
+      the imposed sheets, not the triplicate pages themselves
+    """
+    if timings is None:
+        timings = {}
+    start = time.perf_counter()
+    # Skips are decided from the trailer alone, without loading the file
+    probed_pages = probe_page_count(pdf_path)
+    if probed_pages is not None:
+        reason = skip_reason(probed_pages, max_pages)
+        if reason:
+            timings["probe"] = time.perf_counter() - start
+            raise InvoiceSkipped(reason, probed_pages)
+
+    reader = PdfReader(pdf_path)
+    total_pages = len(reader.pages)
+    mediaboxes = [(float(page.mediabox.width), float(page.mediabox.height)) for page in reader.pages]
+    parsed = time.perf_counter()
+    timings["parse"] = parsed - start
+
+    reason = skip_reason(total_pages, max_pages)
+    if reason:
+        raise InvoiceSkipped(reason, total_pages, mediaboxes)
+    count = triplicate_count(total_pages, max_triplicate)
+    pages = [reader.pages[i] for i in range(total_pages - count, total_pages)]
+    selected = time.perf_counter()
+    timings["select"] = selected - parsed
+
+    if fit_size:
+        fitter = page_fitter(fit_size)
+        pages = [fitter.fit(page) for page in pages]
+        timings["transform"] = time.perf_counter() - selected
+
+    if layout:
+        transformed = time.perf_counter()
+        pages = layout.impose(pages)
+        timings["impose"] = time.perf_counter() - transformed
+
+    return pages, count, total_pages, mediaboxes
+
+
+class RenderResult:
+    """
+    The triplicate pages of one invoice, either as page objects
+    (rendered in this process) or as PDF bytes (rendered by a worker)
+    """
+
+    def __init__(self, path, triplicate_count, total_pages, pages=None, data=None, mediaboxes=None,
+                 timings=None, optimizer=None, output_pages=None):
+        self.path = path
+        self.triplicate_count = triplicate_count
+        self.total_pages = total_pages
+        self.mediaboxes = mediaboxes
+        self.pages = pages
+        self.data = data
+        # Pages (sheets, imposed) in data, counted by get_data as it writes
+        # them, so nobody has to parse the PDF again to know
+        self.output_pages = output_pages
+        self.timings = timings if timings is not None else {}  # stage → seconds
+        self.optimizer = optimizer  # a SpoolOptimizer applied when the PDF is written
+        self.optimized = None  # what the optimizer did
+
+    def get_pages(self):
+        if self.pages is None:
+            self.pages = list(PdfReader(io.BytesIO(self.data)).pages)
+        return self.pages
+
+    def get_data(self):
+        if self.data is None:
+            start = time.perf_counter()
+            writer = PdfWriter()
+            for page in self.pages:
+                writer.add_page(page)
+            if self.optimizer:
+                optimize_start = time.perf_counter()
+                self.optimized = self.optimizer.optimize(writer)
+                self.timings["optimize"] = time.perf_counter() - optimize_start
+            buffer = io.BytesIO()
+            writer.write(buffer)
+            self.data = buffer.getvalue()
+            self.output_pages = len(writer.pages)
+            self.timings["write"] = time.perf_counter() - start - self.timings.get("optimize", 0)
+        return self.data
+
+
+def render_triplicate(pdf_path, fit_size=None, max_pages=None, max_triplicate=None, layout=None, optimizer=None):
+    """
+    Render one invoice's triplicate pages to PDF bytes
+    """
+    timings = {}
+    pages, count, total_pages, mediaboxes = select_triplicate_pages(pdf_path, fit_size, max_pages, max_triplicate,
+                                                                    timings, layout)
+    result = RenderResult(pdf_path, count, total_pages, pages=pages, mediaboxes=mediaboxes, timings=timings,
+                          optimizer=optimizer)
+    result.get_data()
+    result.pages = None  # Page objects can't cross the process boundary
+    return result
+
+
+def _render_job(args):
+    """
+    Worker entry point. Errors are flattened to plain strings so that
+    exceptions which can't be pickled never break the pool
+    """
+    pdf_path, options = args
+    try:
+        return "ok", render_triplicate(pdf_path, **options)
+    except InvoiceSkipped as e:
+        return "skip", str(e), e.total_pages, e.mediaboxes
+    except Exception as e:
+        return "error", f"{type(e).__name__}: {e}"
+
+
+class RenderOutcome:
+    """
+    One entry handed out by render_in_order: exactly one of result/error is set
+    """
+
+    def __init__(self, index, path, result=None, error=None):
+        self.index = index
+        self.path = path
+        self.result = result
+        self.error = error
+
+
+def _cached_skip(page_cache, path, max_pages):
+    """
+    A skip decided from the page cache alone, without opening the PDF
+    """
+    if page_cache is None:
+        return None
+    info = page_cache.get(path)
+    if info is None:
+        return None
+    reason = info.skip_reason(max_pages)
+    if reason is None:
+        return None
+    return InvoiceSkipped(reason, info.page_count, info.mediaboxes)
+
+
+def _remember(page_cache, outcome, max_pages):
+    if page_cache is None:
+        return
+    if outcome.result is not None and outcome.result.mediaboxes is not None:
+        page_cache.put(outcome.path, outcome.result.total_pages, outcome.result.mediaboxes, max_pages)
+    elif isinstance(outcome.error, InvoiceSkipped) and outcome.error.total_pages is not None:
+        page_cache.put(outcome.path, outcome.error.total_pages, outcome.error.mediaboxes or [], max_pages)
+
+
+def _cached_render(render_cache, path, settings):
+    """
+    (entry key, RenderOutcome from the render cache or None)
+    """
+    if render_cache is None:
+        return None, None
+    start = time.perf_counter()
+    key = render_cache.key(path, settings)
+    cached = render_cache.get(key) if key else None
+    if cached is None:
+        return key, None
+    result = RenderResult(path, cached.triplicate_count, cached.total_pages, data=cached.data,
+                          mediaboxes=cached.mediaboxes, timings={"cache": time.perf_counter() - start},
+                          output_pages=cached.output_pages)
+    return key, result
+
+
+def _store(render_cache, key, outcome):
+    if key is None or outcome.result is None:
+        return
+    result = outcome.result
+    data = result.get_data()
+    render_cache.put(key, data, result.triplicate_count, result.total_pages, result.mediaboxes, result.output_pages)
+
+
+def render_in_order(paths, workers=1, timeout=DEFAULT_TIMEOUT, page_cache=None, optimizer=None, render_cache=None,
+                    **options):
+    """
+    Yield a RenderOutcome per path, in the order of paths. paths may be
+    a lazy iterable: it is only read as far as the renderer has room
+    - workers <= 1 renders in this process and keeps the page objects
+    - Otherwise a pool of worker processes renders ahead of the consumer,
+      at most 2 * workers invoices in flight
+    - With a PageCountCache, invoices already known to be skipped are
+      never opened, and every parsed invoice is recorded in the cache
+    - With a SpoolOptimizer, each invoice's PDF is optimised as it is
+      written (by the worker, with a pool)
+    - With a RenderCache, invoices rendered before with the same settings
+      come straight from the cache, and every new rendering is stored,
+      in this process once the caller has written its PDF (get_data)
+    Skips (too many / too few pages) come back as InvoiceSkipped, a
+    ValueError, everything else as Exception, so callers can keep their
+    existing error handling
+    """
+    max_pages = options.get("max_pages")
+    settings = render_settings(optimizer=optimizer, **options) if render_cache else None
+
+    if workers <= 1:
+        for index, path in enumerate(paths):
+            skipped = _cached_skip(page_cache, path, max_pages)
+            if skipped:
+                yield RenderOutcome(index, path, error=skipped)
+                continue
+            key, cached = _cached_render(render_cache, path, settings)
+            if cached:
+                yield RenderOutcome(index, path, result=cached)
+                continue
+            try:
+                timings = {}
+                pages, count, total_pages, mediaboxes = select_triplicate_pages(path, timings=timings, **options)
+                result = RenderResult(path, count, total_pages, pages=pages, mediaboxes=mediaboxes,
+                                      timings=timings, optimizer=optimizer)
+                outcome = RenderOutcome(index, path, result=result)
+            except Exception as e:
+                outcome = RenderOutcome(index, path, error=e)
+            _remember(page_cache, outcome, max_pages)
+            yield outcome
+            if outcome.result is not None and outcome.result.data is not None:
+                # Kept once the caller has written the PDF; pages only wanted
+                # as page objects (a batch job's) are never written for this
+                _store(render_cache, key, outcome)
+        return
+
+    if optimizer:
+        options = dict(options, optimizer=optimizer)
+    pool = multiprocessing.Pool(processes=workers)
+    timed_out = False
+    finished = False
+    try:
+        in_flight = deque()
+        next_index = 0
+        paths = iter(paths)
+        next_path = next(paths, None)
+
+        while next_path is not None or in_flight:
+            # Keep the reorder window full
+            while next_path is not None and len(in_flight) < 2 * workers:
+                path = next_path
+                skipped = _cached_skip(page_cache, path, max_pages)
+                key, cached = (None, None) if skipped else _cached_render(render_cache, path, settings)
+                if skipped:
+                    in_flight.append((next_index, path, None, RenderOutcome(next_index, path, error=skipped)))
+                elif cached:
+                    in_flight.append((next_index, path, None, RenderOutcome(next_index, path, result=cached)))
+                else:
+                    in_flight.append((next_index, path, key, pool.apply_async(_render_job, ((path, options),))))
+                next_index += 1
+                next_path = next(paths, None)
+
+            index, path, key, pending = in_flight.popleft()
+            if isinstance(pending, RenderOutcome):
+                yield pending
+                continue
+
+            try:
+                status = pending.get(timeout)
+            except multiprocessing.TimeoutError:
+                timed_out = True
+                yield RenderOutcome(index, path, error=Exception(f"Timed out after {timeout}s"))
+                continue
+
+            if status[0] == "ok":
+                outcome = RenderOutcome(index, path, result=status[1])
+            elif status[0] == "skip":
+                outcome = RenderOutcome(index, path, error=InvoiceSkipped(*status[1:]))
+            else:
+                outcome = RenderOutcome(index, path, error=Exception(status[1]))
+            _remember(page_cache, outcome, max_pages)
+            _store(render_cache, key, outcome)
+            yield outcome
+        finished = True
+    finally:
+        if timed_out or not finished:
+            # A stuck worker would never finish, and an abandoned batch
+            # has no use for the invoices still in flight
+            pool.terminate()
+        else:
+            pool.close()
+        pool.join()
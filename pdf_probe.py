@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Lightweight PDF page-count probe
+Reads only the trailer, the cross-reference table and two small objects
+(the document catalog and the root /Pages node) to find /Count, instead
+of loading the whole file into a PdfReader. Files the probe can't read
+safely (cross-reference streams, damaged tables, ...) return None so
+the caller can fall back to the full reader
+
+Run directly to compare the probe with PdfReader on a folder:
+    python pdf_probe.py /path/to/invoices
+"""
+
+import os
+import re
+import sys
+import time
+
+TAIL_SIZE = 2048
+OBJECT_READ_LIMIT = 1024 * 1024  # give up on objects larger than this
+
+_STARTXREF = re.compile(rb"startxref\s+(\d+)")
+_SUBSECTION = re.compile(rb"\s*(\d+)\s+(\d+)[ \t]*\r?\n?")
+_ENTRY = re.compile(rb"(\d{10}) (\d{5}) ([nf])")
+_ROOT = re.compile(rb"/Root\s+(\d+)\s+(\d+)\s+R")
+_PREV = re.compile(rb"/Prev\s+(\d+)")
+_XREFSTM = re.compile(rb"/XRefStm\s+\d+")
+_PAGES = re.compile(rb"/Pages\s+(\d+)\s+(\d+)\s+R")
+_COUNT = re.compile(rb"/Count\s+(\d+)(\s+\d+\s+R)?")  # group 2: an indirect count
+
+
+class _XrefSection:
+    """
+    One subsection of a classic xref table: entries are looked up by
+    seeking straight to them, the table itself is never read in full
+    """
+
+    def __init__(self, first, count, position):
+        self.first = first
+        self.count = count
+        self.position = position
+
+
+def _read_xref_table(f, offset):
+    """
+    Parse the xref table at offset. Returns (sections, trailer bytes)
+    or None if this isn't a classic table
+    """
+    f.seek(offset)
+    if f.read(4) != b"xref":
+        return None
+
+    sections = []
+    position = offset + 4
+    while True:
+        f.seek(position)
+        head = f.read(64)
+        stripped = head.lstrip()
+        if stripped.startswith(b"trailer"):
+            f.seek(position + (len(head) - len(stripped)))
+            trailer = f.read(4096)
+            end = trailer.find(b"startxref")
+            return sections, trailer if end == -1 else trailer[:end]
+        match = _SUBSECTION.match(head)
+        if not match:
+            return None
+        first, count = int(match.group(1)), int(match.group(2))
+        entries_start = position + match.end()
+        sections.append(_XrefSection(first, count, entries_start))
+        position = entries_start + 20 * count
+
+
+def _lookup(f, sections, number):
+    """
+    Byte offset of object number from the table sections, or None
+    """
+    for section in sections:
+        if section.first <= number < section.first + section.count:
+            f.seek(section.position + 20 * (number - section.first))
+            match = _ENTRY.match(f.read(20))
+            if not match:
+                raise ValueError("Malformed xref entry")
+            if match.group(3) != b"n":
+                return None
+            return int(match.group(1))
+    return None
+
+
+def _read_object(f, offset, number):
+    """
+    The bytes of one indirect object, up to endobj
+    """
+    f.seek(offset)
+    data = b""
+    while len(data) < OBJECT_READ_LIMIT:
+        chunk = f.read(4096)
+        if not chunk:
+            break
+        data += chunk
+        end = data.find(b"endobj")
+        if end != -1:
+            data = data[:end]
+            break
+    else:
+        raise ValueError("Object too large to probe")
+
+    header = re.match(rb"\s*(\d+)\s+\d+\s+obj", data)
+    if not header or int(header.group(1)) != number:
+        raise ValueError("Xref offset does not point at the object")
+    # Only the dictionary matters, never a stream body
+    stream = data.find(b"stream", header.end())
+    if stream != -1:
+        data = data[:stream]
+    return data[header.end():]
+
+
+def probe_page_count(path):
+    """
+    Return the page count of a PDF from its root /Pages /Count,
+    or None if the file needs the full reader
+    """
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(size - TAIL_SIZE, 0))
+            matches = _STARTXREF.findall(f.read())
+            if not matches:
+                return None
+
+            # Newest table first; incremental updates chain back via /Prev
+            tables = []
+            root = None
+            offset = int(matches[-1])
+            seen = set()
+            while offset is not None and offset not in seen and offset < size:
+                seen.add(offset)
+                table = _read_xref_table(f, offset)
+                if table is None:
+                    return None
+                sections, trailer = table
+                if _XREFSTM.search(trailer):
+                    # Hybrid file: some objects only live in an xref stream
+                    return None
+                tables.append(sections)
+                if root is None:
+                    match = _ROOT.search(trailer)
+                    root = int(match.group(1)) if match else None
+                prev = _PREV.search(trailer)
+                offset = int(prev.group(1)) if prev else None
+
+            if root is None:
+                return None
+
+            def find(number):
+                for sections in tables:
+                    found = _lookup(f, sections, number)
+                    if found is not None:
+                        return found
+                raise ValueError(f"Object {number} not in xref")
+
+            catalog = _read_object(f, find(root), root)
+            match = _PAGES.search(catalog)
+            if not match:
+                return None
+            pages_number = int(match.group(1))
+            pages = _read_object(f, find(pages_number), pages_number)
+            # The /Count of the root node sits beside /Kids; nested
+            # dictionaries don't occur in a /Pages node
+            match = _COUNT.search(pages)
+            if not match or match.group(2):
+                # An indirect /Count (12 0 R) is an object number, not the count
+                return None
+            return int(match.group(1))
+    except (OSError, ValueError):
+        return None
+
+
+def _measure(folder):
+    """
+    Time the probe against PdfReader over every PDF in folder
+    """
+    from pypdf import PdfReader
+
+    paths = sorted(entry.path for entry in os.scandir(folder)
+                   if entry.is_file() and entry.name.lower().endswith(".pdf"))
+    if not paths:
+        print(f"No PDF files in {folder}")
+        return 1
+
+    start = time.perf_counter()
+    probed = [probe_page_count(path) for path in paths]
+    probe_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    counts = []
+    for path in paths:
+        try:
+            counts.append(len(PdfReader(path).pages))
+        except Exception:
+            counts.append(None)
+    reader_time = time.perf_counter() - start
+
+    fallbacks = sum(1 for count in probed if count is None)
+    mismatches = [path for path, probe, count in zip(paths, probed, counts)
+                  if probe is not None and probe != count]
+
+    print(f"Files:          {len(paths)}")
+    print(f"Probe:          {probe_time:.3f}s ({fallbacks} file(s) need the full reader)")
+    print(f"PdfReader:      {reader_time:.3f}s")
+    if probe_time > 0:
+        print(f"Speedup:        {reader_time / probe_time:.1f}x")
+    for path in mismatches:
+        print(f"MISMATCH: {path}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python pdf_probe.py <invoice folder>")
+        sys.exit(2)
+    sys.exit(_measure(sys.argv[1]))
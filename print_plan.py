@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Dry-run print planner
+Works out what printing a range would cost without rendering anything:
+for every invoice the pages that would print, or why it is skipped, and
+for the whole run the sheets, the spool bytes and the printer time.
+Only metadata is read: page counts come from the page cache or the
+trailer probe (pdf_probe), sizes from the file system. Files the probe
+can't read fall back to the full reader, which still only loads the
+page tree; page content is never opened
+
+A plan is saved as a JSON manifest that can be printed as it stands
+(invoice_printer_cli.py --from-plan), with the settings it was made for:
+
+    {"version": 1, "folder": ..., "settings": {...}, "totals": {...},
+     "invoices": [{"invoice": "C300.pdf", "pages": 5, "print": [5], ...},
+                  {"invoice": "C301.pdf", "pages": 2, "skip": "Less than 3 pages: ..."}]}
+
+Spool bytes are estimated from file sizes, on the high side: a print
+job per invoice carries the fonts and images its pages use, which are
+most of an invoice file, so it counts as the whole file; in a batch
+those are shared between invoices, so each printed page counts as its
+share of the file. Print time is the sheets at the printer's pages per
+minute plus a fixed cost per print job
+"""
+
+import json
+import os
+from page_cache import skip_reason
+from parallel_render import triplicate_count
+from pdf_probe import probe_page_count
+from resource_dedup import format_bytes
+
+PLAN_VERSION = 1
+
+DEFAULT_PAGES_PER_MINUTE = 30  # a typical office laser printer
+JOB_SECONDS = 5  # per print job: spooling, warming up, the first page out
+
+
+class PlannedInvoice:
+    """
+    One invoice in a plan: the page numbers (1-based) to print, or a
+    skip reason (the page rules) or error (the file can't be read)
+    """
+
+    def __init__(self, name, size=None, mtime_ns=None, total_pages=None, pages=None, sheets=0, spool_bytes=0,
+                 skip=None, error=None):
+        self.name = name
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.total_pages = total_pages
+        self.pages = pages or []
+        self.sheets = sheets
+        self.spool_bytes = spool_bytes
+        self.skip = skip
+        self.error = error
+
+    @property
+    def status(self):
+        if self.error:
+            return "failed"
+        return "skipped" if self.skip else "planned"
+
+    def record(self):
+        record = {"invoice": self.name, "size": self.size, "mtime_ns": self.mtime_ns, "pages": self.total_pages}
+        if self.error:
+            record["error"] = self.error
+        elif self.skip:
+            record["skip"] = self.skip
+        else:
+            record.update({"print": self.pages, "sheets": self.sheets, "spool_bytes": self.spool_bytes})
+        return record
+
+    @classmethod
+    def from_record(cls, record):
+        return cls(record["invoice"], record.get("size"), record.get("mtime_ns"), record.get("pages"),
+                   record.get("print"), record.get("sheets", 0), record.get("spool_bytes", 0),
+                   record.get("skip"), record.get("error"))
+
+    def changed(self, folder):
+        """
+        True if the file is no longer the one that was planned
+        """
+        try:
+            st = os.stat(os.path.join(folder, self.name))
+        except OSError:
+            return True
+        return st.st_size != self.size or st.st_mtime_ns != self.mtime_ns
+
+
+class PrintPlan:
+    """
+    The planned invoices of one folder, in print order, and the settings
+    (as the run journal stores them) they were planned with
+    """
+
+    def __init__(self, folder, settings, invoices, pages_per_minute=DEFAULT_PAGES_PER_MINUTE):
+        self.folder = str(folder)
+        self.settings = settings
+        self.invoices = invoices
+        self.pages_per_minute = pages_per_minute
+
+    def to_print(self):
+        """
+        Paths of the invoices that print, in order
+        """
+        return [os.path.join(self.folder, invoice.name) for invoice in self.invoices if invoice.status == "planned"]
+
+    def totals(self):
+        printed = [invoice for invoice in self.invoices if invoice.status == "planned"]
+        pages = sum(len(invoice.pages) for invoice in printed)
+        slots = 2 if self.settings.get("two_up") else 1
+        if self.settings.get("batch"):
+            # One job, split in chunks; 2-up sheets are filled across invoices
+            sheets = -(-pages // slots)
+            chunk_pages = (self.settings.get("spool") or {}).get("max_pages_per_chunk")
+            jobs = -(-pages // chunk_pages) if chunk_pages else min(pages, 1)
+        else:
+            sheets = sum(invoice.sheets for invoice in printed)
+            jobs = len(printed)
+        return {
+            "invoices": len(self.invoices),
+            "planned": len(printed),
+            "skipped": sum(1 for invoice in self.invoices if invoice.status == "skipped"),
+            "failed": sum(1 for invoice in self.invoices if invoice.status == "failed"),
+            "pages": pages,
+            "sheets": sheets,
+            "jobs": jobs,
+            "spool_bytes": sum(invoice.spool_bytes for invoice in printed),
+            "print_seconds": round(sheets * 60 / self.pages_per_minute + jobs * JOB_SECONDS),
+        }
+
+    def manifest(self):
+        return {"version": PLAN_VERSION, "folder": os.path.abspath(self.folder), "settings": self.settings,
+                "pages_per_minute": self.pages_per_minute, "totals": self.totals(),
+                "invoices": [invoice.record() for invoice in self.invoices]}
+
+    def save(self, path):
+        """
+        Write the manifest to path ("-" for stdout)
+        """
+        text = json.dumps(self.manifest(), indent=1)
+        if path == "-":
+            print(text)
+            return
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+def load_plan(path):
+    """
+    The PrintPlan saved in a manifest; ValueError if it isn't one
+    """
+    with open(path, encoding="utf-8") as f:
+        try:
+            manifest = json.load(f)
+        except ValueError:
+            raise ValueError(f"{path} is not a print plan")
+    if not isinstance(manifest, dict) or manifest.get("version") != PLAN_VERSION:
+        raise ValueError(f"{path} is not a print plan (version {PLAN_VERSION})")
+    return PrintPlan(manifest["folder"], manifest.get("settings") or {},
+                     [PlannedInvoice.from_record(record) for record in manifest["invoices"]],
+                     manifest.get("pages_per_minute", DEFAULT_PAGES_PER_MINUTE))
+
+
+def page_count(path, page_cache=None):
+    """
+    Page count of one invoice from its metadata: the page cache, the
+    trailer probe, or failing both the page tree
+    """
+    info = page_cache.get(path) if page_cache is not None else None
+    if info is not None:
+        return info.page_count
+    count = probe_page_count(path)
+    if count is None:
+        from pypdf import PdfReader
+        count = len(PdfReader(path).pages)
+    return count
+
+
+def plan_invoice(path, slots=1, batch=False, max_pages=None, max_triplicate=None, page_cache=None):
+    """
+    The PlannedInvoice of one file, printed slots pages per sheet, on
+    its own or (batch=True) as part of a batch
+    """
+    name = os.path.basename(str(path))
+    try:
+        st = os.stat(path)
+        total_pages = page_count(path, page_cache)
+    except Exception as e:
+        return PlannedInvoice(name, error=f"{type(e).__name__}: {e}")
+    planned = PlannedInvoice(name, st.st_size, st.st_mtime_ns, total_pages)
+    planned.skip = skip_reason(total_pages, max_pages)
+    if planned.skip is None:
+        count = triplicate_count(total_pages, max_triplicate)
+        planned.pages = list(range(total_pages - count + 1, total_pages + 1))
+        planned.sheets = -(-count // slots)
+        planned.spool_bytes = st.st_size * count // total_pages if batch else st.st_size
+    return planned
+
+
+def plan_invoices(folder, paths, settings, max_pages=None, max_triplicate=None, page_cache=None,
+                  pages_per_minute=DEFAULT_PAGES_PER_MINUTE):
+    """
+    The PrintPlan for printing paths with settings (see run_journal),
+    under the given page rules
+    """
+    slots = 2 if settings.get("two_up") else 1
+    batch = settings.get("batch", False)
+    invoices = [plan_invoice(path, slots, batch, max_pages, max_triplicate, page_cache) for path in paths]
+    return PrintPlan(folder, settings, invoices, pages_per_minute)
+
+
+def format_duration(seconds):
+    """
+    3725 → "1h 02m", 125 → "2m 05s"
+    """
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m {seconds % 60:02d}s"
+
+
+def format_totals(totals):
+    """
+    The totals of a plan as report lines
+    """
+    return [
+        f"Invoices: {totals['invoices']} ({totals['planned']} to print, {totals['skipped']} skipped, "
+        f"{totals['failed']} unreadable)",
+        f"Pages: {totals['pages']} on {totals['sheets']} sheet(s), {totals['jobs']} print job(s)",
+        f"Spool size: about {format_bytes(totals['spool_bytes'])}",
+        f"Print time: about {format_duration(totals['print_seconds'])}",
+    ]
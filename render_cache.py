@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Rendered-triplicate cache
+Keeps the finished triplicate PDF of every invoice, so a reprint goes
+straight from the cache to the spooler without parsing, selecting,
+scaling or writing anything. Entries are content-addressed: the key is
+a hash of the source file's bytes plus the render settings (page size,
+skip rule, imposition, optimisation), so an edited invoice or changed
+settings simply miss. The PDFs live in one folder per user next to a
+small SQLite index; the least recently used ones are evicted once the
+cache grows past its size cap
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+RENDER_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".invoice_printer", "render_cache")
+INDEX_FILENAME = "index.sqlite"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Bump when the rendered output changes for the same settings
+CACHE_VERSION = 2
+
+HASH_BLOCK = 1024 * 1024
+
+
+def render_settings(fit_size=None, max_pages=None, max_triplicate=None, layout=None, optimizer=None):
+    """
+    Everything besides the source file that decides the rendered output
+    """
+    if layout is not None:
+        layout = dict(layout.settings(), slot_size=list(layout.slot_size), sheet_size=list(layout.sheet_size))
+    return {
+        "version": CACHE_VERSION,
+        "fit_size": list(fit_size) if fit_size else None,
+        "max_pages": max_pages,
+        "max_triplicate": max_triplicate,
+        "layout": layout,
+        "optimize_dpi": optimizer.dpi if optimizer else None,
+    }
+
+
+class CachedRender:
+    """
+    One cache entry: the triplicate PDF and what is known about its source
+    """
+
+    def __init__(self, data, triplicate_count, total_pages, mediaboxes, output_pages=None):
+        self.data = data
+        self.triplicate_count = triplicate_count
+        self.total_pages = total_pages
+        self.mediaboxes = mediaboxes
+        self.output_pages = output_pages  # pages (or sheets) in data, as the writer counted them
+
+
+class RenderCache:
+    """
+    Content-addressed store of rendered triplicate PDFs with LRU eviction
+    - key(path, settings) hashes the source (rehashing only files whose
+      size or mtime changed) and returns the entry key
+    - get(key) returns a CachedRender, or None
+    - put(key, ...) stores a freshly rendered invoice
+    """
+
+    def __init__(self, folder=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.folder = str(folder or RENDER_CACHE_DIR)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+        os.makedirs(self.folder, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(self.folder, INDEX_FILENAME))
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS rendered ("
+            " key TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " triplicate_count INTEGER NOT NULL,"
+            " total_pages INTEGER NOT NULL,"
+            " mediaboxes TEXT NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " output_pages INTEGER)"
+        )
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(rendered)")]
+        if "output_pages" not in columns:
+            # Caches from before the writer's page count: those entries miss once and are stored again
+            self.conn.execute("ALTER TABLE rendered ADD COLUMN output_pages INTEGER")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS rendered_last_used ON rendered (last_used)")
+        # Source hashes, so an unchanged file isn't read again on every run
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            " path TEXT PRIMARY KEY,"
+            " size INTEGER NOT NULL,"
+            " mtime_ns INTEGER NOT NULL,"
+            " hash TEXT NOT NULL)"
+        )
+        self.conn.commit()
+
+    @classmethod
+    def open(cls, folder=None, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        The cache, or None when it is switched off (max_bytes 0) or can't
+        be used, so callers simply render everything
+        """
+        if not max_bytes:
+            return None
+        try:
+            return cls(folder, max_bytes)
+        except (OSError, sqlite3.Error):
+            return None
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+    def source_hash(self, path):
+        path = os.path.abspath(str(path))
+        st = os.stat(path)
+        row = self.conn.execute("SELECT size, mtime_ns, hash FROM sources WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            return row[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b""):
+                digest.update(block)
+        self.conn.execute("INSERT OR REPLACE INTO sources (path, size, mtime_ns, hash) VALUES (?, ?, ?, ?)",
+                          (path, st.st_size, st.st_mtime_ns, digest.hexdigest()))
+        self._changed()
+        return digest.hexdigest()
+
+    def key(self, path, settings):
+        """
+        The entry key for path rendered with settings, or None if the
+        file can't be read (it then fails in the renderer as usual)
+        """
+        try:
+            source = self.source_hash(path)
+        except (OSError, sqlite3.Error):
+            return None
+        return hashlib.sha256((source + json.dumps(settings, sort_keys=True)).encode("utf-8")).hexdigest()
+
+    def _blob(self, key):
+        return os.path.join(self.folder, key[:2], key + ".pdf")
+
+    def get(self, key):
+        try:
+            row = self.conn.execute(
+                "SELECT triplicate_count, total_pages, mediaboxes, output_pages FROM rendered"
+                " WHERE key = ? AND output_pages IS NOT NULL", (key,)
+            ).fetchone()
+            if row is not None:
+                with open(self._blob(key), "rb") as f:
+                    data = f.read()
+        except (OSError, sqlite3.Error):
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        try:
+            self.conn.execute("UPDATE rendered SET last_used = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.Error:
+            pass
+        self._changed()
+        return CachedRender(data, row[0], row[1], [tuple(box) for box in json.loads(row[2])], row[3])
+
+    def put(self, key, data, triplicate_count, total_pages, mediaboxes, output_pages):
+        path = self._blob(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written aside and renamed, so a crash never leaves half a PDF under a valid key
+            temp = f"{path}.{os.getpid()}.tmp"
+            with open(temp, "wb") as f:
+                f.write(data)
+            os.replace(temp, path)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO rendered"
+                " (key, size, triplicate_count, total_pages, mediaboxes, last_used, output_pages)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, len(data), triplicate_count, total_pages,
+                 json.dumps([list(box) for box in mediaboxes or []]), time.time(), output_pages)
+            )
+        except (OSError, sqlite3.Error):
+            return
+        self._changed()
+
+    def _changed(self):
+        # Commit in batches, like the page cache
+        self._pending += 1
+        if self._pending >= 200:
+            self.flush()
+
+    def evict(self):
+        """
+        Drop the least recently used entries until the cache fits in max_bytes
+        """
+        total = 0
+        evicted = []
+        for key, size in self.conn.execute("SELECT key, size FROM rendered ORDER BY last_used DESC"):
+            total += size
+            if total > self.max_bytes:
+                evicted.append(key)
+        for key in evicted:
+            self.conn.execute("DELETE FROM rendered WHERE key = ?", (key,))
+            try:
+                os.remove(self._blob(key))
+            except OSError:
+                pass
+        return len(evicted)
+
+    def flush(self):
+        try:
+            self.evict()
+            self.conn.commit()
+        except sqlite3.Error:
+            pass
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+        self.conn.close()
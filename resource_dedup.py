@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Cross-invoice resource deduplication
+Every invoice carries its own copy of the company logo, the fonts and
+the letterhead Form XObjects. Merged into one batch PdfWriter, each
+copy would be written again, once per invoice. ResourceDeduplicator
+hashes those resources as pages are added and points later copies at
+the object already in the writer, so each distinct image, font or form
+is written once per spool job
+"""
+
+import hashlib
+
+from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+# Resource kinds worth sharing: images and forms (/XObject) and fonts
+SHARED_RESOURCES = ("/XObject", "/Font")
+
+
+class ResourceDeduplicator:
+    """
+    Adds pages to one PdfWriter, reusing identical resources
+    Relies on the writer's table of objects it has already copied from
+    each source PDF (pypdf's _id_translated): an identical resource from
+    another invoice is entered there as already copied. Without that
+    table (other pypdf versions) pages are added unchanged
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.enabled = isinstance(getattr(writer, "_id_translated", None), dict)
+        self.objects = {}  # content hash → object number in the writer
+        self.duplicates = 0
+        self.bytes_saved = 0  # stream bytes not written again
+        self._hashes = {}  # (id(source pdf), object number) → (hash, stream bytes)
+
+    def add_page(self, page):
+        """
+        writer.add_page(page), sharing resources already in the writer
+        """
+        if not self.enabled:
+            return self.writer.add_page(page)
+
+        for ref in self._resource_refs(page):
+            copied = self.writer._id_translated.setdefault(id(ref.pdf), {"PreventGC": ref.pdf})
+            if ref.idnum in copied:
+                continue
+            digest, size = self._hash(ref)
+            if digest in self.objects:
+                copied[ref.idnum] = self.objects[digest]
+                self.duplicates += 1
+                self.bytes_saved += size
+            else:
+                # Copied right away, so a second copy on the same (2-up) sheet is shared too
+                self.objects[digest] = ref.clone(self.writer).idnum
+        return self.writer.add_page(page)
+
+    def release(self):
+        """
+        Let go of the writer and every hash (and, through them, of the
+        source PDFs) once its chunk is written; the counts stay
+        """
+        self.writer = None
+        self.enabled = False
+        self.objects = {}
+        self._hashes = {}
+
+    def _resource_refs(self, page):
+        """
+        Indirect references to the page's shared resources, including
+        those used inside its Form XObjects (a fitted page draws its
+        source page as a form that isn't in any file yet)
+        """
+        refs = []
+        seen = set()
+        pending = [page.get("/Resources")]
+        while pending:
+            resources = pending.pop()
+            resources = resources.get_object() if resources is not None else None
+            if not isinstance(resources, DictionaryObject):
+                continue
+            for kind in SHARED_RESOURCES:
+                entries = resources.get(kind)
+                entries = entries.get_object() if entries is not None else None
+                if not isinstance(entries, DictionaryObject):
+                    continue
+                for value in entries.values():
+                    if isinstance(value, IndirectObject):
+                        if value.pdf is None:
+                            continue
+                        key = (id(value.pdf), value.idnum)
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                        refs.append(value)
+                    obj = value.get_object()
+                    if kind == "/XObject" and isinstance(obj, StreamObject) and obj.get("/Subtype") == "/Form":
+                        pending.append(obj.get("/Resources"))
+        return refs
+
+    def _hash(self, ref):
+        key = (id(ref.pdf), ref.idnum)
+        if key not in self._hashes:
+            digest = hashlib.sha1()
+            size = self._feed(digest, ref.get_object(), {key})
+            self._hashes[key] = (digest.digest(), size)
+        return self._hashes[key]
+
+    def _feed(self, digest, obj, visiting):
+        """
+        Add obj and everything it references to digest; returns the
+        stream bytes found on the way
+        """
+        if isinstance(obj, IndirectObject):
+            key = (id(obj.pdf), obj.idnum)
+            if key in self._hashes:
+                digest.update(self._hashes[key][0])
+                return self._hashes[key][1]
+            if key in visiting:
+                # A cycle (e.g. a /Parent link): its shape is all that matters
+                digest.update(b"R")
+                return 0
+            return self._feed(digest, obj.get_object(), visiting | {key})
+        size = 0
+        if isinstance(obj, DictionaryObject):
+            digest.update(b"<<")
+            for name in sorted(obj):
+                digest.update(name.encode("utf-8", "replace"))
+                size += self._feed(digest, obj.raw_get(name), visiting)
+            digest.update(b">>")
+            if isinstance(obj, StreamObject):
+                # The data as stored (still compressed), not decoded
+                data = obj._data
+                digest.update(b"stream%d:" % len(data))
+                digest.update(data)
+                size += len(data)
+        elif isinstance(obj, ArrayObject):
+            digest.update(b"[")
+            for item in obj:
+                size += self._feed(digest, item, visiting)
+            digest.update(b"]")
+        else:
+            digest.update(repr(obj).encode("utf-8", "replace"))
+            digest.update(b" ")
+        return size
+
+
+def format_bytes(size):
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} MB"
+    return f"{size / 1024:.0f} KB"
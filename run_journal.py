@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Crash-safe run journal
+Every print run appends what happens to each invoice to a JSON Lines
+journal on the local disk:
+
+    {"event": "run", "folder": ..., "settings": {...}, "invoices": ["C300.pdf", ...]}
+    {"event": "state", "invoice": "C300.pdf", "state": "rendered"}
+    {"event": "state", "invoice": "C300.pdf", "state": "submitted", "job_id": "Printer-12"}
+    {"event": "state", "invoice": "C300.pdf", "state": "completed"}
+    {"event": "finished"}
+
+States: planned (listed in the run record), rendered, submitted,
+completed, plus skipped and failed. Lines that must survive a crash
+(the run record, submitted, completed, finished) are fsync'd before the
+run moves on, so an invoice the journal doesn't show as submitted was
+never handed to the printer. If the run dies, resuming it prints the
+remaining invoices only, with the same settings, without opening the
+PDFs that already went out
+"""
+
+import hashlib
+import json
+import os
+import time
+
+JOURNAL_DIR = os.path.join(os.path.expanduser("~"), ".invoice_printer", "journal")
+
+PLANNED = "planned"
+RENDERED = "rendered"
+SUBMITTED = "submitted"
+COMPLETED = "completed"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+# Nothing left to do for invoices in these states; submitted ones may
+# still be in the printer queue, but sending them again would print twice
+DONE_STATES = (SUBMITTED, COMPLETED, SKIPPED)
+
+# Written with fsync: losing one of these could reprint or skip an invoice
+DURABLE_STATES = (SUBMITTED, COMPLETED)
+
+
+def journal_path(folder, journal_dir=JOURNAL_DIR):
+    """
+    One journal per invoice folder, on the local disk: fsync on a
+    network share costs far more, and the journal is about this machine
+    """
+    folder = os.path.normcase(os.path.abspath(str(folder)))
+    digest = hashlib.sha1(folder.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(journal_dir, f"{digest}.jsonl")
+
+
+class JournalState:
+    """
+    What a journal says about its last run
+    """
+
+    def __init__(self, folder, settings, invoices, states, finished, started):
+        self.folder = folder
+        self.settings = settings
+        self.invoices = invoices  # file names, in print order
+        self.states = states  # file name → last state
+        self.finished = finished
+        self.started = started
+
+    def state(self, name):
+        return self.states.get(name, PLANNED)
+
+    def pending(self):
+        """
+        File names still to print, in the original order
+        """
+        return [name for name in self.invoices if self.state(name) not in DONE_STATES]
+
+    def counts(self):
+        counts = {}
+        for name in self.invoices:
+            state = self.state(name)
+            counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    @property
+    def resumable(self):
+        return not self.finished and bool(self.pending())
+
+
+def load_journal(folder, journal_dir=JOURNAL_DIR):
+    """
+    The last run recorded for folder, or None. A line cut short by a
+    crash is ignored
+    """
+    path = journal_path(folder, journal_dir)
+    try:
+        f = open(path, encoding="utf-8")
+    except FileNotFoundError:
+        return None
+    state = None
+    with f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            event = record.get("event")
+            if event == "run":
+                state = JournalState(record["folder"], record.get("settings", {}), record["invoices"], {},
+                                     False, record.get("time"))
+            elif state is None:
+                continue
+            elif event == "state":
+                state.states[record["invoice"]] = record["state"]
+            elif event == "finished":
+                state.finished = True
+            elif event == "resume":
+                state.finished = False
+    return state
+
+
+class RunJournal:
+    """
+    Appends one run's progress to the folder's journal. Safe to use
+    from the GUI's worker thread (one writer per run)
+    """
+
+    def __init__(self, folder, journal_dir=JOURNAL_DIR):
+        self.folder = os.path.abspath(str(folder))
+        self.path = journal_path(folder, journal_dir)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = None
+        self.jobs = {}  # id(PrintJob) → invoice names in that job
+
+    def start(self, files, settings):
+        """
+        Begin a new run: replaces the previous run's journal
+        """
+        self.file = open(self.path, "w", encoding="utf-8")
+        self._write({"event": "run", "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "folder": self.folder,
+                     "settings": settings, "invoices": [os.path.basename(str(path)) for path in files]},
+                    durable=True)
+
+    def resume(self):
+        """
+        Continue the run already in the journal
+        """
+        self.file = open(self.path, "a", encoding="utf-8")
+        self._write({"event": "resume", "time": time.strftime("%Y-%m-%dT%H:%M:%S")}, durable=True)
+
+    def _write(self, record, durable=False):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        if durable:
+            os.fsync(self.file.fileno())
+
+    def mark(self, path, state, **extra):
+        record = {"event": "state", "invoice": os.path.basename(str(path)), "state": state}
+        record.update(extra)
+        self._write(record, durable=state in DURABLE_STATES)
+
+    def submitted(self, paths, job):
+        """
+        Record that a print job holding these invoices went to the spooler
+        """
+        names = [os.path.basename(str(path)) for path in paths]
+        self.jobs[id(job)] = names
+        for name in names:
+            self._write({"event": "state", "invoice": name, "state": SUBMITTED, "job_id": job.job_id})
+        os.fsync(self.file.fileno())
+
+    def job_completed(self, job):
+        """
+        PrintQueue on_complete callback
+        """
+        names = self.jobs.pop(id(job), [])
+        for name in names:
+            self._write({"event": "state", "invoice": name, "state": COMPLETED})
+        if names:
+            os.fsync(self.file.fileno())
+
+    def finish(self):
+        self._write({"event": "finished", "time": time.strftime("%Y-%m-%dT%H:%M:%S")}, durable=True)
+        self.close()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+
+def start_journal(folder, files, settings, log=print):
+    """
+    A RunJournal for a new run of files, or None if it can't be
+    written (the run then goes ahead without one)
+    """
+    try:
+        journal = RunJournal(folder)
+        journal.start(files, settings)
+        return journal
+    except OSError as e:
+        log(f"Warning: no resume journal for this run ({e})")
+        return None
+
+
+def resume_journal(folder, log=print):
+    """
+    (files, settings, journal) to finish the folder's interrupted run,
+    or None if there is nothing to resume
+    """
+    state = load_journal(folder)
+    if state is None or not state.resumable:
+        return None
+    counts = ", ".join(f"{count} {name}" for name, count in state.counts().items())
+    log(f"Resuming the run started {state.started}: {counts}")
+    journal = RunJournal(folder)
+    journal.resume()
+    return [os.path.join(str(folder), name) for name in state.pending()], state.settings, journal
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Shared print queue for several workstations
+Lets every clerk's copy of the app feed one print station through a
+small SQLite database in the invoice folder (the share they all use):
+
+- a workstation adds the invoices it was asked for; an invoice already
+  in the queue, whoever added it, is not added again, unless its render
+  failed or its file has changed since (then it is queued again), or
+  the workstation asks for a reprint (requeue)
+- workstations claim queued invoices a few at a time, in one write
+  transaction, so no two render the same invoice; the rendered
+  triplicate PDF is left in a spool folder next to the database
+- the print station (only one runs at a time) takes rendered invoices
+  in the order they were queued, marks each one printing before it
+  is sent and printed once the spooler has it
+
+Every invoice in the queue prints by the same rules (page limit,
+triplicate pages, page size, 2-up, ...): those of the workstation that
+queued the first of the open invoices. Workstations render by them
+whatever their own, and the print station sends back whatever was
+rendered by others to be rendered again
+
+Like the run journal, the queue would rather miss a print than make
+two: an invoice marked printing is never sent again, even if the print
+station dies before it gets to the printer, until a new print station
+is told to release it (release_printing). A claim whose workstation
+went away goes back to the queue after CLAIM_TIMEOUT
+The database keeps SQLite's rollback journal: WAL needs shared memory,
+which machines on a network share don't have
+"""
+
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import tempfile
+import time
+
+QUEUE_FILENAME = ".invoice_printer_queue.sqlite"
+SPOOL_FOLDER = ".invoice_printer_spool"
+
+CLAIM_BATCH = 2  # invoices claimed at a time, per worker process
+CLAIM_TIMEOUT = 10 * 60  # seconds before a claim of a vanished workstation goes back to the queue
+STATION_TIMEOUT = 60  # seconds without a sign of life before another print station may take over
+LOCK_TIMEOUT = 60  # seconds to wait for another workstation's transaction
+STATION_POLL_INTERVAL = 1.0  # seconds the print station waits when nothing is rendered
+
+QUEUED = "queued"
+CLAIMED = "claimed"
+RENDERED = "rendered"
+PRINTING = "printing"
+PRINTED = "printed"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+# Still on their way to the printer
+OPEN_STATES = (QUEUED, CLAIMED, RENDERED)
+
+
+class SharedQueueError(Exception):
+    """
+    The shared queue can't be used as asked
+    """
+
+
+class SharedInvoice:
+    """
+    One rendered invoice as the print station takes it
+    """
+
+    def __init__(self, seq, name, output, total_pages, triplicate_count, station):
+        self.seq = seq
+        self.name = name
+        self.output = output  # file name in the spool folder
+        self.total_pages = total_pages
+        self.triplicate_count = triplicate_count
+        self.station = station  # the workstation that rendered it
+
+
+def station_name():
+    """
+    This workstation in the queue: host name and process ID
+    """
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class SharedQueue:
+    """
+    The shared queue of one invoice folder
+    - enqueue(paths) adds invoices
+    - claimed() claims and yields queued invoices until none are left;
+      rendered / skipped / failed record what became of each
+    - become_print_station, then take_rendered / printed / print_failed
+      on the print station
+    """
+
+    def __init__(self, folder, station=None):
+        self.folder = str(folder)
+        self.station = station or station_name()
+        self.spool_folder = os.path.join(self.folder, SPOOL_FOLDER)
+        self.rules = None  # the queue's rules as enqueue found them, as plain values (PrintRules.settings)
+        self._rules_text = None
+        # Autocommit mode: every transaction below is opened explicitly
+        self.conn = sqlite3.connect(os.path.join(self.folder, QUEUE_FILENAME), timeout=LOCK_TIMEOUT,
+                                    isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=DELETE")
+        with self._transaction() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS invoices ("
+                " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " name TEXT UNIQUE NOT NULL,"
+                " state TEXT NOT NULL,"
+                " station TEXT,"
+                " output TEXT,"
+                " total_pages INTEGER,"
+                " triplicate_count INTEGER,"
+                " job_id TEXT,"
+                " error TEXT,"
+                " updated REAL NOT NULL,"
+                " size INTEGER,"
+                " mtime_ns INTEGER,"
+                " rules TEXT)"
+            )
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(invoices)")]
+            # Queues from before changed files were queued again, and before the queue's rules
+            for column, kind in (("size", "INTEGER"), ("mtime_ns", "INTEGER"), ("rules", "TEXT")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE invoices ADD COLUMN {column} {kind}")
+            conn.execute("CREATE INDEX IF NOT EXISTS invoices_state ON invoices (state, seq)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS stations ("
+                " role TEXT PRIMARY KEY,"
+                " station TEXT NOT NULL,"
+                " seen REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rules ("
+                " id INTEGER PRIMARY KEY CHECK (id = 1),"
+                " settings TEXT NOT NULL)"
+            )
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # IMMEDIATE takes the write lock up front, so reading and updating the rows is one atomic step
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.conn
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def enqueue(self, paths, rules=None):
+        """
+        Add invoices to the queue; returns the names that were added. An
+        invoice the queue already has is added again (at the end) if its
+        render failed, or if its file changed since it was queued, even
+        once printed: it is another invoice now. The others are on their
+        way, or were printed or skipped as they are, by some workstation
+        rules: this workstation's (see _adopt_rules); self.rules then
+        holds those every invoice in the queue prints by
+        """
+        added = []
+        with self._transaction() as conn:
+            self._adopt_rules(conn, rules)
+            for path in paths:
+                name = os.path.basename(str(path))
+                size, mtime_ns = _file_stamp(path)
+                row = conn.execute("SELECT seq, state, size, mtime_ns, output FROM invoices WHERE name = ?",
+                                   (name,)).fetchone()
+                if row:
+                    seq, state, old_size, old_mtime_ns, output = row
+                    changed = (size is not None and old_size is not None
+                               and (size, mtime_ns) != (old_size, old_mtime_ns))
+                    # Printing: it may have reached the printer (see release_printing)
+                    if state in (QUEUED, PRINTING) or not (state == FAILED or changed):
+                        if old_size is None or state == QUEUED:
+                            conn.execute("UPDATE invoices SET size = ?, mtime_ns = ? WHERE seq = ?",
+                                         (size, mtime_ns, seq))
+                        continue
+                    self._drop(conn, seq, output)
+                self._insert(conn, name, size, mtime_ns)
+                added.append(name)
+        return added
+
+    def requeue(self, paths, rules=None):
+        """
+        Add invoices to the queue again whatever became of them: a
+        reprint. Those still on their way are left as they are; returns
+        the names that were added. rules: as for enqueue
+        """
+        added = []
+        with self._transaction() as conn:
+            self._adopt_rules(conn, rules)
+            for path in paths:
+                name = os.path.basename(str(path))
+                row = conn.execute("SELECT seq, state, output FROM invoices WHERE name = ?", (name,)).fetchone()
+                if row:
+                    seq, state, output = row
+                    if state in OPEN_STATES:
+                        continue
+                    self._drop(conn, seq, output)
+                self._insert(conn, name, *_file_stamp(path))
+                added.append(name)
+        return added
+
+    def _adopt_rules(self, conn, rules):
+        # A queue with nothing open takes the rules of whoever adds to it
+        # next; otherwise everyone renders by the rules it has
+        if rules is not None:
+            text = json.dumps(rules, sort_keys=True)
+            placeholders = ", ".join("?" * len(OPEN_STATES))
+            open_count = conn.execute(f"SELECT COUNT(*) FROM invoices WHERE state IN ({placeholders})",
+                                      OPEN_STATES).fetchone()[0]
+            if not open_count:
+                conn.execute("INSERT OR REPLACE INTO rules (id, settings) VALUES (1, ?)", (text,))
+        row = conn.execute("SELECT settings FROM rules WHERE id = 1").fetchone()
+        self._rules_text = row[0] if row else None
+        self.rules = json.loads(row[0]) if row else None
+
+    def _insert(self, conn, name, size, mtime_ns):
+        conn.execute("INSERT INTO invoices (name, state, station, size, mtime_ns, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                     (name, QUEUED, self.station, size, mtime_ns, time.time()))
+
+    def _drop(self, conn, seq, output):
+        # Queued again as a new row, so it goes to the end of the queue; a
+        # workstation still holding the old claim can no longer hand it in
+        conn.execute("DELETE FROM invoices WHERE seq = ?", (seq,))
+        if output:
+            _remove(os.path.join(self.spool_folder, output))
+
+    def claim(self, limit):
+        """
+        Take up to limit queued invoices to render; returns their paths, in queue order
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT settings FROM rules WHERE id = 1").fetchone()
+            if row and row[0] != self._rules_text:
+                # The queue has moved on to other rules than this workstation renders by
+                return []
+            # Claims of workstations that stopped working go back to the queue
+            conn.execute("UPDATE invoices SET state = ?, station = NULL WHERE state = ? AND updated < ?",
+                         (QUEUED, CLAIMED, now - CLAIM_TIMEOUT))
+            rows = conn.execute("SELECT seq, name FROM invoices WHERE state = ? ORDER BY seq LIMIT ?",
+                                (QUEUED, limit)).fetchall()
+            conn.executemany("UPDATE invoices SET state = ?, station = ?, updated = ? WHERE seq = ?",
+                             [(CLAIMED, self.station, now, seq) for seq, name in rows])
+        return [os.path.join(self.folder, name) for seq, name in rows]
+
+    def claimed(self, batch=CLAIM_BATCH):
+        """
+        Claim queued invoices batch at a time and yield their paths, until
+        none are left. Lazy: a renderer only claims what it is ready for
+        """
+        while True:
+            paths = self.claim(batch)
+            if not paths:
+                return
+            yield from paths
+
+    def rendered(self, path, data, total_pages, triplicate_count):
+        """
+        Leave a claimed invoice's triplicate PDF for the print station.
+        Returns False if the claim was lost meanwhile (another
+        workstation took it over); the PDF is then thrown away
+        """
+        name = os.path.basename(str(path))
+        os.makedirs(self.spool_folder, exist_ok=True)
+        fd, output = tempfile.mkstemp(prefix=f"{os.path.splitext(name)[0]}_", suffix=".pdf", dir=self.spool_folder)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE invoices SET state = ?, output = ?, total_pages = ?, triplicate_count = ?, rules = ?,"
+                " updated = ? WHERE name = ? AND state = ? AND station = ?",
+                (RENDERED, os.path.basename(output), total_pages, triplicate_count, self._rules_text, time.time(),
+                 name, CLAIMED, self.station))
+        if not cursor.rowcount:
+            _remove(output)
+            return False
+        return True
+
+    def skipped(self, path, reason, total_pages=None):
+        """
+        Record a claimed invoice the page rules leave out
+        """
+        self._finish(path, SKIPPED, reason, total_pages)
+
+    def failed(self, path, error):
+        """
+        Record a claimed invoice that could not be rendered
+        """
+        self._finish(path, FAILED, error)
+
+    def _finish(self, path, state, error, total_pages=None):
+        with self._transaction() as conn:
+            conn.execute("UPDATE invoices SET state = ?, error = ?, total_pages = ?, updated = ?"
+                         " WHERE name = ? AND state = ? AND station = ?",
+                         (state, error, total_pages, time.time(), os.path.basename(str(path)), CLAIMED,
+                          self.station))
+
+    def release_claims(self):
+        """
+        Put this workstation's unfinished claims back in the queue (on cancel or exit)
+        """
+        with self._transaction() as conn:
+            conn.execute("UPDATE invoices SET state = ?, station = NULL WHERE state = ? AND station = ?",
+                         (QUEUED, CLAIMED, self.station))
+
+    def become_print_station(self):
+        """
+        Make this workstation the print station; SharedQueueError if
+        another one is running
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT station, seen FROM stations WHERE role = 'print'").fetchone()
+            if row and row[0] != self.station and row[1] > now - STATION_TIMEOUT:
+                raise SharedQueueError(f"{row[0]} is already the print station for {self.folder}")
+            conn.execute("INSERT OR REPLACE INTO stations (role, station, seen) VALUES ('print', ?, ?)",
+                         (self.station, now))
+
+    def release_printing(self):
+        """
+        On a new print station, before it takes anything: the invoices
+        the last one left marked printing go back, to be printed from
+        their PDF if the spool folder still has it, queued otherwise.
+        They may have printed already, so only for an operator who has
+        checked the printer. Returns their names
+        """
+        released = []
+        with self._transaction() as conn:
+            rows = conn.execute("SELECT seq, name, output, size, mtime_ns FROM invoices WHERE state = ?"
+                                " ORDER BY seq", (PRINTING,)).fetchall()
+            for seq, name, output, size, mtime_ns in rows:
+                if output and os.path.exists(os.path.join(self.spool_folder, output)):
+                    conn.execute("UPDATE invoices SET state = ?, updated = ? WHERE seq = ?",
+                                 (RENDERED, time.time(), seq))
+                else:
+                    self._drop(conn, seq, output)
+                    self._insert(conn, name, size, mtime_ns)
+                released.append(name)
+        return released
+
+    def leave_print_station(self):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM stations WHERE role = 'print' AND station = ?", (self.station,))
+
+    def take_rendered(self, limit):
+        """
+        The print station's next rendered invoices (at most limit), in
+        queue order, marked printing. Invoices rendered by other rules
+        than the queue's go back to be rendered again. Also tells other
+        would-be print stations this one is still alive
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("UPDATE stations SET seen = ? WHERE role = 'print' AND station = ?", (now, self.station))
+            row = conn.execute("SELECT settings FROM rules WHERE id = 1").fetchone()
+            if row:
+                stray = conn.execute("SELECT seq, output FROM invoices WHERE state = ? AND rules IS NOT ?",
+                                     (RENDERED, row[0])).fetchall()
+                for seq, output in stray:
+                    _remove(os.path.join(self.spool_folder, output))
+                conn.executemany("UPDATE invoices SET state = ?, station = NULL, output = NULL, updated = ?"
+                                 " WHERE seq = ?", [(QUEUED, now, seq) for seq, output in stray])
+            rows = conn.execute("SELECT seq, name, output, total_pages, triplicate_count, station FROM invoices"
+                                " WHERE state = ? ORDER BY seq LIMIT ?", (RENDERED, limit)).fetchall()
+            conn.executemany("UPDATE invoices SET state = ?, updated = ? WHERE seq = ?",
+                             [(PRINTING, now, row[0]) for row in rows])
+        return [SharedInvoice(*row) for row in rows]
+
+    def output_path(self, invoice):
+        return os.path.join(self.spool_folder, invoice.output)
+
+    def printed(self, invoice, job_id=None):
+        with self._transaction() as conn:
+            conn.execute("UPDATE invoices SET state = ?, job_id = ?, updated = ? WHERE seq = ?",
+                         (PRINTED, job_id, time.time(), invoice.seq))
+
+    def print_failed(self, invoice, error):
+        with self._transaction() as conn:
+            conn.execute("UPDATE invoices SET state = ?, error = ?, updated = ? WHERE seq = ?",
+                         (FAILED, error, time.time(), invoice.seq))
+        _remove(self.output_path(invoice))
+
+    def counts(self):
+        """
+        Invoices per state
+        """
+        return dict(self.conn.execute("SELECT state, COUNT(*) FROM invoices GROUP BY state").fetchall())
+
+    def outstanding(self):
+        """
+        Invoices still on their way to the printer
+        """
+        counts = self.counts()
+        return sum(counts.get(state, 0) for state in OPEN_STATES)
+
+    def close(self):
+        self.conn.close()
+
+
+def _file_stamp(path):
+    """
+    (size, mtime_ns) of an invoice file, or (None, None) if it can't be read
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None, None
+    return st.st_size, st.st_mtime_ns
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Spool output optimisation
+An optional last pass over a print job before it is written:
+- Images are downsampled to the printer's resolution. Their size on
+  paper is read from the page's content stream and those of the Form
+  XObjects it draws, so the A5 fit (and a 2-up sheet) is taken into
+  account: a 600 dpi scan shrunk to 70% needs far fewer pixels than it
+  carries
+- Content streams, the forms' included, are Flate compressed
+- Fonts and images a page's (or form's) resources list but its content
+  never uses are dropped, and objects nothing refers to any more are
+  not written
+Downsampling needs Pillow (pip install pillow); without it the other
+steps still run
+"""
+
+import io
+import math
+import zlib
+
+from pypdf.generic import ContentStream, DictionaryObject, NameObject, NumberObject, StreamObject
+from page_sizes import DEFAULT_DPI
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Images with less than this much more resolution than needed are left alone
+DOWNSAMPLE_THRESHOLD = 1.25
+JPEG_QUALITY = 90
+
+# Resource kinds pruned to what the content stream uses, and the operator using them
+PRUNED_RESOURCES = {"/XObject": b"Do", "/Font": b"Tf"}
+
+# Colour spaces whose pixels Pillow can hand back unchanged
+IMAGE_MODES = {"/DeviceGray": "L", "/DeviceRGB": "RGB", "/DeviceCMYK": "CMYK"}
+
+# Forms drawn inside forms are followed this deep (a fitted page on a 2-up sheet is two)
+MAX_FORM_DEPTH = 4
+
+
+def _multiply(m, n):
+    """
+    Product of two PDF matrices [a b c d e f]: m applied first, then n
+    """
+    a, b, c, d, e, f = m
+    a2, b2, c2, d2, e2, f2 = n
+    return (a * a2 + b * c2, a * b2 + b * d2,
+            c * a2 + d * c2, c * b2 + d * d2,
+            e * a2 + f * c2 + e2, e * b2 + f * d2 + f2)
+
+
+def scan_content(page):
+    """
+    Return (used, placements) for a page's content stream, or a Form
+    XObject's (its /Matrix applied)
+    - used: {resource kind: names the content refers to}
+    - placements: {XObject name: (width, height)} largest size it is
+      drawn at, in points (in the units of whatever draws the form)
+    """
+    used = {kind: set() for kind in PRUNED_RESOURCES}
+    placements = {}
+    initial = (1, 0, 0, 1, 0, 0)
+    if isinstance(page, StreamObject):
+        reference = getattr(page, "indirect_reference", None)
+        content = ContentStream(page, reference.pdf if reference else None)
+        if "/Matrix" in page:
+            initial = tuple(float(value) for value in page["/Matrix"])
+    else:
+        content = page.get_contents()
+    if content is None:
+        return used, placements
+
+    matrix = initial
+    stack = []
+    for operands, operator in content.operations:
+        if operator == b"q":
+            stack.append(matrix)
+        elif operator == b"Q":
+            matrix = stack.pop() if stack else initial
+        elif operator == b"cm" and len(operands) == 6:
+            matrix = _multiply(tuple(float(value) for value in operands), matrix)
+        elif operator == b"Tf" and operands:
+            used["/Font"].add(operands[0])
+        elif operator == b"Do" and operands:
+            name = operands[0]
+            used["/XObject"].add(name)
+            a, b, c, d = matrix[:4]
+            width, height = math.hypot(a, b), math.hypot(c, d)
+            old_width, old_height = placements.get(name, (0, 0))
+            placements[name] = (max(width, old_width), max(height, old_height))
+    return used, placements
+
+
+class SpoolOptimizer:
+    """
+    Optimises the pages of a PdfWriter in place, just before it is written.
+    Picklable, so it can be handed to the render worker processes
+    """
+
+    def __init__(self, dpi=DEFAULT_DPI, downsample=True):
+        self.dpi = dpi
+        self.downsample = downsample and Image is not None
+
+    def optimize(self, writer):
+        """
+        Optimise every page of writer; returns counts of what was done
+        """
+        stats = {"images_downsampled": 0, "resources_removed": 0}
+        images = {}  # object number → (image object, widest and tallest placement)
+        forms = {}  # object number → a form's (used, placements): scanned once, however often drawn
+        for page in writer.pages:
+            used, placements = scan_content(page)
+            stats["resources_removed"] += self._prune(page, used)
+            for name, size in placements.items():
+                self._collect_image(page, name, size, images, forms, stats)
+            page.compress_content_streams()
+
+        if self.downsample:
+            for image, size in images.values():
+                if self._downsample(image, size):
+                    stats["images_downsampled"] += 1
+
+        remove_unreferenced(writer)
+        return stats
+
+    def _prune(self, page, used):
+        """
+        Give the page its own resource dictionaries holding only what
+        its content uses (the originals are often shared by every page
+        of the source invoice). Returns the number of entries dropped
+        """
+        resources = page.get("/Resources")
+        resources = resources.get_object() if resources is not None else None
+        if not isinstance(resources, DictionaryObject):
+            return 0
+        removed = 0
+        own = DictionaryObject(resources)
+        for kind, names in used.items():
+            entries = resources.get(kind)
+            entries = entries.get_object() if entries is not None else None
+            if not isinstance(entries, DictionaryObject):
+                continue
+            kept = DictionaryObject({key: entries.raw_get(key) for key in entries if key in names})
+            removed += len(entries) - len(kept)
+            own[NameObject(kind)] = kept
+        if removed:
+            page[NameObject("/Resources")] = own
+        return removed
+
+    def _collect_image(self, page, name, size, images, forms, stats, depth=0):
+        """
+        Note the size the image name on page is drawn at; a form is
+        followed to the images it draws, scaled by the size it is drawn at
+        """
+        xobjects = page["/Resources"].get_object().get("/XObject")
+        reference = xobjects.get_object().raw_get(name) if xobjects is not None else None
+        if reference is None or not hasattr(reference, "idnum"):
+            return
+        image = reference.get_object()
+        if not isinstance(image, StreamObject):
+            return
+        if image.get("/Subtype") == "/Form" and depth < MAX_FORM_DEPTH and "/Resources" in image:
+            scanned = forms.get(reference.idnum)
+            if scanned is None:
+                scanned = forms[reference.idnum] = scan_content(image)
+                stats["resources_removed"] += self._prune(image, scanned[0])
+                _compress(image)
+            for inner, (width, height) in scanned[1].items():
+                self._collect_image(image, inner, (width * size[0], height * size[1]), images, forms, stats,
+                                    depth + 1)
+            return
+        if image.get("/Subtype") != "/Image":
+            return
+        known = images.get(reference.idnum)
+        if known:
+            size = (max(size[0], known[1][0]), max(size[1], known[1][1]))
+        images[reference.idnum] = (image, size)
+
+    def _downsample(self, image, size):
+        """
+        Resample one image to self.dpi at the size it is printed;
+        True if it was replaced
+        """
+        width, height = int(image.get("/Width", 0)), int(image.get("/Height", 0))
+        target_width = max(int(math.ceil(size[0] / 72.0 * self.dpi)), 1)
+        target_height = max(int(math.ceil(size[1] / 72.0 * self.dpi)), 1)
+        # Both sides keep the resolution the more demanding one needs
+        scale = max(target_width / float(width or 1), target_height / float(height or 1))
+        if scale * DOWNSAMPLE_THRESHOLD > 1:
+            return False
+        # Masks, decode arrays and unusual colour spaces are left as they are
+        mode = IMAGE_MODES.get(image.get("/ColorSpace"))
+        if (mode is None or image.get("/BitsPerComponent") != 8
+                or any(key in image for key in ("/SMask", "/Mask", "/Decode", "/ImageMask"))):
+            return False
+        filters = image.get("/Filter")
+        jpeg = filters == "/DCTDecode"
+        if jpeg and mode == "CMYK":
+            return False  # Adobe CMYK JPEGs are stored inverted
+
+        new_size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+        try:
+            picture = self._decode(image, mode, jpeg, (width, height), new_size)
+        except Exception:
+            return False
+        if picture is None or picture.mode != mode:
+            return False
+        picture = picture.resize(new_size, Image.LANCZOS, reducing_gap=2.0)
+
+        if jpeg:
+            buffer = io.BytesIO()
+            picture.save(buffer, "JPEG", quality=JPEG_QUALITY)
+            data = buffer.getvalue()
+        else:
+            data = zlib.compress(picture.tobytes())
+        for key in ("/DecodeParms", "/Length"):
+            if key in image:
+                del image[key]
+        image[NameObject("/Filter")] = NameObject("/DCTDecode" if jpeg else "/FlateDecode")
+        image[NameObject("/Width")] = NumberObject(new_size[0])
+        image[NameObject("/Height")] = NumberObject(new_size[1])
+        image._data = data
+        if hasattr(image, "decoded_self"):
+            image.decoded_self = None
+        return True
+
+    def _decode(self, image, mode, jpeg, size, new_size):
+        """
+        The image's pixels as a Pillow image, straight from the stream
+        (pypdf's own page.images re-encodes every image as PNG first)
+        """
+        if jpeg:
+            picture = Image.open(io.BytesIO(image._data))
+            # Lets the JPEG decoder skip detail the new size doesn't need
+            picture.draft(mode, new_size)
+            return picture
+        if image.get("/Filter") not in ("/FlateDecode", None):
+            return None
+        data = image.get_data()  # Flate and predictors undone
+        if len(data) < size[0] * size[1] * len(mode):
+            return None
+        return Image.frombytes(mode, size, data)
+
+
+def _compress(form):
+    """
+    Flate compress a form's content stream, in place, unless it already is
+    """
+    if "/Filter" in form:
+        return
+    form._data = zlib.compress(form.get_data())
+    form[NameObject("/Filter")] = NameObject("/FlateDecode")
+    if hasattr(form, "decoded_self"):
+        form.decoded_self = None
+
+
+def remove_unreferenced(writer, max_passes=8):
+    """
+    Drop objects nothing in the document refers to any more (pypdf 4.3+).
+    pypdf drops one level per pass (a dropped resource dictionary still
+    counts as referring to its fonts), so passes repeat until nothing changes
+    """
+    if not hasattr(writer, "compress_identical_objects"):
+        return
+    live = None
+    for _ in range(max_passes):
+        try:
+            writer.compress_identical_objects(remove_duplicates=False, remove_unreferenced=True)
+        except TypeError:
+            # pypdf before 5.x names the options differently
+            writer.compress_identical_objects(remove_identicals=False, remove_orphans=True)
+        remaining = sum(1 for obj in writer._objects if obj is not None)
+        if remaining == live:
+            break
+        live = remaining
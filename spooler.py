@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+In-memory print submission and print-queue tracking
+Sends rendered PDF bytes straight to the print spooler over stdin
+(lp, or lpr where lp is missing), so nothing is written to the invoice
+folder. Windows can only print files, so there the bytes go to a
+temporary file on the local disk instead of the (network) invoice folder
+
+PrintQueue keeps the job IDs lp reports and polls lpstat, so callers
+are throttled by how many jobs are really waiting at the printer and
+temp files are removed as soon as their job has finished, instead of
+sleeping for a fixed time after every job
+
+Given an IppPrinter (see ipp_client) the queue talks to CUPS directly
+instead: Print-Job and Get-Job-Attributes over one kept-alive
+connection, with no process started per job or per poll. lp and lpstat
+take over if the IPP connection fails
+"""
+
+import http.client
+import os
+import platform
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+
+from ipp_client import FINISHED_JOB_STATES, STATUS_NOT_FOUND, IppError, IppNoAnswer
+
+LOCAL_TEMP_DIR = os.path.join(tempfile.gettempdir(), "invoice_printer")
+STALE_TEMP_AGE = 24 * 60 * 60  # seconds
+
+
+def spool_needs_file():
+    """
+    True where printing requires a file on disk (Windows)
+    """
+    return platform.system() == "Windows"
+
+
+def spool_command(title=None):
+    """
+    Command that prints a PDF read from stdin, or from files appended to it.
+    lp is preferred (macOS has it too) because it reports the job ID
+    """
+    if platform.system() == "Darwin" and not shutil.which("lp"):
+        return ["lpr"] + (["-T", title] if title else [])
+    return ["lp"] + (["-t", title] if title else [])
+
+
+def spool_bytes(data, title=None, timeout=30):
+    """
+    Pipe PDF bytes to the spooler. Returns its output (lp prints the job ID)
+    """
+    result = subprocess.run(spool_command(title), input=data, check=True,
+                            timeout=timeout, capture_output=True)
+    return result.stdout.decode(errors="replace")
+
+
+def write_local_temp(data, name):
+    """
+    Write PDF bytes to a uniquely named file in the local temp folder
+    """
+    os.makedirs(LOCAL_TEMP_DIR, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(name))[0]
+    fd, path = tempfile.mkstemp(prefix=f"{stem}_", suffix=".pdf", dir=LOCAL_TEMP_DIR)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return path
+
+
+def cleanup_stale_temp(max_age=STALE_TEMP_AGE):
+    """
+    Remove local temp files left behind by runs that crashed.
+    Returns the number of files removed
+    """
+    removed = 0
+    cutoff = time.time() - max_age
+    try:
+        entries = list(os.scandir(LOCAL_TEMP_DIR))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+_JOB_ID = re.compile(r"request id is (\S+)")
+
+DEFAULT_QUEUE_DEPTH = 4
+DEFAULT_POLL_INTERVAL = 1.0  # seconds between lpstat calls
+UNTRACKED_DELAY = 2.0  # seconds an untracked job counts against the queue depth
+CLEANUP_GRACE = 30.0  # seconds before deleting the temp file of an untracked job
+
+
+def parse_job_id(output):
+    """
+    Job ID from lp's "request id is Printer-123 (1 file(s))", or None
+    """
+    match = _JOB_ID.search(output or "")
+    return match.group(1) if match else None
+
+
+class PrintJob:
+    """
+    One submitted print job. job_id is None where the platform gives
+    no job ID (Windows, lpr); such jobs are timed instead of tracked
+    ipp_id is the number IPP returned for jobs sent over IPP
+    unknown: sent, but the spooler never said whether it took the job
+    """
+
+    def __init__(self, title, job_id=None, cleanup_path=None, ipp_id=None, unknown=False):
+        self.title = title
+        self.job_id = job_id
+        self.ipp_id = ipp_id
+        self.unknown = unknown
+        self.cleanup_path = cleanup_path
+        self.submitted = time.monotonic()
+        self.completed = None
+        self.queue_wait = None  # seconds spent waiting for room in the queue
+        self.spool_seconds = None  # seconds the spooler command took
+
+
+class PrintQueue:
+    """
+    Submit print jobs without more than max_queue_depth of them waiting
+    at the spooler at once
+    - submit_data / submit_file block until there is room in the queue
+    - Jobs with an ID are complete once lpstat no longer lists them, or
+      IPP reports them finished
+    - Temp files are deleted as soon as their job completes
+    print_file is the front end's own print_pdf, used where printing
+    needs a file and the platform's own print methods (Windows)
+    on_complete, if given, is called with each PrintJob as it completes
+    ipp, an IppPrinter, sends the jobs over IPP instead of through lp
+    """
+
+    def __init__(self, print_file=None, max_queue_depth=DEFAULT_QUEUE_DEPTH,
+                 poll_interval=DEFAULT_POLL_INTERVAL, log=None, on_complete=None, ipp=None):
+        if max_queue_depth < 1:
+            raise ValueError("max_queue_depth must be at least 1")
+        self.print_file = print_file
+        self.max_queue_depth = max_queue_depth
+        self.poll_interval = poll_interval
+        self.log = log or (lambda message: None)
+        self.on_complete = on_complete
+        self.ipp = ipp
+        self.active = []
+        self.cleanups = []  # (due time, path) for untracked jobs
+        self.completed_jobs = []
+        self.tracking = True  # cleared when lpstat isn't available
+        self._last_poll = 0.0
+
+    def submit_data(self, data, title):
+        """
+        Print PDF bytes; returns the PrintJob
+        """
+        queue_wait = self.wait_for_slot()
+        start = time.monotonic()
+        job = self._submit_ipp(data, title)
+        if job is None and spool_needs_file():
+            path = write_local_temp(data, title)
+            self.print_file(path)
+            job = PrintJob(title, cleanup_path=path)
+        elif job is None:
+            output = spool_bytes(data, title=title)
+            job = PrintJob(title, job_id=parse_job_id(output))
+        return self._add(job, queue_wait, start)
+
+    def submit_file(self, path, title, cleanup=False):
+        """
+        Print a PDF file, deleting it once printed if cleanup is set
+        """
+        queue_wait = self.wait_for_slot()
+        start = time.monotonic()
+        cleanup_path = path if cleanup else None
+        if spool_needs_file():
+            self.print_file(path)
+            return self._add(PrintJob(title, cleanup_path=cleanup_path), queue_wait, start)
+        if self.ipp:
+            with open(path, "rb") as f:
+                job = self._submit_ipp(f.read(), title)
+            if job:
+                job.cleanup_path = cleanup_path
+                return self._add(job, queue_wait, start)
+        result = subprocess.run(spool_command(title) + [path], check=True,
+                                timeout=30, capture_output=True)
+        job_id = parse_job_id(result.stdout.decode(errors="replace"))
+        return self._add(PrintJob(title, job_id=job_id, cleanup_path=cleanup_path), queue_wait, start)
+
+    def _submit_ipp(self, data, title):
+        # A PrintJob sent over IPP, or None to go through lp
+        if not self.ipp:
+            return None
+        try:
+            ipp_id = self.ipp.print_job(data, title)
+        except IppNoAnswer as e:
+            # Never sent again, through lp or otherwise: missing a print beats printing twice
+            self.log(f"  → {e}: the job may or may not print and is not sent again; using lp and lpstat from now on")
+            self.ipp.close()
+            self.ipp = None
+            return PrintJob(title, unknown=True)
+        except (IppError, http.client.HTTPException, OSError) as e:
+            self._drop_ipp(e)
+            return None
+        return PrintJob(title, job_id=self.ipp.job_name(ipp_id), ipp_id=ipp_id)
+
+    def _drop_ipp(self, error):
+        self.log(f"  → IPP printing failed ({error}), using lp and lpstat instead")
+        self.ipp.close()
+        self.ipp = None
+
+    def close(self):
+        """
+        Close the IPP connection, if any
+        """
+        if self.ipp:
+            self.ipp.close()
+
+    def _add(self, job, queue_wait=None, start=None):
+        job.queue_wait = queue_wait
+        if start is not None:
+            job.spool_seconds = job.submitted - start
+        if job.job_id is None or not self.tracking:
+            job.job_id = None
+            if job.cleanup_path:
+                self.cleanups.append((job.submitted + CLEANUP_GRACE, job.cleanup_path))
+                job.cleanup_path = None
+        self.active.append(job)
+        return job
+
+    def queued_job_ids(self):
+        """
+        IDs of the jobs the spooler has not finished yet
+        """
+        queued = set()
+        ask_lpstat = False
+        for job in self.active:
+            if not job.job_id:
+                continue
+            if job.ipp_id is None or not self.ipp:
+                # Sent through lp, or IPP was lost since: lpstat lists both by the same ID
+                ask_lpstat = True
+                continue
+            try:
+                if self.ipp.job_state(job.ipp_id) not in FINISHED_JOB_STATES:
+                    queued.add(job.job_id)
+            except IppError as e:
+                # Not found: the job is done and CUPS no longer keeps it
+                if e.status != STATUS_NOT_FOUND:
+                    self._drop_ipp(e)
+                    ask_lpstat = True
+            except (http.client.HTTPException, OSError) as e:
+                self._drop_ipp(e)
+                ask_lpstat = True
+        if ask_lpstat:
+            queued |= self.lpstat_job_ids()
+        return queued
+
+    def lpstat_job_ids(self):
+        """
+        IDs of the jobs lpstat lists as not finished
+        """
+        try:
+            result = subprocess.run(["lpstat", "-o"], capture_output=True, timeout=15)
+        except (OSError, subprocess.SubprocessError):
+            self.tracking = False
+            return set()
+        if result.returncode != 0:
+            self.tracking = False
+            return set()
+        lines = result.stdout.decode(errors="replace").splitlines()
+        return set(line.split()[0] for line in lines if line.strip())
+
+    def poll(self):
+        """
+        Mark finished jobs complete and run due cleanups
+        """
+        self._last_poll = time.monotonic()
+        queued = set()
+        if self.tracking and any(job.job_id for job in self.active):
+            queued = self.queued_job_ids()
+
+        now = time.monotonic()
+        for job in list(self.active):
+            if job.job_id and self.tracking:
+                done = job.job_id not in queued
+            else:
+                done = now - job.submitted >= UNTRACKED_DELAY
+                if job.cleanup_path:
+                    # Tracking was lost after submission: fall back to the grace period
+                    self.cleanups.append((job.submitted + CLEANUP_GRACE, job.cleanup_path))
+                    job.cleanup_path = None
+            if done:
+                self._complete(job)
+
+        for due, path in list(self.cleanups):
+            if now >= due:
+                self.cleanups.remove((due, path))
+                self._remove(path)
+
+    def _complete(self, job):
+        job.completed = time.monotonic()
+        self.active.remove(job)
+        self.completed_jobs.append(job)
+        if job.job_id:
+            self.log(f"  → Print job {job.job_id} ({job.title}) completed")
+        if job.cleanup_path:
+            self._remove(job.cleanup_path)
+        if self.on_complete:
+            self.on_complete(job)
+
+    def _remove(self, path):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            self.log(f"  → Warning: Could not delete {os.path.basename(path)}: {e}")
+
+    def _wait(self):
+        # Never ask lpstat more often than poll_interval
+        delay = self.poll_interval - (time.monotonic() - self._last_poll)
+        if delay > 0:
+            time.sleep(delay)
+        self.poll()
+
+    def wait_for_slot(self):
+        """
+        Block while the queue is full; returns the seconds spent waiting
+        """
+        start = time.monotonic()
+        while len(self.active) >= self.max_queue_depth:
+            self._wait()
+        return time.monotonic() - start
+
+    def pending_files(self):
+        return [job.cleanup_path for job in self.active if job.cleanup_path] + [path for due, path in self.cleanups]
+
+    def wait_all(self, timeout=None):
+        """
+        Wait until every job has completed and every temp file is gone.
+        Returns False if timeout (seconds) ran out first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.poll()
+        while self.active or self.cleanups:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            self._wait()
+        return True
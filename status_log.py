@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Bounded status log
+Keeps the GUI's status log at a fixed cost however long a run gets:
+- ring buffers hold the last messages of every kind (all, errors,
+  skipped), so the view can switch to errors or skips only without
+  searching the text widget
+- the full log goes to a spill file on the local disk, rotated once it
+  reaches SPILL_MAX_BYTES, with SPILL_BACKUPS older files kept
+"""
+
+import os
+import time
+from collections import deque
+
+LOG_DIR = os.path.join(os.path.expanduser("~"), ".invoice_printer", "logs")
+SPILL_FILENAME = "status.log"
+SPILL_MAX_BYTES = 5 * 1024 * 1024
+SPILL_BACKUPS = 3
+
+DEFAULT_MAX_LINES = 2000  # messages kept per kind
+
+# Message kinds, which are also the filters of the view
+ALL_MESSAGES = "all"
+ERROR_MESSAGES = "errors"
+SKIP_MESSAGES = "skipped"
+FILTERS = (ALL_MESSAGES, ERROR_MESSAGES, SKIP_MESSAGES)
+
+
+def message_kind(message):
+    """
+    ERROR_MESSAGES or SKIP_MESSAGES for messages that report one,
+    otherwise None; goes by the markers the printer's messages use
+    """
+    if "SKIPPED" in message:
+        return SKIP_MESSAGES
+    if "✗" in message or "Error" in message:
+        return ERROR_MESSAGES
+    return None
+
+
+class SpillFile:
+    """
+    A log file that is rotated (status.log → status.log.1 → ...) once it
+    reaches max_bytes. Gives up quietly if the disk won't take it: the
+    log view still works without it
+    """
+
+    def __init__(self, path, max_bytes=SPILL_MAX_BYTES, backups=SPILL_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file = None
+        self.size = 0
+        self.broken = False
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.size = self.file.tell()
+
+    def _rotate(self):
+        self.file.close()
+        self.file = None
+        for number in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{number}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{number + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def write(self, text):
+        if self.broken:
+            return
+        try:
+            if self.file is None:
+                self._open()
+            elif self.size >= self.max_bytes:
+                self._rotate()
+            self.file.write(text)
+            self.size += len(text.encode("utf-8"))
+        except OSError:
+            self.broken = True
+
+    def flush(self):
+        if self.file is not None and not self.broken:
+            try:
+                self.file.flush()
+            except OSError:
+                self.broken = True
+
+    def close(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+            self.file = None
+
+
+class StatusLog:
+    """
+    The last max_lines messages of each kind, plus the spill file.
+    add() is O(1); lines(kind) returns one ring buffer as it stands
+    """
+
+    def __init__(self, max_lines=DEFAULT_MAX_LINES, spill_path=None):
+        self.buffers = {kind: deque(maxlen=max_lines) for kind in FILTERS}
+        self.spill = SpillFile(spill_path) if spill_path else None
+
+    def add(self, message):
+        """
+        Record one message; returns its kind (see message_kind)
+        """
+        kind = message_kind(message)
+        self.buffers[ALL_MESSAGES].append(message)
+        if kind:
+            self.buffers[kind].append(message)
+        if self.spill:
+            self.spill.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {message.rstrip()}\n")
+        return kind
+
+    def lines(self, kind=ALL_MESSAGES):
+        return list(self.buffers[kind])
+
+    def clear(self):
+        """
+        Empty the ring buffers (a new run); the spill file keeps everything
+        """
+        for buffer in self.buffers.values():
+            buffer.clear()
+
+    def flush(self):
+        if self.spill:
+            self.spill.flush()
+
+    def close(self):
+        if self.spill:
+            self.spill.close()
@@ -0,0 +1,71 @@
+"""
+A streamed batch job holds one chunk at a time: its Python heap must
+not grow with the number of invoices
+"""
+
+import os
+import random
+import tracemalloc
+
+import pytest
+
+pytest.importorskip("pypdf")
+
+from pypdf import PdfReader
+
+from batch_spool import BatchSpoolJob
+from benchmark import PAGE_SIZES, make_invoice
+
+INVOICES = 20
+CHUNK_PAGES = 20
+# Peak traced heap of a streamed job, whatever its length: a chunk of CHUNK_PAGES and the reader of the invoice being added
+PEAK_BOUND = 8 * 1024 * 1024
+SOURCES = 10  # distinct invoice files, added round robin
+
+
+@pytest.fixture(scope="module")
+def sources(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("invoices")
+    rng = random.Random(1)
+    paths = []
+    for number in range(1, SOURCES + 1):
+        path = os.path.join(folder, f"C{number}.pdf")
+        # 1-4 pages, every third one with a 300 px image that doesn't compress
+        make_invoice(path, 1 + number % 4, PAGE_SIZES["a4"], 300 if number % 3 == 0 else 0, rng)
+        paths.append(path)
+    return paths
+
+
+def spool_peak(sources, invoices, stream=True):
+    """
+    Add invoices (opening each file afresh, as the engine does) to one
+    batch job; returns the peak traced heap and the chunks handed on
+    """
+    chunks = []
+    on_chunk = (lambda number, data: chunks.append(len(data))) if stream else None
+    tracemalloc.start()
+    try:
+        job = BatchSpoolJob(max_pages_per_chunk=CHUNK_PAGES, on_chunk=on_chunk)
+        for index in range(invoices):
+            path = sources[index % len(sources)]
+            job.add_invoice(os.path.basename(path), PdfReader(path).pages)
+        job.finish()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak, chunks
+
+
+def test_streamed_peak_stays_bounded(sources):
+    small_peak, small_chunks = spool_peak(sources, INVOICES)
+    large_peak, large_chunks = spool_peak(sources, INVOICES * 10)
+
+    assert len(large_chunks) > 5 * len(small_chunks)
+    assert small_peak < PEAK_BOUND
+    assert large_peak < PEAK_BOUND
+
+
+def test_whole_job_outgrows_the_bound(sources):
+    # The bound is tight enough to notice chunks that are kept instead of handed on
+    peak, _ = spool_peak(sources, INVOICES * 10, stream=False)
+    assert peak > PEAK_BOUND
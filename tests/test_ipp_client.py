@@ -0,0 +1,175 @@
+"""
+IppPrinter and PrintQueue against a small local IPP server: one kept-alive
+connection, a retry where the server had closed it, and no second copy
+of a job the server took without answering
+"""
+
+import socket
+import threading
+
+import pytest
+
+import spooler
+from ipp_client import (CHARSET, ENUM, GET_JOB_ATTRIBUTES, INTEGER, JOB_ATTRIBUTES, JOB_COMPLETED, JOB_PENDING,
+                        NATURAL_LANGUAGE, OPERATION_ATTRIBUTES, PRINT_JOB, IppNoAnswer, IppPrinter, decode_message,
+                        encode_message)
+from spooler import PrintQueue
+
+
+class StubIppServer:
+    """
+    Answers Print-Job with the next job ID and Get-Job-Attributes with
+    "completed", over raw sockets so it can misbehave like a real one
+    - close_after_answer: closes every kept-alive connection after one answer
+    - silent_job: the Print-Job (1, 2, ...) that is taken but never answered
+    """
+
+    def __init__(self, close_after_answer=False, silent_job=None):
+        self.close_after_answer = close_after_answer
+        self.silent_job = silent_job
+        self.operations = []
+        self.jobs = []  # the documents of every Print-Job received
+        self.connections = 0
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.port = self.listener.getsockname()[1]
+        self.stopped = threading.Event()
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while not self.stopped.is_set():
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return
+            self.connections += 1
+            with connection:
+                self._answer(connection)
+
+    def _answer(self, connection):
+        while True:
+            body = self._read_request(connection)
+            if body is None:
+                return
+            operation, request_id, _, data = decode_message(body)
+            self.operations.append(operation)
+            reply = [(OPERATION_ATTRIBUTES, [(CHARSET, "attributes-charset", "utf-8"),
+                                             (NATURAL_LANGUAGE, "attributes-natural-language", "en")])]
+            if operation == PRINT_JOB:
+                self.jobs.append(data)
+                if len(self.jobs) == self.silent_job:
+                    # Took the job and went quiet until the client gave up
+                    self.stopped.wait(5)
+                    return
+                reply.append((JOB_ATTRIBUTES, [(INTEGER, "job-id", len(self.jobs)), (ENUM, "job-state", JOB_PENDING)]))
+            elif operation == GET_JOB_ATTRIBUTES:
+                reply.append((JOB_ATTRIBUTES, [(ENUM, "job-state", JOB_COMPLETED)]))
+            payload = encode_message(0x0000, request_id, reply)
+            connection.sendall(b"HTTP/1.1 200 OK\r\nContent-Type: application/ipp\r\n"
+                               b"Content-Length: %d\r\n\r\n" % len(payload) + payload)
+            if self.close_after_answer:
+                return
+
+    @staticmethod
+    def _read_request(connection):
+        data = b""
+        while b"\r\n\r\n" not in data:
+            chunk = connection.recv(65536)
+            if not chunk:
+                return None
+            data += chunk
+        head, body = data.split(b"\r\n\r\n", 1)
+        length = next(int(line.split(b":", 1)[1]) for line in head.split(b"\r\n")
+                      if line.lower().startswith(b"content-length:"))
+        while len(body) < length:
+            chunk = connection.recv(65536)
+            if not chunk:
+                return None
+            body += chunk
+        return body
+
+    def stop(self):
+        self.stopped.set()
+        self.listener.close()
+
+
+@pytest.fixture
+def ipp_server():
+    servers = []
+
+    def start(**behaviour):
+        servers.append(StubIppServer(**behaviour))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def lp_calls(monkeypatch):
+    # Jobs that went to lp instead; lpstat must never be needed
+    calls = []
+
+    def spool_bytes(data, title=None, timeout=30):
+        calls.append(title)
+        return f"request id is stub-{len(calls)} (1 file(s))"
+
+    monkeypatch.setattr(spooler, "spool_bytes", spool_bytes)
+    monkeypatch.setattr(spooler, "spool_needs_file", lambda: False)
+    monkeypatch.setattr(PrintQueue, "lpstat_job_ids", lambda self: set())
+    return calls
+
+
+def test_jobs_and_polls_share_one_connection(ipp_server, lp_calls):
+    server = ipp_server()
+    queue = PrintQueue(ipp=IppPrinter(printer="stub", port=server.port, timeout=5), poll_interval=0.01)
+    jobs = [queue.submit_data(b"%PDF-1.4 " + bytes([number]), f"C{number}") for number in (1, 2, 3)]
+    assert queue.wait_all(timeout=5)
+    queue.close()
+
+    assert [job.ipp_id for job in jobs] == [1, 2, 3]
+    assert [job.job_id for job in jobs] == ["stub-1", "stub-2", "stub-3"]
+    assert server.jobs == [b"%PDF-1.4 \x01", b"%PDF-1.4 \x02", b"%PDF-1.4 \x03"]
+    assert GET_JOB_ATTRIBUTES in server.operations
+    assert server.connections == 1
+    assert lp_calls == []
+
+
+def test_closed_keep_alive_connection_is_retried(ipp_server):
+    server = ipp_server(close_after_answer=True)
+    printer = IppPrinter(printer="stub", port=server.port, timeout=5)
+    try:
+        job_ids = [printer.print_job(b"%PDF-1.4", f"C{number}") for number in (1, 2, 3)]
+    finally:
+        printer.close()
+
+    # Each job sent once, each on a new connection
+    assert job_ids == [1, 2, 3]
+    assert len(server.jobs) == 3
+    assert server.connections == 3
+
+
+def test_unanswered_print_job_is_not_sent_again(ipp_server, lp_calls):
+    server = ipp_server(silent_job=2)
+    log = []
+    queue = PrintQueue(ipp=IppPrinter(printer="stub", port=server.port, timeout=0.5), log=log.append)
+    first = queue.submit_data(b"%PDF-1.4", "C1")
+    second = queue.submit_data(b"%PDF-1.4", "C2")
+    third = queue.submit_data(b"%PDF-1.4", "C3")
+
+    assert first.ipp_id == 1 and not first.unknown
+    assert second.unknown and second.job_id is None
+    # C2 reached the server once and went nowhere else; C3 went through lp once IPP was dropped
+    assert len(server.jobs) == 2
+    assert lp_calls == ["C3"]
+    assert third.job_id == "stub-1"
+    assert queue.ipp is None
+    assert any("not sent again" in message for message in log)
+
+
+def test_print_job_without_answer_raises(ipp_server):
+    server = ipp_server(silent_job=1)
+    printer = IppPrinter(printer="stub", port=server.port, timeout=0.5)
+    with pytest.raises(IppNoAnswer):
+        printer.print_job(b"%PDF-1.4", "C1")
+    assert len(server.jobs) == 1
@@ -0,0 +1,140 @@
+"""
+PrintQueue against stub lp and lpstat commands: lp takes the job and
+reports its ID, lpstat lists the jobs the test has not finished yet
+"""
+
+import os
+import platform
+import threading
+import time
+
+import pytest
+
+import spooler
+from spooler import PrintQueue, parse_job_id
+
+pytestmark = pytest.mark.skipif(platform.system() == "Windows", reason="stub spooler commands are shell scripts")
+
+# Every job goes into the queue file, where lpstat lists it until the test finishes it
+STUB_LP = """#!/bin/sh
+case "$*" in *.pdf) ;; *) cat > /dev/null ;; esac
+count=$(( $(cat "$STUB_SPOOL/count" 2>/dev/null || echo 0) + 1 ))
+echo $count > "$STUB_SPOOL/count"
+echo "stub-$count" >> "$STUB_SPOOL/queue"
+echo "request id is stub-$count (1 file(s))"
+"""
+
+STUB_LPSTAT = """#!/bin/sh
+[ -f "$STUB_SPOOL/fail" ] && exit 1
+[ -f "$STUB_SPOOL/queue" ] || exit 0
+while read job; do echo "$job user 1024 Sat 17 Oct 2026 10:00:00"; done < "$STUB_SPOOL/queue"
+"""
+
+
+class StubSpooler:
+    def __init__(self, folder):
+        self.folder = folder
+
+    def queued(self):
+        path = os.path.join(self.folder, "queue")
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            return f.read().split()
+
+    def finish(self, job_id):
+        # The printer is done with the job: lpstat stops listing it
+        # Replaced whole, so an lpstat running meanwhile never reads half a file
+        left = [job for job in self.queued() if job != job_id]
+        path = os.path.join(self.folder, "queue")
+        with open(path + ".new", "w") as f:
+            f.writelines(f"{job}\n" for job in left)
+        os.replace(path + ".new", path)
+
+    def fail_lpstat(self):
+        open(os.path.join(self.folder, "fail"), "w").close()
+
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    for name, script in (("lp", STUB_LP), ("lpstat", STUB_LPSTAT)):
+        path = tmp_path / name
+        path.write_text(script)
+        path.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ.get('PATH', '')}")
+    monkeypatch.setenv("STUB_SPOOL", str(tmp_path))
+    monkeypatch.setattr(spooler.platform, "system", lambda: "Linux")
+    return StubSpooler(str(tmp_path))
+
+
+def test_parse_job_id():
+    assert parse_job_id("request id is Office-123 (1 file(s))") == "Office-123"
+    assert parse_job_id("lpr: no output") is None
+    assert parse_job_id("") is None
+    assert parse_job_id(None) is None
+
+
+def test_job_completes_once_lpstat_stops_listing_it(stub):
+    queue = PrintQueue(poll_interval=0.05)
+    job = queue.submit_data(b"%PDF-1.4", "C1")
+    assert job.job_id == "stub-1"
+
+    queue.poll()
+    assert queue.active == [job]
+
+    stub.finish("stub-1")
+    queue.poll()
+    assert queue.active == []
+    assert queue.completed_jobs == [job]
+    assert job.completed is not None
+
+
+def test_queue_depth_throttles_submission(stub):
+    queue = PrintQueue(max_queue_depth=2, poll_interval=0.05)
+    queue.submit_data(b"%PDF-1.4", "C1")
+    queue.submit_data(b"%PDF-1.4", "C2")
+
+    finisher = threading.Timer(0.5, stub.finish, ["stub-1"])
+    finisher.start()
+    try:
+        third = queue.submit_data(b"%PDF-1.4", "C3")
+    finally:
+        finisher.join()
+
+    # Held back until the printer had finished the first job
+    assert third.queue_wait >= 0.4
+    assert [job.job_id for job in queue.active] == ["stub-2", "stub-3"]
+    assert stub.queued() == ["stub-2", "stub-3"]
+
+
+def test_temp_file_is_removed_as_soon_as_its_job_completes(stub, tmp_path):
+    first, second = tmp_path / "C1.pdf", tmp_path / "C2.pdf"
+    for path in (first, second):
+        path.write_bytes(b"%PDF-1.4")
+    queue = PrintQueue(poll_interval=0.05)
+    queue.submit_file(str(first), "C1", cleanup=True)
+    queue.submit_file(str(second), "C2", cleanup=True)
+
+    stub.finish("stub-1")
+    queue.poll()
+    assert not first.exists()
+    assert second.exists()
+    assert queue.pending_files() == [str(second)]
+
+    stub.finish("stub-2")
+    assert queue.wait_all(timeout=5)
+    assert not second.exists()
+
+
+def test_untracked_jobs_are_timed_when_lpstat_fails(stub, monkeypatch):
+    monkeypatch.setattr(spooler, "UNTRACKED_DELAY", 0.2)
+    stub.fail_lpstat()
+    queue = PrintQueue(poll_interval=0.05)
+    job = queue.submit_data(b"%PDF-1.4", "C1")
+
+    queue.poll()
+    assert not queue.tracking
+    assert queue.active == [job]
+
+    assert queue.wait_all(timeout=5)
+    assert queue.completed_jobs == [job]
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Watch-folder mode
+Prints new {prefix}{number}.pdf invoices as they arrive instead of in
+one burst at the end of the day
+- Linux: inotify wakes the watcher as soon as a file is written; a full
+  listing still runs every rescan_interval in case events were missed
+  (network shares often deliver none)
+- Elsewhere: the folder is listed with os.scandir every poll_interval
+A file is only printed once its size and modification time have stayed
+the same for settle seconds, so half-copied invoices are never read.
+The high-water mark of every prefix is saved in the invoice folder, so
+a restart neither reprints old invoices nor misses ones that arrived
+while it was down
+"""
+
+import ctypes
+import ctypes.util
+import json
+import os
+import platform
+import select
+import struct
+import time
+
+from invoice_index import InvoiceIndex, invoice_digits
+
+STATE_FILENAME = ".invoice_printer_watch.json"
+
+DEFAULT_SETTLE = 2.0  # seconds a file must stay unchanged
+DEFAULT_POLL_INTERVAL = 5.0  # seconds between listings without inotify
+DEFAULT_RESCAN_INTERVAL = 60.0  # seconds between safety listings with inotify
+
+# Numbers printed above the mark are remembered individually, up to this many
+MAX_PRINTED_ABOVE_MARK = 10000
+
+
+class WatchState:
+    """
+    Persisted progress per prefix: every number up to "mark" is done,
+    plus the numbers above it that were printed out of order
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.prefixes = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                for prefix, entry in json.load(f).items():
+                    self.prefixes[prefix] = {"mark": int(entry["mark"]), "printed": set(entry.get("printed", []))}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            raise ValueError(f"Can't read watch state {path}: {e}")
+
+    @classmethod
+    def for_folder(cls, folder):
+        return cls(os.path.join(str(folder), STATE_FILENAME))
+
+    def has(self, prefix):
+        return prefix in self.prefixes
+
+    def start(self, prefix, mark):
+        """
+        Begin watching a prefix: everything up to mark counts as done
+        """
+        self.prefixes[prefix] = {"mark": mark, "printed": set()}
+        self.save()
+
+    def mark(self, prefix):
+        return self.prefixes[prefix]["mark"]
+
+    def is_done(self, prefix, number):
+        entry = self.prefixes[prefix]
+        return number <= entry["mark"] or number in entry["printed"]
+
+    def done(self, prefix, number):
+        """
+        Record one invoice as handled and move the mark up over any
+        now-contiguous numbers
+        """
+        entry = self.prefixes[prefix]
+        entry["printed"].add(number)
+        while entry["mark"] + 1 in entry["printed"]:
+            entry["mark"] += 1
+            entry["printed"].discard(entry["mark"])
+        if len(entry["printed"]) > MAX_PRINTED_ABOVE_MARK:
+            # Numbers that never arrived would otherwise pin the mark forever
+            entry["mark"] = min(entry["printed"])
+            entry["printed"].discard(entry["mark"])
+        self.save()
+
+    def save(self):
+        # Write-then-rename, so a crash never leaves half a state file
+        data = {prefix: {"mark": entry["mark"], "printed": sorted(entry["printed"])}
+                for prefix, entry in self.prefixes.items()}
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+
+class _Inotify:
+    """
+    Minimal inotify binding (Linux only, through ctypes): wait() returns
+    the names of files that were written or moved into the folder
+    """
+
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self, folder):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | getattr(os, "O_CLOEXEC", 0))
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE | self.IN_MODIFY
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed")
+
+    def wait(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        names = set()
+        if not readable:
+            return names
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + self._EVENT.size <= len(data):
+                wd, mask, cookie, length = self._EVENT.unpack_from(data, offset)
+                offset += self._EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                if name:
+                    names.add(os.fsdecode(name))
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_inotify(folder):
+    """
+    An inotify watch on folder, or None where inotify isn't available
+    """
+    if platform.system() != "Linux":
+        return None
+    try:
+        return _Inotify(folder)
+    except (OSError, AttributeError):
+        return None
+
+
+class FolderWatcher:
+    """
+    Calls on_ready(prefix, number, path) once for every new invoice,
+    in number order per listing, after it has settled
+    """
+
+    def __init__(self, folder, prefixes, on_ready, state=None, settle=DEFAULT_SETTLE,
+                 poll_interval=DEFAULT_POLL_INTERVAL, rescan_interval=DEFAULT_RESCAN_INTERVAL,
+                 use_inotify=True, log=print):
+        self.folder = str(folder)
+        self.prefixes = list(prefixes)
+        self.on_ready = on_ready
+        self.state = state or WatchState.for_folder(folder)
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.log = log
+        self.inotify = open_inotify(self.folder) if use_inotify else None
+        self.pending = {}  # name → (prefix, number, size, mtime_ns, unchanged since)
+
+    def start(self, start_numbers=None):
+        """
+        Set the mark of prefixes seen for the first time: start_numbers
+        maps prefix → first number to print; without one, everything
+        already in the folder counts as done
+        """
+        index = InvoiceIndex(self.folder)
+        for prefix in self.prefixes:
+            if self.state.has(prefix):
+                self.log(f"Watching {prefix or '(no prefix)'}: resuming after {prefix}{self.state.mark(prefix)}")
+                continue
+            first = (start_numbers or {}).get(prefix)
+            if first is None:
+                first = max(index.numbers(prefix), default=0) + 1
+            self.state.start(prefix, first - 1)
+            self.log(f"Watching {prefix or '(no prefix)'}: printing from {prefix}{first}")
+
+    def _match(self, name):
+        """
+        (prefix, number) of a new invoice file name, or None
+        """
+        # Longest prefix first, so "CN" files don't count as "C"
+        for prefix in sorted(self.prefixes, key=len, reverse=True):
+            digits = invoice_digits(name, prefix)
+            if digits is not None:
+                number = int(digits)
+                if not self.state.is_done(prefix, number):
+                    return prefix, number
+                return None
+        return None
+
+    def _consider(self, names, now):
+        for name in names:
+            match = self._match(name)
+            if match is None:
+                self.pending.pop(name, None)
+                continue
+            try:
+                st = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                self.pending.pop(name, None)
+                continue
+            known = self.pending.get(name)
+            if known and known[2] == st.st_size and known[3] == st.st_mtime_ns:
+                continue
+            # New or still being written: restart its settle time
+            self.pending[name] = (match[0], match[1], st.st_size, st.st_mtime_ns, now)
+
+    def _ready(self, now):
+        ready = []
+        for name, (prefix, number, size, mtime_ns, since) in list(self.pending.items()):
+            if now - since < self.settle:
+                continue
+            try:
+                st = os.stat(os.path.join(self.folder, name))
+            except OSError:
+                del self.pending[name]
+                continue
+            if st.st_size != size or st.st_mtime_ns != mtime_ns:
+                self.pending[name] = (prefix, number, st.st_size, st.st_mtime_ns, now)
+            elif size > 0:
+                ready.append((prefix, number, name))
+        return sorted(ready)
+
+    def scan(self):
+        return InvoiceIndex(self.folder).names
+
+    def next_timeout(self, now):
+        """
+        Seconds until the next settled file or listing is due
+        """
+        timeout = self.rescan_interval if self.inotify else self.poll_interval
+        if self.pending:
+            soonest = min(entry[4] for entry in self.pending.values()) + self.settle - now
+            timeout = min(timeout, max(soonest, 0.05))
+        return timeout
+
+    def run(self, stop=None):
+        """
+        Watch until stop (a threading.Event) is set or Ctrl+C
+        """
+        self.log(f"Watching {self.folder} ({'inotify' if self.inotify else 'polling'}); press Ctrl+C to stop")
+        last_scan = time.monotonic()
+        self._consider(self.scan(), last_scan)
+        try:
+            while not (stop and stop.is_set()):
+                now = time.monotonic()
+                timeout = self.next_timeout(now)
+                if self.inotify:
+                    changed = self.inotify.wait(timeout)
+                else:
+                    time.sleep(timeout)
+                    changed = set()
+
+                now = time.monotonic()
+                interval = self.rescan_interval if self.inotify else self.poll_interval
+                if now - last_scan >= interval:
+                    changed = set(self.scan())
+                    last_scan = now
+                self._consider(changed, now)
+
+                for prefix, number, name in self._ready(now):
+                    del self.pending[name]
+                    # on_ready reports its own failures: a bad invoice is
+                    # reported once, not retried in a loop
+                    self.on_ready(prefix, number, os.path.join(self.folder, name))
+                    self.state.done(prefix, number)
+        finally:
+            if self.inotify:
+                self.inotify.close()